@@ -1,17 +1,90 @@
 """GM/PLエージェント"""
 import os
-from anthropic import Anthropic
-from openai import OpenAI
-from google import genai
-from google.genai import types
+import re
+import json
+import time
+import asyncio
+import hashlib
+import contextlib
+import weakref
+import importlib
+import functools
 import config
+import llm_cache
+import metrics
+import hedging
+import mock_provider
+from scheduler import get_scheduler
+from message_buffer import MessageAdapter, convert_messages
+from tokens import estimate_tokens, input_tokens, fit_max_tokens
 
-# クライアント初期化
-claude_client = Anthropic()
-openai_client = OpenAI()
-google_client = None
-if config.GOOGLE_API_KEY:
-    google_client = genai.Client(api_key=config.GOOGLE_API_KEY)
+# プロバイダーSDKは初回使用時に import する（使わないSDKの読み込みで起動を遅くしないため）
+# プロバイダー名 -> (import するモジュール, インストールするパッケージ名)
+PROVIDER_SDKS = {
+    "anthropic": ("anthropic", "anthropic"),
+    "openai": ("openai", "openai"),
+    "google": ("google.genai", "google-genai"),
+}
+
+
+@functools.cache
+def _sdk(provider: str):
+    """プロバイダーのSDKモジュールを初回のみ import して返す"""
+    module_name, package = PROVIDER_SDKS[provider]
+    try:
+        return importlib.import_module(module_name)
+    except ImportError as e:
+        raise ImportError(f"{provider} を使うには {package} をインストールしてください（pip install {package}）") from e
+
+
+def _genai_types():
+    """google.genai.types（Gemini のリクエスト組み立て用）"""
+    _sdk("google")
+    return importlib.import_module("google.genai.types")
+
+
+def _http_limits():
+    """全キャンペーンで共有するコネクションプールの上限"""
+    import httpx
+    return httpx.Limits(max_connections=config.HTTP_MAX_CONNECTIONS, max_keepalive_connections=config.HTTP_MAX_CONNECTIONS)
+
+
+# 再試行は scheduler が一元管理するので、SDK側の再試行は無効にする
+def _new_anthropic_client():
+    anthropic = _sdk("anthropic")
+    return anthropic.AsyncAnthropic(max_retries=0, http_client=anthropic.DefaultAsyncHttpxClient(limits=_http_limits()))
+
+
+def _new_openai_client():
+    openai = _sdk("openai")
+    return openai.AsyncOpenAI(max_retries=0, http_client=openai.DefaultAsyncHttpxClient(limits=_http_limits()))
+
+
+def _new_google_client():
+    if not config.GOOGLE_API_KEY:
+        raise ValueError("Google API Key is not set.")
+    return _sdk("google").Client(api_key=config.GOOGLE_API_KEY).aio
+
+
+# プロバイダー名 -> 非同期クライアントを生成する関数
+CLIENT_FACTORIES = {
+    "anthropic": _new_anthropic_client,
+    "openai": _new_openai_client,
+    "google": _new_google_client,
+}
+
+# クライアントはイベントループごとに生成する（非同期HTTPクライアントはループをまたいで使えないため）
+_clients_by_loop = weakref.WeakKeyDictionary()
+
+
+def get_client(provider: str):
+    """実行中のイベントループに紐づくプロバイダーの非同期クライアントを取得（初回のみ生成）"""
+    clients = _clients_by_loop.setdefault(asyncio.get_running_loop(), {})
+    if provider not in clients:
+        if provider not in CLIENT_FACTORIES:
+            raise ValueError(f"Unknown provider: {provider}")
+        clients[provider] = CLIENT_FACTORIES[provider]()
+    return clients[provider]
 
 
 def load_file(filepath: str) -> str:
@@ -20,14 +93,24 @@ def load_file(filepath: str) -> str:
         return f.read()
 
 
-# ルールブック読み込み
-RULEBOOK = load_file("rulebook.md")
+# === プロンプト ===
+# ルールブックを埋め込むプロンプトは初回参照時に組み立ててメモ化する（agents.GM_SYSTEM_PROMPT のように参照できる）
+
+# 読み込みは遅延しても、パスは import 時のカレントディレクトリ基準で決めておく
+RULEBOOK_PATH = os.path.abspath("rulebook.md")
+
+
+def _rulebook() -> str:
+    """ルールブック読み込み"""
+    return load_file(RULEBOOK_PATH)
+
 
-# GMのシステムプロンプト
-GM_SYSTEM_PROMPT = f"""あなたはテキストTRPGのゲームマスター（GM）です。目的は「短い入力でテンポよく遊べる」こと。
+def _gm_system_prompt() -> str:
+    """GMのシステムプロンプト"""
+    return f"""あなたはテキストTRPGのゲームマスター（GM）です。目的は「短い入力でテンポよく遊べる」こと。
 以下のルールを優先し、ルール外の創作は"状況描写"の範囲でのみ行う。
 
-{RULEBOOK}
+{get_prompt("RULEBOOK")}
 
 # 開始手順
 PC情報とシナリオ設定は最初のメッセージで与えられます。
@@ -38,13 +121,15 @@ PC情報とシナリオ設定は最初のメッセージで与えられます。
 - PLの失敗を許容する。たとえPCが失敗したり死亡したりしても、PLによるPCの選択を活かして、物語としての美しさを優先する。
 """
 
-# PLのシステムプロンプト
-PL_SYSTEM_PROMPT = f"""あなたはテキストTRPGのプレイヤー（PL）です。
+
+def _pl_system_prompt() -> str:
+    """PLのシステムプロンプト"""
+    return f"""あなたはテキストTRPGのプレイヤー（PL）です。
 
 # ルールブック
 以下のルールを理解した上でプレイしてください：
 
-{RULEBOOK}
+{get_prompt("RULEBOOK")}
 
 # あなたの役割
 - GMの描写を受けて、PCとして行動を宣言する
@@ -75,12 +160,14 @@ PL_SYSTEM_PROMPT = f"""あなたはテキストTRPGのプレイヤー（PL）で
 
 """
 
-# PL用：シナリオ生成プロンプト
-PL_SCENARIO_GEN_PROMPT = f"""あなたはテキストTRPGのプレイヤー（PL）です。
+
+def _pl_scenario_gen_prompt() -> str:
+    """PL用：シナリオ生成プロンプト"""
+    return f"""あなたはテキストTRPGのプレイヤー（PL）です。
 これからゲームを始めるにあたり、PC（プレイヤーキャラクター）を作成し、最初のセッションの状況を設定してください。
 
 # ルールブック
-{RULEBOOK}
+{get_prompt("RULEBOOK")}
 
 # 応答フォーマット（必須）
 以下の形式で,700字以内で応答してください：
@@ -98,6 +185,51 @@ PL_SCENARIO_GEN_PROMPT = f"""あなたはテキストTRPGのプレイヤー（PL
 - 初期所持品（3〜5個）:
 """
 
+
+def _core_save_fields() -> str:
+    """ルールブックの「1. コアセーブ」の項目一覧を取り出す"""
+    match = re.search(r"^## 1\..*?\n(.*?)(?=^## )", get_prompt("RULEBOOK"), re.MULTILINE | re.DOTALL)
+    return match.group(1).strip() if match else ""
+
+
+def _history_summary_prompt() -> str:
+    """履歴圧縮用：古いターンをコアセーブ＋あらすじに畳み込むプロンプト"""
+    return f"""あなたはテキストTRPGの記録係です。
+これまでのプレイ記録（以前の要約を含む場合があります）を、以降の進行に必要な情報を失わないように圧縮してください。
+数値（HP/SP/Tension）や所持品は最新の状態を正確に書き写してください。
+
+# 応答フォーマット（必須）
+
+【コアセーブ】
+{_core_save_fields()}
+
+【これまでのあらすじ】
+（重要な出来事・登場したNPC・未回収の伏線を時系列で、800字以内）
+"""
+
+
+_PROMPT_BUILDERS = {
+    "RULEBOOK": _rulebook,
+    "GM_SYSTEM_PROMPT": _gm_system_prompt,
+    "PL_SYSTEM_PROMPT": _pl_system_prompt,
+    "PL_SCENARIO_GEN_PROMPT": _pl_scenario_gen_prompt,
+    "HISTORY_SUMMARY_PROMPT": _history_summary_prompt,
+}
+
+
+@functools.cache
+def get_prompt(name: str) -> str:
+    """プロンプトを名前で取得（初回のみ組み立て、以降は同じ文字列を返す）"""
+    return _PROMPT_BUILDERS[name]()
+
+
+def __getattr__(name: str):
+    # モジュール属性としての参照（agents.RULEBOOK など）を遅延評価する
+    if name in _PROMPT_BUILDERS:
+        return get_prompt(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 # PL用：次回フック選択プロンプト
 PL_NEXT_HOOK_PROMPT = """セッションが終了しました。
 GMから提示された「次回フック」を踏まえて、次のセッションで何をしたいか選択・提案してください。
@@ -145,127 +277,694 @@ PL_SESSION_FEEDBACK_PROMPT = """セッションが終了しました。今回の
 """
 
 
-def call_llm(provider: str, model: str, system_prompt: str, messages: list, max_tokens: int = 1000) -> str:
-    """汎用LLM呼び出し関数"""
+class StreamAborted(Exception):
+    """on_chunk から送出すると、ストリーミング中の生成を打ち切る（受信済みの応答は破棄される）"""
+    
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CallStats:
+    """1回のLLM呼び出しの計測値"""
+    
+    def __init__(self):
+        self.provider = ""
+        self.model = ""
+        self.streamed = False
+        self.ttft = None  # 最初のトークンが届くまでの秒数（非ストリーミング時は応答時間と同じ）
+        self.latency = None  # 応答完了までの秒数
+        self.input_tokens = 0  # 入力トークン数（キャッシュ分を含む）
+        self.cached_tokens = 0  # うちキャッシュから読み込まれたトークン数（キャッシュヒット）
+        self.cache_write_tokens = 0  # うちキャッシュに書き込まれたトークン数（Anthropicのみ）
+        self.output_tokens = 0
+        self.replayed = False  # 記録/再生キャッシュから返した（APIを呼んでいない）
+        self.queue_wait = 0.0  # レート制限・再試行で待った秒数
+        self.retries = 0  # 再試行の回数
+        self.aborted = False  # StreamAborted で生成を打ち切った（トークン数は受信済みの分からの推定値）
+        self.route = None  # モデルの振り分け結果（routing.Route。振り分けなしなら None）
+        self.hedge = None  # 予備のリクエストを送った場合に使った方（"primary" / "backup"。送っていなければ None）
+        self.batch = None  # バッチAPIで実行した場合のバッチID
+    
+    @property
+    def uncached_tokens(self) -> int:
+        """キャッシュミスとなった入力トークン数"""
+        return self.input_tokens - self.cached_tokens
+    
+    def summary(self) -> str:
+        if self.replayed:
+            text = f"記録済み応答を再生 / 応答時間: {self.latency:.2f}s"
+        elif self.aborted:
+            text = f"生成を中断 / TTFT: {self.ttft:.2f}s / 応答時間: {self.latency:.2f}s / 出力: 約{self.output_tokens} tokens（推定）"
+        else:
+            if self.batch is not None:
+                text = f"バッチAPI: {self.batch} / 完了まで: {self.latency:.0f}s"
+            else:
+                text = f"TTFT: {self.ttft:.2f}s / 応答時間: {self.latency:.2f}s"
+            if self.input_tokens:
+                text += f" / 入力: {self.input_tokens} tokens (キャッシュ hit {self.cached_tokens} / miss {self.uncached_tokens}) / 出力: {self.output_tokens} tokens"
+            if self.retries or self.queue_wait >= 0.01:
+                text += f" / 待機: {self.queue_wait:.2f}s / 再試行: {self.retries}回"
+        if self.hedge == "backup":
+            text += f" / ヘッジ: 予備のリクエスト（{self.provider} / {self.model}）の応答を使用"
+        elif self.hedge == "primary":
+            text += " / ヘッジ: 予備のリクエストを送信（元のリクエストの応答を使用）"
+        if self.route is not None:
+            text += f" / モデル: {self.route.describe()}"
+        return text
+
+
+def _record_usage(stats: CallStats | None, provider: str, usage):
+    """プロバイダーごとのusageをCallStatsに記録"""
+    if stats is None or usage is None:
+        return
     if provider == "anthropic":
-        response = claude_client.messages.create(
+        cached = usage.cache_read_input_tokens or 0
+        written = usage.cache_creation_input_tokens or 0
+        stats.input_tokens = usage.input_tokens + cached + written
+        stats.cached_tokens = cached
+        stats.cache_write_tokens = written
+        stats.output_tokens = usage.output_tokens
+    elif provider == "openai":
+        details = usage.prompt_tokens_details
+        stats.input_tokens = usage.prompt_tokens
+        stats.cached_tokens = (details.cached_tokens or 0) if details else 0
+        stats.output_tokens = usage.completion_tokens
+    elif provider == "google":
+        stats.input_tokens = usage.prompt_token_count or 0
+        stats.cached_tokens = usage.cached_content_token_count or 0
+        stats.output_tokens = usage.candidates_token_count or 0
+    elif provider == "mock":
+        stats.input_tokens, stats.output_tokens = usage
+
+
+def _anthropic_request(model: str, system_prompt: str, messages: list, max_tokens: int) -> dict:
+    """Anthropicのリクエストを組み立てる（システムプロンプトと履歴末尾にキャッシュのブレークポイントを置く）"""
+    if not config.ENABLE_PROMPT_CACHE:
+        return dict(model=model, max_tokens=max_tokens, system=system_prompt, messages=messages)
+    
+    cache_control = {"type": "ephemeral"}
+    system = [{"type": "text", "text": system_prompt, "cache_control": cache_control}]
+    if messages:
+        # 履歴末尾までを次回以降のキャッシュ対象にする（元の履歴は書き換えない）
+        last = messages[-1]
+        messages = messages[:-1] + [{
+            "role": last["role"],
+            "content": [{"type": "text", "text": last["content"], "cache_control": cache_control}],
+        }]
+    return dict(model=model, max_tokens=max_tokens, system=system, messages=messages)
+
+
+def _openai_request(model: str, system_prompt: str, messages: list, max_tokens: int) -> dict:
+    """OpenAIのリクエストを組み立てる（先頭固定のメッセージ配置で自動プレフィックスキャッシュを効かせる）"""
+    openai_messages = convert_messages("openai", MESSAGE_ADAPTERS["openai"], system_prompt, messages)
+    request = dict(model=model, max_completion_tokens=max_tokens, messages=openai_messages)
+    if config.ENABLE_PROMPT_CACHE:
+        # 同じシステムプロンプトのリクエストを同じキャッシュに振り分ける
+        request["prompt_cache_key"] = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:32]
+    return request
+
+
+# Geminiの明示的コンテキストキャッシュ: (model, システムプロンプトのハッシュ) -> (キャッシュ名, 有効期限) / 作成不可ならNone
+_gemini_caches = {}
+
+
+async def _gemini_cached_content(model: str, system_prompt: str) -> str | None:
+    """システムプロンプト（ルールブック）のコンテキストキャッシュを取得・作成"""
+    key = (model, hashlib.sha256(system_prompt.encode("utf-8")).hexdigest())
+    if key in _gemini_caches:
+        entry = _gemini_caches[key]
+        if entry is None:
+            return None
+        name, expires_at = entry
+        if time.monotonic() < expires_at:
+            return name
+    
+    try:
+        cache = await get_client("google").caches.create(
             model=model,
-            max_tokens=max_tokens,
-            system=system_prompt,
-            messages=messages
+            config=_genai_types().CreateCachedContentConfig(
+                system_instruction=system_prompt,
+                ttl=f"{config.GEMINI_CACHE_TTL}s",
+            )
+        )
+    except _sdk("google").errors.APIError:
+        # 最小トークン数に満たない・非対応モデルなどではキャッシュなしで続行
+        _gemini_caches[key] = None
+        return None
+    # 期限切れ直前のキャッシュを使わないよう、少し早めに作り直す
+    _gemini_caches[key] = (cache.name, time.monotonic() + config.GEMINI_CACHE_TTL * 0.9)
+    return cache.name
+
+
+async def _gemini_request(model: str, system_prompt: str, messages: list, max_tokens: int) -> dict:
+    """Geminiのリクエストを組み立てる（ルールブック入りのシステムプロンプトは明示キャッシュから参照）"""
+    types = _genai_types()
+    cached_content = None
+    if config.ENABLE_PROMPT_CACHE:
+        cached_content = await _gemini_cached_content(model, system_prompt)
+    if cached_content:
+        generate_config = types.GenerateContentConfig(cached_content=cached_content, max_output_tokens=max_tokens)
+    else:
+        generate_config = types.GenerateContentConfig(system_instruction=system_prompt, max_output_tokens=max_tokens)
+    contents = convert_messages("google", MESSAGE_ADAPTERS["google"], system_prompt, messages)
+    return dict(model=model, contents=contents, config=generate_config)
+
+
+class OpenAIMessageAdapter(MessageAdapter):
+    """OpenAIのメッセージ形式（先頭にシステムメッセージ）"""
+
+    def prefix(self, system_prompt: str) -> list:
+        return [{"role": "system", "content": system_prompt}]
+
+
+class GeminiMessageAdapter(MessageAdapter):
+    """Googleのメッセージ形式（types.Content）"""
+
+    def convert(self, message: dict):
+        types = _genai_types()
+        role = "user" if message["role"] == "user" else "model"
+        return types.Content(role=role, parts=[types.Part.from_text(text=message["content"])])
+
+
+# 履歴の変換が必要なプロバイダー（Anthropicとモックは履歴をそのまま渡す）
+MESSAGE_ADAPTERS = {
+    "openai": OpenAIMessageAdapter(),
+    "google": GeminiMessageAdapter(),
+}
+
+
+async def _complete(provider: str, model: str, system_prompt: str, messages: list, max_tokens: int,
+                    stats: CallStats | None = None) -> str:
+    """応答全体を一括で取得"""
+    if provider == "mock":
+        text = await mock_provider.complete(system_prompt, messages)
+        _record_usage(stats, provider, mock_provider.estimate_usage(system_prompt, messages, text))
+        return text
+    
+    elif provider == "anthropic":
+        response = await get_client(provider).messages.create(
+            **_anthropic_request(model, system_prompt, messages, max_tokens)
         )
+        _record_usage(stats, provider, response.usage)
         return response.content[0].text
     
     elif provider == "openai":
-        openai_messages = [{"role": "system", "content": system_prompt}]
-        openai_messages.extend(messages)
-        
-        response = openai_client.chat.completions.create(
-            model=model,
-            max_completion_tokens=max_tokens,
-            messages=openai_messages
+        response = await get_client(provider).chat.completions.create(
+            **_openai_request(model, system_prompt, messages, max_tokens)
         )
+        _record_usage(stats, provider, response.usage)
         return response.choices[0].message.content
     
     elif provider == "google":
-        if not google_client:
-            raise ValueError("Google API Key is not set.")
-            
-        # Googleのメッセージ形式に変換
-        gemini_messages = []
-        for msg in messages:
-            role = "user" if msg["role"] == "user" else "model"
-            gemini_messages.append(types.Content(role=role, parts=[types.Part.from_text(text=msg["content"])]))
-        
-        response = google_client.models.generate_content(
-            model=model,
-            contents=gemini_messages,
-            config=types.GenerateContentConfig(
-                system_instruction=system_prompt,
-                max_output_tokens=max_tokens,
-            )
+        response = await get_client(provider).models.generate_content(
+            **await _gemini_request(model, system_prompt, messages, max_tokens)
         )
+        _record_usage(stats, provider, response.usage_metadata)
         return response.text
     
     else:
         raise ValueError(f"Unknown provider: {provider}")
 
 
-def call_gm(conversation_history: list) -> str:
-    """GMを呼び出す"""
-    return call_llm(
-        provider=config.GM_PROVIDER,
-        model=config.GM_MODEL,
-        system_prompt=GM_SYSTEM_PROMPT,
+async def astream_llm(provider: str, model: str, system_prompt: str, messages: list, max_tokens: int = 1000,
+                      stats: CallStats | None = None):
+    """応答をテキスト断片ごとに逐次返す（非同期ジェネレーター）"""
+    if provider == "mock":
+        parts = []
+        async for text in mock_provider.stream(system_prompt, messages):
+            parts.append(text)
+            yield text
+        _record_usage(stats, provider, mock_provider.estimate_usage(system_prompt, messages, "".join(parts)))
+    
+    elif provider == "anthropic":
+        async with get_client(provider).messages.stream(
+            **_anthropic_request(model, system_prompt, messages, max_tokens)
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+            _record_usage(stats, provider, (await stream.get_final_message()).usage)
+    
+    elif provider == "openai":
+        stream = await get_client(provider).chat.completions.create(
+            **_openai_request(model, system_prompt, messages, max_tokens),
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        # 途中で打ち切られた場合も接続を閉じて生成を止める
+        async with stream:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if chunk.usage:
+                    _record_usage(stats, provider, chunk.usage)
+    
+    elif provider == "google":
+        stream = await get_client(provider).models.generate_content_stream(
+            **await _gemini_request(model, system_prompt, messages, max_tokens)
+        )
+        usage = None
+        async for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+            if chunk.usage_metadata:
+                usage = chunk.usage_metadata
+        _record_usage(stats, provider, usage)
+    
+    else:
+        raise ValueError(f"Unknown provider: {provider}")
+
+
+async def acall_llm(provider: str, model: str, system_prompt: str, messages: list, max_tokens: int = 1000,
+                    on_chunk=None, stats: CallStats | None = None, role: str = "other") -> str:
+    """汎用LLM呼び出し関数（非同期）
+    
+    on_chunk: 指定するとストリーミングで呼び出し、テキスト断片ごとに on_chunk(text) を呼ぶ
+              （on_chunk が StreamAborted を送出すると生成を打ち切り、その例外をそのまま送出する）
+    stats: 指定すると TTFT・応答時間・トークン数（キャッシュヒット/ミス）を記録する
+    role: 計測の集計に使う呼び出しの役割（"gm", "pl", "scenario" など）
+    
+    max_tokens は入力の推定トークン数に合わせてコンテキストウィンドウに収まるよう縮め、
+    収まらない入力は送らずに tokens.ContextLimitError を送出する。
+    config.LLM_CACHE_MODE が "record"/"replay" のときは記録/再生キャッシュを経由する。
+    キャンペーン実行中は、呼び出しごとの計測値を metrics の集計にも記録する。
+    """
+    start = time.perf_counter()
+    if stats is None:
+        stats = CallStats()
+    max_tokens = fit_max_tokens(provider, model, system_prompt, messages, max_tokens)
+    campaign_metrics = metrics.current()
+    # プリフェッチなどで完了が後になっても、開始時点のセッション・ターンで集計する
+    tags = campaign_metrics.tags() if campaign_metrics is not None else None
+    cache = llm_cache.get_cache()
+    key = None
+    if cache is not None:
+        key = cache.make_key(provider, model, system_prompt, messages, max_tokens)
+        entry = cache.get(key)
+        if entry is not None:
+            stats.provider = provider
+            stats.model = model
+            stats.replayed = True
+            try:
+                if on_chunk is not None:
+                    on_chunk(entry["text"])
+                # 打ち切った応答は、検証の内容が変わって on_chunk が送出しなくても記録時と同じく打ち切る
+                if "aborted" in entry:
+                    stats.aborted = True
+                    raise StreamAborted(entry["aborted"])
+            finally:
+                stats.ttft = stats.latency = time.perf_counter() - start
+                if campaign_metrics is not None:
+                    campaign_metrics.record(role, stats, tags, "replayed")
+            return entry["text"]
+        if config.LLM_CACHE_MODE == "replay":
+            raise llm_cache.CacheMissError(f"No recorded response for {provider}/{model} (key={key})")
+        if on_chunk is not None:
+            # 打ち切った応答も記録できるよう、呼び出し元に渡した断片を控えておく
+            received = []
+            forward = on_chunk
+
+            def on_chunk(text):
+                received.append(text)
+                forward(text)
+    
+    stats.provider = provider
+    stats.model = model
+    stats.streamed = on_chunk is not None
+    status = "error"
+    try:
+        if hedging.enabled(role):
+            text = await _hedged_request(provider, model, system_prompt, messages, max_tokens, on_chunk, stats, start,
+                                         role, tags)
+        else:
+            text = await _request(provider, model, system_prompt, messages, max_tokens, on_chunk, stats, start)
+        status = "ok"
+    except StreamAborted as e:
+        status = "aborted"
+        if key is not None:
+            cache.put(key, "".join(received), provider, model, aborted=e.reason)
+        raise
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    finally:
+        if campaign_metrics is not None:
+            campaign_metrics.record(role, stats, tags, status)
+    
+    if key is not None:
+        cache.put(key, text, provider, model)
+    return text
+
+
+async def _request(provider: str, model: str, system_prompt: str, messages: list, max_tokens: int, on_chunk,
+                   stats: CallStats, start: float) -> str:
+    """スケジューラーを通した1回のリクエスト（TTFT・応答時間は start からの秒数で stats に記録）"""
+    ttft = None
+    parts = []
+    
+    async def attempt() -> str:
+        nonlocal ttft
+        if on_chunk is None:
+            return await _complete(provider, model, system_prompt, messages, max_tokens, stats)
+        parts.clear()
+        # 打ち切り時はジェネレーターを閉じ、プロバイダーへの接続も閉じる
+        async with contextlib.aclosing(astream_llm(provider, model, system_prompt, messages, max_tokens, stats)) as stream:
+            async for chunk in stream:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                parts.append(chunk)
+                on_chunk(chunk)
+        return "".join(parts)
+    
+    stats.provider = provider
+    stats.model = model
+    stats.streamed = on_chunk is not None
+    finished = False
+    try:
+        # レート制限・再試行はスケジューラーに任せる（ストリーミングで出力済みなら再試行しない）
+        text = await get_scheduler().call(
+            provider, system_prompt, messages, max_tokens, attempt, stats, can_retry=lambda: ttft is None
+        )
+        finished = True
+        return text
+    except StreamAborted:
+        finished = True
+        # usage は応答の最後に届くため、打ち切った場合は送信・受信済みの分から推定する
+        stats.aborted = True
+        stats.input_tokens = input_tokens(provider, system_prompt, messages)
+        stats.output_tokens = estimate_tokens("".join(parts), provider)
+        raise
+    finally:
+        if finished:
+            stats.latency = time.perf_counter() - start
+            stats.ttft = ttft if ttft is not None else stats.latency
+
+
+# ヘッジで使ったリクエストから呼び出し元の CallStats に写す計測値
+_HEDGE_STATS_FIELDS = ("provider", "model", "ttft", "latency", "input_tokens", "cached_tokens", "cache_write_tokens",
+                       "output_tokens", "queue_wait", "retries", "aborted")
+
+
+async def _hedged_request(provider: str, model: str, system_prompt: str, messages: list, max_tokens: int, on_chunk,
+                          stats: CallStats, start: float, role: str, tags: dict | None) -> str:
+    """最初のトークンが期限までに届かなければ予備のリクエストも送り、先に応答した方を使う（→ hedging.py）
+    
+    使わなかったリクエストも、送信した入力トークン数の推定値で計測値に記録する（status: "hedge_lost"）。
+    """
+    def start_request(target: tuple[str, str], relay):
+        request_stats = CallStats()
+        request_stats.route = stats.route
+        coro = _request(*target, system_prompt, messages, max_tokens, relay, request_stats, start)
+        return coro, request_stats
+    
+    hedge = hedging.Hedge(start_request, (provider, model), on_chunk is not None)
+    try:
+        return await hedge.run(on_chunk)
+    finally:
+        if hedge.requests:
+            chosen = hedge.requests[hedge.winner if hedge.winner is not None else 0]
+            for field in _HEDGE_STATS_FIELDS:
+                setattr(stats, field, getattr(chosen.stats, field))
+            if len(hedge.requests) > 1:
+                stats.hedge = "backup" if chosen.index else "primary"
+            campaign_metrics = metrics.current()
+            for request in hedge.requests:
+                if request is chosen or campaign_metrics is None:
+                    continue
+                if not request.stats.input_tokens:
+                    request.stats.input_tokens = input_tokens(request.stats.provider or provider, system_prompt, messages)
+                campaign_metrics.record(role, request.stats, tags, "hedge_lost")
+
+
+# バッチAPIのあるプロバイダー（モックはローカルの代役。→ mock_provider.submit_batch）
+BATCH_PROVIDERS = ("anthropic", "openai", "mock")
+
+# OpenAIのバッチの終了状態
+_OPENAI_BATCH_ENDED = ("completed", "failed", "expired", "cancelled")
+
+
+async def submit_batch(provider: str, requests: list) -> str:
+    """バッチAPIにリクエストをまとめて送り、バッチIDを返す
+    
+    requests: (custom_id, acall_llm() の引数の辞書) のリスト。リクエストの組み立ては通常の呼び出しと同じ
+              （プロンプトキャッシュのブレークポイント・prompt_cache_key も付ける）
+    """
+    if provider == "mock":
+        return mock_provider.submit_batch([(custom_id, r["system_prompt"], r["messages"]) for custom_id, r in requests])
+    
+    elif provider == "anthropic":
+        batch = await get_client(provider).messages.batches.create(requests=[
+            {"custom_id": custom_id,
+             "params": _anthropic_request(r["model"], r["system_prompt"], r["messages"], r["max_tokens"])}
+            for custom_id, r in requests
+        ])
+        return batch.id
+    
+    elif provider == "openai":
+        lines = "".join(
+            json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions",
+                        "body": _openai_request(r["model"], r["system_prompt"], r["messages"], r["max_tokens"])},
+                       ensure_ascii=False) + "\n"
+            for custom_id, r in requests
+        )
+        client = get_client(provider)
+        input_file = await client.files.create(file=("batch.jsonl", lines.encode("utf-8")), purpose="batch")
+        batch = await client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions",
+                                            completion_window="24h")
+        return batch.id
+    
+    else:
+        raise ValueError(f"バッチAPIに対応していないプロバイダーです: {provider}")
+
+
+async def batch_ended(provider: str, batch_id: str) -> bool:
+    """バッチの処理が終わったか（成功・失敗・期限切れを問わない）"""
+    if provider == "mock":
+        return mock_provider.batch_ended(batch_id)
+    elif provider == "anthropic":
+        batch = await get_client(provider).messages.batches.retrieve(batch_id)
+        return batch.processing_status == "ended"
+    elif provider == "openai":
+        batch = await get_client(provider).batches.retrieve(batch_id)
+        return batch.status in _OPENAI_BATCH_ENDED
+    else:
+        raise ValueError(f"バッチAPIに対応していないプロバイダーです: {provider}")
+
+
+async def batch_results(provider: str, model: str, batch_id: str) -> dict:
+    """終わったバッチの結果を custom_id → (応答, CallStats) で返す（失敗したリクエストは例外オブジェクト）
+    
+    結果のないリクエスト（バッチ全体の失敗・期限切れ）は含まない。
+    """
+    results = {}
+    
+    def succeeded(custom_id: str, text: str, usage):
+        stats = CallStats()
+        stats.provider = provider
+        stats.model = model
+        stats.batch = batch_id
+        _record_usage(stats, provider, usage)
+        results[custom_id] = (text, stats)
+    
+    if provider == "mock":
+        for custom_id, (text, usage) in mock_provider.batch_results(batch_id).items():
+            succeeded(custom_id, text, usage)
+    
+    elif provider == "anthropic":
+        async for entry in await get_client(provider).messages.batches.results(batch_id):
+            result = entry.result
+            if result.type == "succeeded":
+                succeeded(entry.custom_id, result.message.content[0].text, result.message.usage)
+            else:
+                detail = f": {result.error.error.message}" if result.type == "errored" else ""
+                results[entry.custom_id] = RuntimeError(f"バッチのリクエストが {result.type} になりました{detail}")
+    
+    elif provider == "openai":
+        client = get_client(provider)
+        batch = await client.batches.retrieve(batch_id)
+        completion_type = _sdk("openai").types.chat.ChatCompletion
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = await client.files.content(file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                response = entry.get("response") or {}
+                if response.get("status_code") == 200:
+                    completion = completion_type.model_validate(response["body"])
+                    succeeded(entry["custom_id"], completion.choices[0].message.content, completion.usage)
+                else:
+                    error = entry.get("error") or response.get("body", {}).get("error") or {}
+                    results[entry["custom_id"]] = RuntimeError(
+                        f"バッチのリクエストが失敗しました: {error.get('message', response.get('status_code'))}"
+                    )
+    
+    else:
+        raise ValueError(f"バッチAPIに対応していないプロバイダーです: {provider}")
+    return results
+
+
+def call_llm(provider: str, model: str, system_prompt: str, messages: list, max_tokens: int = 1000,
+             on_chunk=None, stats: CallStats | None = None, role: str = "other") -> str:
+    """汎用LLM呼び出し関数（同期版。イベントループ外からの呼び出し用）"""
+    return asyncio.run(acall_llm(provider, model, system_prompt, messages, max_tokens, on_chunk, stats, role))
+
+
+async def acall_gm(conversation_history: list, on_chunk=None, stats: CallStats | None = None,
+                   target: tuple[str, str] | None = None) -> str:
+    """GMを呼び出す（target: 使う (プロバイダー, モデル)。省略時は GM_PROVIDER / GM_MODEL）"""
+    provider, model = target or (config.GM_PROVIDER, config.GM_MODEL)
+    return await acall_llm(
+        provider=provider,
+        model=model,
+        system_prompt=get_prompt("GM_SYSTEM_PROMPT"),
         messages=conversation_history,
-        max_tokens=3000
+        max_tokens=config.MAX_OUTPUT_TOKENS["gm"],
+        on_chunk=on_chunk,
+        stats=stats,
+        role="gm"
     )
 
 
-def call_pl(conversation_history: list) -> str:
-    """PLを呼び出す"""
-    return call_llm(
-        provider=config.PL_PROVIDER,
-        model=config.PL_MODEL,
-        system_prompt=PL_SYSTEM_PROMPT,
+def _pl_target(member, prompt_name: str) -> tuple[str, str, str]:
+    """PL呼び出しの (プロバイダー, モデル, システムプロンプト)（member: パーティのPL。None なら config のPL）"""
+    if member is None:
+        return config.PL_PROVIDER, config.PL_MODEL, get_prompt(prompt_name)
+    return member.provider, member.model, member.system_prompt(prompt_name)
+
+
+async def acall_pl(conversation_history: list, on_chunk=None, stats: CallStats | None = None, member=None,
+                   target: tuple[str, str] | None = None) -> str:
+    """PLを呼び出す（target: 使う (プロバイダー, モデル)。省略時はPLのモデル）"""
+    provider, model, system_prompt = _pl_target(member, "PL_SYSTEM_PROMPT")
+    if target is not None:
+        provider, model = target
+    return await acall_llm(
+        provider=provider,
+        model=model,
+        system_prompt=system_prompt,
         messages=conversation_history,
-        max_tokens=2000
+        max_tokens=config.MAX_OUTPUT_TOKENS["pl"],
+        on_chunk=on_chunk,
+        stats=stats,
+        role="pl"
     )
 
 
-def call_pl_scenario_gen(scenario_template: str) -> str:
-    """PLにシナリオ生成を依頼"""
+def pl_scenario_gen_request(scenario_template: str, member=None) -> dict:
+    """シナリオ生成の acall_llm() の引数（バッチAPIで後から実行する場合も同じ内容を送る）"""
     messages = [
         {"role": "user", "content": f"以下のシナリオテンプレートに基づいて、PCと初回セッションを設定してください：\n\n{scenario_template}"}
     ]
-    
-    return call_llm(
-        provider=config.PL_PROVIDER,
-        model=config.PL_MODEL,
-        system_prompt=PL_SCENARIO_GEN_PROMPT,
-        messages=messages,
-        max_tokens=2000
-    )
+    provider, model, system_prompt = _pl_target(member, "PL_SCENARIO_GEN_PROMPT")
+    return dict(provider=provider, model=model, system_prompt=system_prompt, messages=messages,
+                max_tokens=config.MAX_OUTPUT_TOKENS["scenario"], role="scenario")
+
+
+async def acall_pl_scenario_gen(scenario_template: str, on_chunk=None, stats: CallStats | None = None,
+                                member=None) -> str:
+    """PLにシナリオ生成を依頼"""
+    return await acall_llm(**pl_scenario_gen_request(scenario_template, member), on_chunk=on_chunk, stats=stats)
 
 
-def call_pl_next_hook(session_end_response: str) -> str:
+async def acall_pl_next_hook(session_end_response: str, on_chunk=None, stats: CallStats | None = None,
+                             member=None) -> str:
     """PLに次回フック選択を依頼"""
     messages = [
         {"role": "user", "content": f"GMからのセッション終了描写：\n\n{session_end_response}\n\n{PL_NEXT_HOOK_PROMPT}"}
     ]
+    provider, model, system_prompt = _pl_target(member, "PL_SYSTEM_PROMPT")
     
-    return call_llm(
-        provider=config.PL_PROVIDER,
-        model=config.PL_MODEL,
-        system_prompt=PL_SYSTEM_PROMPT,
+    return await acall_llm(
+        provider=provider,
+        model=model,
+        system_prompt=system_prompt,
         messages=messages,
-        max_tokens=3000
+        max_tokens=config.MAX_OUTPUT_TOKENS["next_hook"],
+        on_chunk=on_chunk,
+        stats=stats,
+        role="next_hook"
     )
 
 
-def call_gm_session_feedback(conversation_history: list) -> str:
-    """GMにセッションの振り返りを依頼"""
+def gm_session_feedback_request(conversation_history: list) -> dict:
+    """GMのセッション振り返りの acall_llm() の引数"""
     messages = conversation_history + [
         {"role": "user", "content": GM_SESSION_FEEDBACK_PROMPT}
     ]
-    return call_llm(
-        provider=config.GM_PROVIDER,
-        model=config.GM_MODEL,
-        system_prompt=GM_SYSTEM_PROMPT,
-        messages=messages,
-        max_tokens=4000
-    )
+    return dict(provider=config.GM_PROVIDER, model=config.GM_MODEL, system_prompt=get_prompt("GM_SYSTEM_PROMPT"),
+                messages=messages, max_tokens=config.MAX_OUTPUT_TOKENS["gm_feedback"], role="gm_feedback")
 
 
-def call_pl_session_feedback(conversation_history: list) -> str:
-    """PLにセッションの振り返りを依頼"""
+async def acall_gm_session_feedback(conversation_history: list, on_chunk=None, stats: CallStats | None = None) -> str:
+    """GMにセッションの振り返りを依頼"""
+    return await acall_llm(**gm_session_feedback_request(conversation_history), on_chunk=on_chunk, stats=stats)
+
+
+def pl_session_feedback_request(conversation_history: list, member=None) -> dict:
+    """PLのセッション振り返りの acall_llm() の引数"""
     messages = conversation_history + [
         {"role": "user", "content": PL_SESSION_FEEDBACK_PROMPT}
     ]
-    return call_llm(
-        provider=config.PL_PROVIDER,
-        model=config.PL_MODEL,
-        system_prompt=PL_SYSTEM_PROMPT,
+    provider, model, system_prompt = _pl_target(member, "PL_SYSTEM_PROMPT")
+    return dict(provider=provider, model=model, system_prompt=system_prompt, messages=messages,
+                max_tokens=config.MAX_OUTPUT_TOKENS["pl_feedback"], role="pl_feedback")
+
+
+async def acall_pl_session_feedback(conversation_history: list, on_chunk=None, stats: CallStats | None = None,
+                                    member=None) -> str:
+    """PLにセッションの振り返りを依頼"""
+    return await acall_llm(**pl_session_feedback_request(conversation_history, member), on_chunk=on_chunk, stats=stats)
+
+
+async def acall_history_summary(role: str, transcript: str, stats: CallStats | None = None,
+                                target: tuple[str, str] | None = None) -> str:
+    """GM/PLの古い履歴をコアセーブ＋あらすじに要約する（role: "gm" / "pl"。target: 使う (プロバイダー, モデル)。省略時はGM/PLのモデル）"""
+    provider, model = (config.GM_PROVIDER, config.GM_MODEL) if role == "gm" else (config.PL_PROVIDER, config.PL_MODEL)
+    if target is not None:
+        provider, model = target
+    messages = [
+        {"role": "user", "content": f"以下のプレイ記録を圧縮してください：\n\n{transcript}"}
+    ]
+    return await acall_llm(
+        provider=provider,
+        model=model,
+        system_prompt=get_prompt("HISTORY_SUMMARY_PROMPT"),
         messages=messages,
-        max_tokens=4000
-    )
\ No newline at end of file
+        max_tokens=config.MAX_OUTPUT_TOKENS["compaction"],
+        stats=stats,
+        role=f"{role}_compaction"
+    )
+
+
+# 同期版（イベントループ外からの呼び出し用）
+def call_gm(conversation_history: list, on_chunk=None, stats: CallStats | None = None) -> str:
+    """GMを呼び出す"""
+    return asyncio.run(acall_gm(conversation_history, on_chunk=on_chunk, stats=stats))
+
+
+def call_pl(conversation_history: list, on_chunk=None, stats: CallStats | None = None) -> str:
+    """PLを呼び出す"""
+    return asyncio.run(acall_pl(conversation_history, on_chunk=on_chunk, stats=stats))
+
+
+def call_pl_scenario_gen(scenario_template: str, on_chunk=None, stats: CallStats | None = None) -> str:
+    """PLにシナリオ生成を依頼"""
+    return asyncio.run(acall_pl_scenario_gen(scenario_template, on_chunk=on_chunk, stats=stats))
+
+
+def call_pl_next_hook(session_end_response: str, on_chunk=None, stats: CallStats | None = None) -> str:
+    """PLに次回フック選択を依頼"""
+    return asyncio.run(acall_pl_next_hook(session_end_response, on_chunk=on_chunk, stats=stats))
+
+
+def call_gm_session_feedback(conversation_history: list, on_chunk=None, stats: CallStats | None = None) -> str:
+    """GMにセッションの振り返りを依頼"""
+    return asyncio.run(acall_gm_session_feedback(conversation_history, on_chunk=on_chunk, stats=stats))
+
+
+def call_pl_session_feedback(conversation_history: list, on_chunk=None, stats: CallStats | None = None) -> str:
+    """PLにセッションの振り返りを依頼"""
+    return asyncio.run(acall_pl_session_feedback(conversation_history, on_chunk=on_chunk, stats=stats))
@@ -0,0 +1,104 @@
+"""バッチランナー：複数キャンペーンを非対話・並行で実行"""
+import asyncio
+import argparse
+import time
+import traceback
+from orchestrator import run_campaign, ScriptedDecider
+from scheduler import get_scheduler
+import batch_api
+
+
+class BatchReport:
+    """バッチ実行結果の集計"""
+
+    def __init__(self):
+        self.completed = 0
+        self.failed = 0
+        self.total_turns = 0
+        self.total_cost = 0.0
+        self.elapsed = 0.0
+        self.log_files = []
+        self.errors = []
+        self.scheduler_metrics = {}
+
+    @property
+    def turns_per_min(self) -> float:
+        return self.total_turns / self.elapsed * 60 if self.elapsed else 0.0
+
+    @property
+    def campaigns_per_hour(self) -> float:
+        return self.completed / self.elapsed * 3600 if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        text = (
+            f"完了キャンペーン数: {self.completed} / 失敗: {self.failed}\n"
+            f"総ターン数: {self.total_turns}\n"
+            f"推定コスト: ${self.total_cost:.4f}\n"
+            f"経過時間: {self.elapsed:.1f}s\n"
+            f"スループット: {self.turns_per_min:.1f} turns/min, {self.campaigns_per_hour:.1f} campaigns/hour"
+        )
+        for provider, m in self.scheduler_metrics.items():
+            text += (
+                f"\n[{provider}] リクエスト: {m['requests']} / 再試行: {m['retries']} / "
+                f"待機: 合計 {m['queue_wait_total']:.1f}s, 最大 {m['queue_wait_max']:.1f}s / 一時停止: {m['circuit_opens']}回"
+            )
+        return text
+
+
+async def run_batch(scenarios: list, n_campaigns: int, concurrency: int = 4, max_sessions: int = 1,
+                    decider_factory=None) -> BatchReport:
+    """シナリオテンプレートを順に割り当てて n_campaigns 件のキャンペーンを並行実行する
+
+    concurrency: 同時に実行するキャンペーン数の上限
+    max_sessions: 1キャンペーンあたりのセッション数（decider_factory 未指定時）
+    decider_factory: キャンペーン番号を受け取り decider を返す関数（スクリプト化した介入用）
+    """
+    if decider_factory is None:
+        decider_factory = lambda i: ScriptedDecider(max_sessions=max_sessions)
+
+    report = BatchReport()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(i: int):
+        scenario_path = scenarios[i % len(scenarios)]
+        async with semaphore:
+            try:
+                logger = await run_campaign(scenario_path, decider_factory(i), echo=False)
+            except Exception as e:
+                # 1キャンペーンの失敗でバッチ全体を止めない
+                report.failed += 1
+                report.errors.append((i, scenario_path, repr(e)))
+                traceback.print_exc()
+                print(f"❌ [{i}] {scenario_path}: {e!r}")
+                return
+        report.completed += 1
+        report.total_turns += logger.total_turns
+        report.total_cost += logger.metrics.totals()["cost_usd"]
+        report.log_files.append(logger.filepath)
+        print(f"✅ [{i}] {scenario_path} → {logger.filepath} ({logger.total_turns} turns)")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(n_campaigns)))
+    report.elapsed = time.perf_counter() - start
+    report.scheduler_metrics = get_scheduler().metrics()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="複数キャンペーンをヘッドレスで並行実行する")
+    parser.add_argument("scenarios", nargs="+", help="シナリオテンプレートのパス")
+    parser.add_argument("-n", "--campaigns", type=int, default=10, help="実行するキャンペーン数")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="同時実行数")
+    parser.add_argument("-s", "--sessions", type=int, default=1, help="1キャンペーンあたりのセッション数")
+    parser.add_argument("--run-deferred", action="store_true",
+                        help="終了後に後回しにした呼び出しをバッチAPIで実行し、完了を待ってログに書き戻す")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_batch(args.scenarios, args.campaigns, args.concurrency, args.sessions))
+    print("=" * 50)
+    print(report.summary())
+    print("=" * 50)
+    if args.run_deferred:
+        deferred_report = asyncio.run(batch_api.run())
+        print(deferred_report.summary())
+        print("=" * 50)
@@ -0,0 +1,255 @@
+"""バッチAPIでの実行：後回しにした呼び出しをバッチAPIでまとめて実行し、完了を待って各キャンペーンのログに書き戻す
+
+    python batch_api.py prepare scenarios/template_fantasy.md -n 20   # キャンペーンを用意し、PLのシナリオ生成を後回しにする
+    python batch_api.py run                                           # 待ち行列を送信し、完了を待って書き戻す
+    python batch_api.py status                                        # 待ち行列の状況
+
+待ち行列（deferred.py）のリクエストを、プロバイダー・モデルごとに BATCH_MAX_REQUESTS 件までのバッチにまとめて送る。
+送ったバッチは待ち行列に記録するので、run を中断しても次の run で同じバッチの完了を待ち直す（再送しない）。
+run は同時に1つだけ実行すること（同じバッチの結果を二重に書き戻さないため）。
+バッチAPIのないプロバイダー（google）のリクエストは、run の中で通常の呼び出しで実行する。
+シナリオ生成は、キャンペーンの全PLの結果がそろったらチェックポイントに書き戻す（python main.py --resume で続きを遊べる）。
+"""
+import time
+import asyncio
+import argparse
+from agents import BATCH_PROVIDERS, CallStats, acall_llm, pl_scenario_gen_request, submit_batch, batch_ended, batch_results
+from checkpoint import CampaignCheckpoint, load_checkpoint, PHASE_SCENARIO
+from deferred import DeferredQueue, defer
+from metrics import estimate_cost
+from orchestrator import CampaignLogger, new_campaign, commit_characters
+from party import load_party
+import config
+
+
+class BatchRunReport:
+    """run() の結果の集計"""
+
+    def __init__(self):
+        self.submitted = 0  # 送信したリクエスト数
+        self.completed = 0
+        self.failed = 0
+        self.waiting = 0  # 完了を待たずに終えたリクエスト数
+        self.cost = 0.0
+        self.standard_cost = 0.0  # 同じ呼び出しを通常の料金で実行した場合の推定コスト
+        self.campaigns_ready = []  # シナリオ生成を書き戻したキャンペーンのチェックポイント
+        self.elapsed = 0.0
+
+    def add(self, stats: CallStats):
+        self.completed += 1
+        cost = estimate_cost(stats.provider, stats.model, stats.input_tokens, stats.cached_tokens,
+                             stats.cache_write_tokens, stats.output_tokens)
+        if cost is not None:
+            self.standard_cost += cost
+            self.cost += cost * config.BATCH_DISCOUNT if stats.batch is not None else cost
+
+    def summary(self) -> str:
+        text = (
+            f"送信: {self.submitted} / 完了: {self.completed} / 失敗: {self.failed} / 完了待ち: {self.waiting}\n"
+            f"推定コスト: ${self.cost:.4f}（通常の料金なら ${self.standard_cost:.4f}）\n"
+            f"経過時間: {self.elapsed:.1f}s"
+        )
+        for path in self.campaigns_ready:
+            text += f"\n再開できるキャンペーン: python main.py --resume {path}"
+        return text
+
+
+def prepare_scenarios(scenarios: list, n_campaigns: int) -> list:
+    """シナリオテンプレートを順に割り当てた n_campaigns 件のキャンペーンを用意し、PLのシナリオ生成を待ち行列に入れる
+
+    テンプレートの一括テスト用。人間によるシナリオの確認は行わない。
+    返り値は各キャンペーンのチェックポイントのパス（run() で書き戻した後、再開して続きを実行できる）。
+    """
+    if not config.ENABLE_CHECKPOINT:
+        raise ValueError("シナリオ生成を後回しにするには ENABLE_CHECKPOINT = True が必要です")
+    paths = []
+    for i in range(n_campaigns):
+        logger, state, checkpoint = new_campaign(scenarios[i % len(scenarios)], echo=False)
+        try:
+            for member in load_party():
+                defer(logger, "scenario", pl_scenario_gen_request(state.scenario_template, member), member.label,
+                      member.key)
+        finally:
+            checkpoint.close()
+            logger.close()
+        paths.append(logger.checkpoint_path)
+    return paths
+
+
+async def _call_now(record: dict):
+    """バッチAPIのないプロバイダーのリクエストを通常の呼び出しで実行する（失敗は例外オブジェクトで返す）"""
+    stats = CallStats()
+    try:
+        return await acall_llm(**record["request"], stats=stats), stats
+    except Exception as e:
+        return e
+
+
+def _commit_scenarios(checkpoint_path: str, requests: dict, done: dict) -> bool:
+    """キャンペーンの全PLのシナリオ生成がそろっていれば、チェックポイントに書き戻す"""
+    personas = {}
+    for record in requests.values():
+        if record["kind"] != "scenario" or record["checkpoint"] != checkpoint_path:
+            continue
+        result = done.get(record["id"])
+        if result is None or result["text"] is None:
+            return False  # 未完了・失敗（失敗したキャンペーンは再開するとシナリオ生成からやり直す）
+        personas[record["member"]] = result["text"]
+    members = load_party()
+    if sorted(personas) != sorted(member.key for member in members):
+        print(f"⚠️ PARTY の設定が用意したときと異なるため書き戻しません: {checkpoint_path}")
+        return False
+    _, state = load_checkpoint(checkpoint_path)
+    if state.phase != PHASE_SCENARIO:
+        return False  # 先に再開して進めたキャンペーン
+    checkpoint = CampaignCheckpoint(checkpoint_path, state)
+    try:
+        commit_characters(state, checkpoint, members, [personas[member.key] for member in members])
+    finally:
+        checkpoint.close()
+    return True
+
+
+def _write_back(queue: DeferredQueue, requests: dict, done: dict, items: list, batch_ids: list, report: BatchRunReport):
+    """結果をキャンペーンごとにログの末尾へ書き戻し、待ち行列に記録する
+
+    items: (request の記録, (応答, CallStats) または例外) のリスト
+    """
+    by_log = {}
+    for record, result in items:
+        by_log.setdefault(record["log"], []).append((record, result))
+    for log_path, entries in by_log.items():
+        logger = CampaignLogger("", echo=False, filepath=log_path)
+        marks = []
+        try:
+            logger.log_batch_results(batch_ids)
+            for record, result in entries:
+                # イベントログには後回しにしたときのセッション・ターンで記録する
+                logger.session_count = record["session"]
+                logger.current_turn = record["turn"]
+                if isinstance(result, Exception):
+                    reason = f"{type(result).__name__}: {result}"
+                    logger.log_call_error(record["kind"], reason, record["speaker"])
+                    report.failed += 1
+                    marks.append((record["id"], None, reason))
+                else:
+                    text, stats = result
+                    logger.begin_response(record["kind"], speaker=record["speaker"])
+                    logger.write_response(text)
+                    logger.end_response(stats)
+                    report.add(stats)
+                    marks.append((record["id"], text, None))
+        finally:
+            logger.close()
+        queue.mark_done(marks)
+        for request_id, text, error in marks:
+            done[request_id] = {"text": text, "error": error}
+    for checkpoint_path in {record["checkpoint"] for record, _ in items if record["kind"] == "scenario"}:
+        if _commit_scenarios(checkpoint_path, requests, done):
+            report.campaigns_ready.append(checkpoint_path)
+
+
+async def run(queue: DeferredQueue | None = None, wait: bool = True, out=print) -> BatchRunReport:
+    """待ち行列の未送信のリクエストを送り、送信済みのバッチの完了を待って結果をログに書き戻す
+
+    wait: False なら完了していないバッチを待たずに戻る（次の run() で続きを待つ）
+    """
+    queue = queue or DeferredQueue()
+    report = BatchRunReport()
+    start = time.perf_counter()
+    requests, batches, done = queue.load()
+    submitted = {request_id for batch in batches.values() for request_id in batch["ids"]}
+
+    # プロバイダー・モデルごとにバッチにまとめて送る（バッチAPIのないプロバイダーは通常の呼び出し）
+    groups, direct = {}, []
+    for record in requests.values():
+        if record["id"] in submitted or record["id"] in done:
+            continue
+        request = record["request"]
+        if request["provider"] in BATCH_PROVIDERS:
+            groups.setdefault((request["provider"], request["model"]), []).append(record)
+        else:
+            direct.append(record)
+    for (provider, model), records in groups.items():
+        for i in range(0, len(records), config.BATCH_MAX_REQUESTS):
+            chunk = records[i:i + config.BATCH_MAX_REQUESTS]
+            batch_id = await submit_batch(provider, [(record["id"], record["request"]) for record in chunk])
+            queue.mark_submitted(batch_id, provider, model, [record["id"] for record in chunk])
+            report.submitted += len(chunk)
+            out(f"📦 {provider} / {model}: {len(chunk)}件を送信 → {batch_id}")
+    if direct:
+        report.submitted += len(direct)
+        results = await asyncio.gather(*(_call_now(record) for record in direct))
+        _write_back(queue, requests, done, list(zip(direct, results)), [], report)
+
+    # 送信済みで書き戻していないバッチ（前回の run から持ち越した分を含む）の完了を待つ
+    requests, batches, done = queue.load()
+    waiting = {batch_id: batch for batch_id, batch in batches.items()
+               if any(request_id not in done for request_id in batch["ids"])}
+    order = {request_id: i for i, request_id in enumerate(requests)}
+    while waiting:
+        # 同じ確認で終わっていたバッチの結果は、待ち行列に入った順にまとめて書き戻す
+        ended, items = [], []
+        for batch_id, batch in list(waiting.items()):
+            if not await batch_ended(batch["provider"], batch_id):
+                continue
+            del waiting[batch_id]
+            ended.append(batch_id)
+            results = await batch_results(batch["provider"], batch["model"], batch_id)
+            elapsed = time.time() - batch["ts"]
+            for request_id in batch["ids"]:
+                if request_id in done:
+                    continue
+                result = results.get(request_id, RuntimeError("バッチの結果がありません（バッチの失敗・期限切れ）"))
+                if not isinstance(result, Exception):
+                    result[1].ttft = result[1].latency = elapsed
+                items.append((requests[request_id], result))
+        if ended:
+            items.sort(key=lambda item: order[item[0]["id"]])
+            _write_back(queue, requests, done, items, ended, report)
+            out(f"✅ {', '.join(ended)}: {len(items)}件を書き戻しました")
+        if not waiting:
+            break
+        if not wait:
+            report.waiting = sum(1 for batch in waiting.values() for request_id in batch["ids"] if request_id not in done)
+            break
+        await asyncio.sleep(config.BATCH_POLL_INTERVAL)
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def status(queue: DeferredQueue | None = None) -> dict:
+    """待ち行列の状況（未送信・完了待ち・完了・失敗の件数）"""
+    requests, batches, done = (queue or DeferredQueue()).load()
+    submitted = {request_id for batch in batches.values() for request_id in batch["ids"]}
+    counts = {"pending": 0, "waiting": 0, "completed": 0, "failed": 0}
+    for request_id in requests:
+        if request_id in done:
+            counts["failed" if done[request_id]["error"] else "completed"] += 1
+        else:
+            counts["waiting" if request_id in submitted else "pending"] += 1
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="後回しにした呼び出しをバッチAPIでまとめて実行する")
+    commands = parser.add_subparsers(dest="command", required=True)
+    prepare_parser = commands.add_parser("prepare", help="キャンペーンを用意し、PLのシナリオ生成を待ち行列に入れる")
+    prepare_parser.add_argument("scenarios", nargs="+", help="シナリオテンプレートのパス")
+    prepare_parser.add_argument("-n", "--campaigns", type=int, default=10, help="用意するキャンペーン数")
+    run_parser = commands.add_parser("run", help="待ち行列を送信し、完了を待ってログに書き戻す")
+    run_parser.add_argument("--no-wait", action="store_true", help="完了していないバッチを待たずに終える")
+    commands.add_parser("status", help="待ち行列の状況を表示する")
+    args = parser.parse_args()
+
+    if args.command == "prepare":
+        for path in prepare_scenarios(args.scenarios, args.campaigns):
+            print(path)
+    elif args.command == "run":
+        report = asyncio.run(run(wait=not args.no_wait))
+        print("=" * 50)
+        print(report.summary())
+        print("=" * 50)
+    else:
+        counts = status()
+        print(f"未送信: {counts['pending']} / 完了待ち: {counts['waiting']} / 完了: {counts['completed']} / 失敗: {counts['failed']}")
@@ -0,0 +1,411 @@
+"""オフラインベンチマーク：モックプロバイダーでオーケストレーターの性能を計測する
+
+APIキー不要。CIなどのオフライン環境で性能劣化を検出するために使う。
+
+    python benchmark.py --turns 1000 --json bench.json
+    python benchmark.py --turns 1000 --baseline bench.json  # 基準値から劣化していれば終了コード1
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+import agents
+import config
+import mock_provider
+from compaction import history_tokens
+from message_buffer import convert_messages, clear_buffers
+from memory import RetrievalMemory
+from log_index import parse_log
+from metrics import percentile
+from orchestrator import run_campaign, ScriptedDecider, CampaignLogger
+
+SCENARIO_TEMPLATE_PATH = os.path.abspath("scenarios/template_fantasy.md")
+
+# 値が大きいほど悪い指標（基準値との比較対象）
+REGRESSION_METRICS = [
+    "orchestrator_overhead_ms_per_turn",
+    "logger_us_per_response",
+    "logger_us_per_stream_chunk",
+    "peak_memory_mb",
+]
+
+
+def _use_mock(turns: int, compaction: bool):
+    config.GM_PROVIDER = config.PL_PROVIDER = "mock"
+    config.MOCK_TTFT_MEDIAN = 0.0
+    config.MOCK_CHARS_PER_SEC = 0
+    config.MAX_TURNS = turns
+    config.MOCK_SESSION_TURNS = turns + 1  # 最大ターンまでセッションを続ける
+    config.ENABLE_SESSION_FEEDBACK = False
+    config.LLM_CACHE_MODE = "passthrough"
+    if not compaction:
+        config.HISTORY_COMPACTION_TOKENS = 0
+
+
+async def _run_instrumented_campaign() -> dict:
+    """LLM呼び出しを計測しながら1キャンペーンを実行"""
+    llm_time = 0.0
+    gm_history_tokens = []
+    original = agents.acall_llm
+
+    async def timed_acall_llm(provider, model, system_prompt, messages, *args, **kwargs):
+        nonlocal llm_time
+        if system_prompt is agents.GM_SYSTEM_PROMPT:
+            gm_history_tokens.append(history_tokens(messages))
+        start = time.perf_counter()
+        try:
+            return await original(provider, model, system_prompt, messages, *args, **kwargs)
+        finally:
+            llm_time += time.perf_counter() - start
+
+    agents.acall_llm = timed_acall_llm
+    try:
+        start = time.perf_counter()
+        logger = await run_campaign(SCENARIO_TEMPLATE_PATH, ScriptedDecider(max_sessions=1), echo=False)
+        elapsed = time.perf_counter() - start
+    finally:
+        agents.acall_llm = original
+    return {"elapsed": elapsed, "llm_time": llm_time, "turns": logger.total_turns, "gm_history_tokens": gm_history_tokens}
+
+
+def bench_campaign(turns: int, compaction: bool) -> dict:
+    """長いキャンペーンでのターンあたりのオーケストレーター処理時間・履歴の伸び・メモリを計測"""
+    _use_mock(turns, compaction)
+    result = asyncio.run(_run_instrumented_campaign())
+
+    tracemalloc.start()
+    asyncio.run(_run_instrumented_campaign())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    growth = result["gm_history_tokens"]
+    checkpoints = sorted({0, len(growth) // 4, len(growth) // 2, len(growth) - 1})
+    return {
+        "turns": result["turns"],
+        "campaign_seconds": round(result["elapsed"], 3),
+        "mock_llm_seconds": round(result["llm_time"], 3),
+        "orchestrator_overhead_ms_per_turn": round((result["elapsed"] - result["llm_time"]) / result["turns"] * 1000, 4),
+        "gm_history_tokens": {f"turn_{i}": growth[i] for i in checkpoints},
+        "gm_history_tokens_max": max(growth),
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+    }
+
+
+def bench_logger(n: int) -> dict:
+    """CampaignLogger の書き込みコストを計測"""
+    text = "霧の向こうに灯りが見える。\n" * 40
+    logger = CampaignLogger("ベンチマーク", echo=False)
+
+    start = time.perf_counter()
+    for _ in range(n):
+        logger.log_gm(text)
+    per_response = (time.perf_counter() - start) / n
+
+    chunks = [text[i:i + 20] for i in range(0, len(text), 20)]
+    start = time.perf_counter()
+    for _ in range(n):
+        logger.begin_response("gm")
+        for chunk in chunks:
+            logger.write_response(chunk)
+        logger.end_response()
+    per_chunk = (time.perf_counter() - start) / (n * len(chunks))
+
+    # 書き込みスレッドに溜まった分を書き切るまでの時間
+    start = time.perf_counter()
+    logger.close()
+    drain = time.perf_counter() - start
+
+    return {
+        "logger_us_per_response": round(per_response * 1e6, 2),
+        "logger_us_per_stream_chunk": round(per_chunk * 1e6, 2),
+        "logger_drain_ms": round(drain * 1000, 2),
+        "log_bytes": os.path.getsize(logger.filepath),
+    }
+
+
+def bench_conversion(n: int) -> dict:
+    """履歴のメッセージ変換（Gemini形式）のコストを、履歴の長さごとに計測
+
+    変換バッファを使う場合と、毎回履歴全体を変換し直す場合を比べる。
+    google-genai が入っていなければ計測しない。
+    """
+    try:
+        agents._genai_types()
+    except ImportError:
+        return {}
+    adapter = agents.MESSAGE_ADAPTERS["google"]
+    text = "霧の向こうに灯りが見える。\n" * 10
+    history = []
+    buffered, rebuilt = [], []
+    for i in range(n):
+        history.append({"role": "user" if i % 2 == 0 else "assistant", "content": text})
+        start = time.perf_counter()
+        convert_messages("google", adapter, "ベンチマーク", history)
+        buffered.append(time.perf_counter() - start)
+        if i % 10 == 0:
+            # 全体の変換し直しは履歴の長さに比例して重いので、10回に1回だけ計る
+            start = time.perf_counter()
+            [adapter.convert(message) for message in history]
+            rebuilt.append(time.perf_counter() - start)
+    clear_buffers()
+
+    def per_call(samples: list, part: slice) -> float:
+        samples = samples[part]
+        return round(sum(samples) / len(samples) * 1e6, 2)
+
+    def tenths(samples: list) -> tuple:
+        tenth = max(1, len(samples) // 10)
+        return per_call(samples, slice(0, tenth)), per_call(samples, slice(len(samples) - tenth, len(samples)))
+
+    first, last = tenths(buffered)
+    rebuild_first, rebuild_last = tenths(rebuilt)
+    return {
+        "conversion_us_per_call_first_10pct": first,
+        "conversion_us_per_call_last_10pct": last,
+        "conversion_rebuild_us_per_call_first_10pct": rebuild_first,
+        "conversion_rebuild_us_per_call_last_10pct": rebuild_last,
+    }
+
+
+def bench_memory(n: int) -> dict:
+    """検索メモリの索引追加と検索のコストを、キャンペーンの長さ（ターン数）ごとに計測
+
+    モックのGM/PL応答で n ターン分の履歴を作り、GMを呼ぶたびの入力の組み立て（索引への追加を含む）と検索を計る。
+    """
+    rng = random.Random(config.MOCK_SEED)
+    memory = RetrievalMemory()
+    history = [{"role": "user", "content": "ベンチマーク"}]
+    contexts, searches = [], []
+    for turn in range(1, n + 1):
+        history.append({"role": "user", "content": f"PLの行動：\n{mock_provider._pl_turn(rng)}"})
+        start = time.perf_counter()
+        memory.context(history, 1, turn)
+        contexts.append(time.perf_counter() - start)
+        if turn % 10 == 0:
+            # context() と同じく、直前のGM応答と今の入力で検索する（添えた過去の記録は含めない）
+            query = f"{history[-2]['content']}\n{history[-1]['content']}"
+            start = time.perf_counter()
+            memory.index.search(query, config.MEMORY_TOP_K)
+            searches.append(time.perf_counter() - start)
+        history.append({"role": "assistant", "content": mock_provider._gm_turn(rng, history)})
+
+    def tenths(samples: list) -> tuple:
+        tenth = max(1, len(samples) // 10)
+        return (round(sum(samples[:tenth]) / tenth * 1e6, 1), round(sum(samples[-tenth:]) / tenth * 1e6, 1))
+
+    context_first, context_last = tenths(contexts)
+    search_first, search_last = tenths(searches) if searches else (0.0, 0.0)
+    return {
+        "memory_documents": len(memory.index),
+        "memory_context_us_first_10pct": context_first,
+        "memory_context_us_last_10pct": context_last,
+        "memory_search_us_first_10pct": search_first,
+        "memory_search_us_last_10pct": search_last,
+    }
+
+
+def bench_hedging(n: int) -> dict:
+    """ヘッジリクエストの有無で、GM呼び出しの応答時間の p50 / p95 / p99 を比べる
+
+    モックのTTFTを裾の重い分布（対数正規分布、σ=1）にして、ストリーミングの呼び出しを n 回ずつ行う。
+    ヘッジありは期限の学習（HEDGE_MIN_SAMPLES 回）を済ませてから計る。
+    """
+    config.GM_PROVIDER = "mock"
+    config.MOCK_TTFT_MEDIAN = 0.02
+    config.MOCK_TTFT_SIGMA = 1.0
+    config.MOCK_CHARS_PER_SEC = 0
+    config.HEDGE_ROLES = ("gm",)
+    history = [{"role": "user", "content": "ベンチマーク"}]
+
+    async def run(calls: int) -> tuple[list, int]:
+        latencies, hedged = [], 0
+        for _ in range(calls):
+            stats = agents.CallStats()
+            start = time.perf_counter()
+            await agents.acall_gm(history, on_chunk=lambda text: None, stats=stats)
+            latencies.append(time.perf_counter() - start)
+            hedged += stats.hedge is not None
+        return latencies, hedged
+
+    results = {}
+    try:
+        for enabled in (False, True):
+            config.ENABLE_HEDGING = enabled
+            if enabled:
+                asyncio.run(run(config.HEDGE_MIN_SAMPLES))
+            latencies, hedged = asyncio.run(run(n))
+            name = "hedging_on" if enabled else "hedging_off"
+            for q in (50, 95, 99):
+                results[f"{name}_p{q}_ms"] = round(percentile(latencies, q) * 1000, 1)
+            if enabled:
+                results["hedging_extra_requests_ratio"] = round(hedged / n, 3)
+    finally:
+        config.ENABLE_HEDGING = False
+        config.MOCK_TTFT_MEDIAN = 0.0
+    return results
+
+
+def _responses(logger) -> list:
+    """イベントログの応答（種類・再試行か・本文）の一覧"""
+    with open(logger.events_path, encoding="utf-8") as f:
+        events = [json.loads(line) for line in f]
+    return [(e["kind"], e["retry"], e["text"]) for e in events if e["event"] == "response"]
+
+
+def check_replay(turns: int) -> dict:
+    """記録モードで実行したキャンペーンを再生モードで実行し直し、同じ応答が再現されるか確かめる
+
+    PL応答の打ち切り（ENABLE_PL_STREAM_ABORT）が起きるよう、モックの異常応答率を上げて実行する。
+    """
+    saved = (config.LLM_CACHE_MODE, config.LLM_CACHE_DIR, config.ENABLE_STREAMING, config.ENABLE_PL_STREAM_ABORT,
+             config.MOCK_PL_ANOMALY_RATE)
+    _use_mock(turns, compaction=True)
+    config.ENABLE_STREAMING = config.ENABLE_PL_STREAM_ABORT = True
+    config.MOCK_PL_ANOMALY_RATE = 0.5
+    config.LLM_CACHE_DIR = tempfile.mkdtemp(prefix="llm_cache_")
+    try:
+        runs = {}
+        for mode in ("record", "replay"):
+            config.LLM_CACHE_MODE = mode
+            logger = asyncio.run(run_campaign(SCENARIO_TEMPLATE_PATH, ScriptedDecider(max_sessions=1), echo=False))
+            runs[mode] = _responses(logger)
+        aborts = 0
+        for root, _, files in os.walk(config.LLM_CACHE_DIR):
+            for name in files:
+                with open(os.path.join(root, name), encoding="utf-8") as f:
+                    aborts += "aborted" in json.load(f)
+    finally:
+        (config.LLM_CACHE_MODE, config.LLM_CACHE_DIR, config.ENABLE_STREAMING, config.ENABLE_PL_STREAM_ABORT,
+         config.MOCK_PL_ANOMALY_RATE) = saved
+    return {
+        "replay_responses": len(runs["record"]),
+        "replay_stream_aborts": aborts,
+        "replay_match": runs["record"] == runs["replay"],
+    }
+
+
+def _append_batch_results(log_path: str) -> agents.CallStats:
+    """batch_api.py と同じ形式で、バッチAPIの応答の書き戻しをログの末尾に追記する"""
+    stats = agents.CallStats()
+    stats.provider, stats.model = config.PL_PROVIDER, config.PL_MODEL
+    stats.ttft = stats.latency = 312.0
+    stats.input_tokens, stats.output_tokens = 1200, 300
+    stats.batch = "bench_batch"
+    logger = CampaignLogger("", echo=False, filepath=log_path)
+    try:
+        logger.log_batch_results([stats.batch])
+        logger.begin_response("next_hook")
+        logger.write_response("【次回フック】\n書き戻した応答")
+        logger.end_response(stats)
+    finally:
+        logger.close()
+    return stats
+
+
+def check_log_index(turns: int) -> dict:
+    """履歴圧縮とバッチAPIの書き戻しを含むキャンペーンのログを索引用に読み、イベントログと一致するか確かめる
+
+    ターンごとのGM/PL応答の文字数と、書き戻した応答のトークン数がキャンペーンの合計に入るかを比べる。
+    """
+    saved = config.HISTORY_COMPACTION_TOKENS
+    _use_mock(turns, compaction=True)
+    config.HISTORY_COMPACTION_TOKENS = 3000
+    try:
+        logger = asyncio.run(run_campaign(SCENARIO_TEMPLATE_PATH, ScriptedDecider(max_sessions=1), echo=False))
+    finally:
+        config.HISTORY_COMPACTION_TOKENS = saved
+    expected = {}
+    compactions = 0
+    with open(logger.filepath.removesuffix(".md") + ".jsonl", encoding="utf-8") as f:
+        for line in f:
+            event = json.loads(line)
+            if event["event"] == "compaction":
+                compactions += 1
+            elif event["event"] == "response" and event["kind"] in ("gm", "pl"):
+                # ログの索引は改行を除いた文字数を数える
+                chars = expected.setdefault((event["session"], event["turn"]), {"gm_chars": 0, "pl_chars": 0})
+                chars[f"{event['kind']}_chars"] += len(event["text"]) - event["text"].count("\n")
+    before = parse_log(logger.filepath)
+    stats = _append_batch_results(logger.filepath)
+    rows = parse_log(logger.filepath)
+    parsed = {key: {"gm_chars": row["gm_chars"], "pl_chars": row["pl_chars"]}
+              for key, row in rows["turns"].items() if row["gm_chars"] or row["pl_chars"]}
+    batch_tokens = (rows["campaign"]["input_tokens"] - before["campaign"]["input_tokens"],
+                    rows["campaign"]["output_tokens"] - before["campaign"]["output_tokens"])
+    return {
+        "index_compactions": compactions,
+        "index_match": (parsed == expected and rows["turns"] == before["turns"]
+                        and batch_tokens == (stats.input_tokens, stats.output_tokens)),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """基準値より tolerance 倍以上悪化した指標を返す"""
+    regressions = []
+    for key in REGRESSION_METRICS:
+        if key in results and key in baseline and baseline[key] > 0:
+            ratio = results[key] / baseline[key]
+            if ratio > tolerance:
+                regressions.append(f"{key}: {baseline[key]} → {results[key]} (x{ratio:.2f})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="モックプロバイダーによるオフラインベンチマーク")
+    parser.add_argument("--turns", type=int, default=1000, help="計測するキャンペーンのターン数")
+    parser.add_argument("--log-writes", type=int, default=2000, help="ログ書き込みの計測回数")
+    parser.add_argument("--conversions", type=int, default=1000, help="メッセージ変換の計測に使う履歴の長さ")
+    parser.add_argument("--memory-turns", type=int, default=10000, help="検索メモリの計測に使うキャンペーンのターン数")
+    parser.add_argument("--hedge-calls", type=int, default=200, help="ヘッジリクエストの計測で行うGM呼び出しの回数（0で計測しない）")
+    parser.add_argument("--replay-turns", type=int, default=30, help="記録/再生の確認に使うキャンペーンのターン数（0で確認しない）")
+    parser.add_argument("--index-turns", type=int, default=40, help="ログの索引の確認に使うキャンペーンのターン数（0で確認しない）")
+    parser.add_argument("--no-compaction", action="store_true", help="履歴圧縮を無効にして計測")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", help="比較する基準値のJSON")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="劣化とみなす倍率")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    # ログはベンチマーク用の一時ディレクトリに出力する
+    os.chdir(tempfile.mkdtemp(prefix="trpg_bench_"))
+
+    results = {}
+    results.update(bench_campaign(args.turns, compaction=not args.no_compaction))
+    results.update(bench_logger(args.log_writes))
+    results.update(bench_conversion(args.conversions))
+    results.update(bench_memory(args.memory_turns))
+    if args.hedge_calls:
+        results.update(bench_hedging(args.hedge_calls))
+    if args.replay_turns:
+        results.update(check_replay(args.replay_turns))
+    if args.index_turns:
+        results.update(check_log_index(args.index_turns))
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if not results.get("replay_match", True):
+        print("\n⚠️ 再生モードで記録時と異なる応答になりました")
+        sys.exit(1)
+
+    if not results.get("index_match", True):
+        print("\n⚠️ ログの索引がイベントログと一致しません")
+        sys.exit(1)
+
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\n⚠️ 性能劣化を検出:")
+            for line in regressions:
+                print(f"- {line}")
+            sys.exit(1)
+        print("\n✅ 基準値からの劣化なし")
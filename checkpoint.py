@@ -0,0 +1,193 @@
+"""チェックポイント：キャンペーンの進行状態を追記専用のJSONLに保存し、中断したキャンペーンを再開できるようにする
+
+1行目は見出し（シナリオテンプレートとログファイル）、2行目以降は1回のやり取り（ターン・セッションの区切り）ごとに1行。
+各行には前回から増えたメッセージと履歴圧縮の操作だけを書くので、書き込み量は履歴の長さによらない。
+書きかけの最終行（プロセスの強制終了など）は読み込み時に捨てる。
+"""
+import os
+import json
+import time
+from log_writer import get_writer
+
+CHECKPOINT_VERSION = 1
+
+# 再開する位置
+PHASE_SCENARIO = "scenario"  # シナリオ生成の前
+PHASE_SESSION = "session"  # 次のセッションの開始前
+PHASE_TURN = "turn"  # ターンの完了後
+PHASE_SESSION_END = "session_end"  # セッションの終了後（次回フック選択の前）
+PHASE_END = "end"  # キャンペーン終了（再開できない）
+
+
+class CampaignState:
+    """キャンペーンの進行状態（チェックポイントから復元する値）"""
+
+    def __init__(self, scenario_template_path: str, scenario_template: str):
+        self.scenario_template_path = scenario_template_path
+        self.scenario_template = scenario_template
+        self.pl_scenario = ""
+        self.phase = PHASE_SCENARIO
+        self.session_num = 0
+        self.turn = 0
+        self.total_turns = 0
+        self.next_session_instruction = ""
+        self.personas = {}  # PLのキー → PC設定
+        self.histories = {"gm": []}  # "gm" / PLのキー（PartyMember.key） → 会話履歴
+        self.tokens_used = 0  # キャンペーンで使ったトークン数（入力＋出力。トークン予算用）
+        self.session_tokens_start = 0  # 今のセッションの開始時点の tokens_used
+        self.metrics = None  # このキャンペーンの CampaignMetrics（チェックポイントには書かず、commit() で tokens_used を写す）
+        self.memory = None  # GMの検索メモリ（RetrievalMemory。チェックポイントには書かず、再開時に履歴から作り直す）
+
+    @property
+    def gm_history(self) -> list:
+        return self.histories["gm"]
+
+    @property
+    def gm_response(self) -> str:
+        """直近のGM応答（ターン完了後・セッション終了後は履歴の末尾）"""
+        return self.gm_history[-1]["content"] if self.gm_history else ""
+
+    def history(self, role: str) -> list:
+        return self.histories.setdefault(role, [])
+
+
+class CampaignCheckpoint:
+    """進行状態の変化をチェックポイントファイルに追記する
+
+    履歴ごとに書き込み済みの位置を覚えておき、commit() ではそれ以降のメッセージだけを書く。
+    履歴圧縮は compacted() で操作として記録し、再開時に同じ置き換えを再現する。
+    path が None なら何も書かない（ENABLE_CHECKPOINT = False）。
+    """
+
+    def __init__(self, path: str | None, state: CampaignState, log_path: str | None = None):
+        self.path = path
+        self.state = state
+        self._ops = []
+        self._synced = {role: len(history) for role, history in state.histories.items()}
+        self._writer = get_writer()
+        self._file = open(path, "a", encoding="utf-8") if path else None
+        if log_path is not None:
+            # 新しいキャンペーン：見出しを書く
+            self._write({
+                "version": CHECKPOINT_VERSION,
+                "log": log_path,
+                "scenario_template_path": state.scenario_template_path,
+                "scenario_template": state.scenario_template,
+            })
+
+    def _write(self, record: dict):
+        if self._file is None:
+            return
+        self._writer.write(self._file, json.dumps(record, ensure_ascii=False) + "\n")
+        self._writer.flush(self._file)
+
+    def reset(self, role: str):
+        """履歴を空にして記録（新しいセッションのPL履歴）"""
+        self.state.histories[role] = []
+        self._ops.append(["reset", role])
+        self._synced[role] = 0
+
+    def compacted(self, role: str, before_len: int):
+        """履歴圧縮（先頭を要約1件に置き換え）を記録
+
+        before_len: 圧縮前の履歴の長さ。未書き込みのメッセージが要約に含まれた場合は、それらを書かずに済ませる。
+        """
+        history = self.state.history(role)
+        start = before_len - len(history) + 1
+        self._ops.append(["compact", role, start, history[0]])
+        self._synced[role] = 1 + max(0, self._synced.get(role, 0) - start)
+
+    def commit(self, phase: str, **fields):
+        """やり取りの区切りで、前回からの差分と再開する位置を1行で書く"""
+        state = self.state
+        for role, history in state.histories.items():
+            synced = self._synced.get(role, 0)
+            if len(history) > synced:
+                self._ops.append(["append", role, history[synced:]])
+                self._synced[role] = len(history)
+        state.phase = phase
+        if state.metrics is not None:
+            state.tokens_used = state.metrics.tokens_used
+        self._write({
+            "ts": round(time.time(), 3),
+            "phase": phase,
+            "session": state.session_num,
+            "turn": state.turn,
+            "total_turns": state.total_turns,
+            "tokens": state.tokens_used,
+            "session_tokens": state.session_tokens_start,
+            **fields,
+            "ops": self._ops,
+        })
+        self._ops = []
+
+    def close(self):
+        if self._file is not None:
+            self._writer.close(self._file)
+
+
+def _apply(state: CampaignState, record: dict, on_gm_response=None, on_gm_message=None):
+    """1行分の差分を状態に反映する"""
+    for op in record["ops"]:
+        kind, role = op[0], op[1]
+        history = state.history(role)
+        if kind == "append":
+            history.extend(op[2])
+            if role == "gm":
+                for message in op[2]:
+                    if on_gm_message is not None:
+                        on_gm_message(message, record["session"], record["turn"])
+                    if on_gm_response is not None and message["role"] == "assistant":
+                        on_gm_response(message["content"], record["session"], record["turn"])
+        elif kind == "compact":
+            history[:] = [op[3]] + history[op[2]:]
+        elif kind == "reset":
+            history.clear()
+        else:
+            raise ValueError(f"チェックポイントの操作が不明です: {kind}")
+    state.phase = record["phase"]
+    state.session_num = record["session"]
+    state.turn = record["turn"]
+    state.total_turns = record["total_turns"]
+    # トークン数は後から追加した項目（古いチェックポイントでは 0 から数える）
+    state.tokens_used = record.get("tokens", 0)
+    state.session_tokens_start = record.get("session_tokens", 0)
+    if "pl_scenario" in record:
+        state.pl_scenario = record["pl_scenario"]
+    if "personas" in record:
+        state.personas = record["personas"]
+    if "instruction" in record:
+        state.next_session_instruction = record["instruction"]
+
+
+def load_checkpoint(path: str, on_gm_response=None, on_gm_message=None) -> tuple[str, CampaignState]:
+    """チェックポイントを先頭から読み直して状態を復元し、(ログファイルのパス, 状態) を返す
+
+    書きかけの最終行はファイルから切り詰める（続きを追記できるようにする）。
+    on_gm_response: 復元したGM応答ごとに (応答, セッション番号, ターン番号) で呼ばれる
+    on_gm_message: 復元したGMの会話履歴のメッセージごとに (メッセージ, セッション番号, ターン番号) で呼ばれる（圧縮で消えたものを含む）
+    """
+    valid_end = 0
+    header = None
+    state = None
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if header is None:
+                header = record
+                if header.get("version") != CHECKPOINT_VERSION:
+                    raise ValueError(f"チェックポイントの形式が対応していません: {path}")
+                state = CampaignState(header["scenario_template_path"], header["scenario_template"])
+            else:
+                _apply(state, record, on_gm_response, on_gm_message)
+            valid_end += len(line)
+    if header is None:
+        raise ValueError(f"チェックポイントが空です: {path}")
+    if valid_end < os.path.getsize(path):
+        os.truncate(path, valid_end)
+    return header["log"], state
@@ -0,0 +1,99 @@
+"""履歴圧縮：長いキャンペーンでも1ターンあたりの入力トークンを一定に保つ"""
+from agents import acall_history_summary
+import tokens
+import config
+
+# 圧縮後の履歴先頭に置く見出し
+SUMMARY_HEADER = "【これまでの経緯（圧縮済み）】\n以下はこれまでのプレイの要約です。この状態から続きを進行してください。"
+
+
+def history_tokens(history: list, provider: str | None = None) -> int:
+    """会話履歴全体の推定トークン数"""
+    return tokens.history_tokens(history, provider)
+
+
+def _transcript(role: str, messages: list) -> str:
+    """要約に渡すため、履歴を発言者付きの平文にする"""
+    speakers = {"user": "PL/オーケストレーター", "assistant": "GM"} if role == "gm" else {"user": "GM", "assistant": "PL"}
+    return "\n\n".join(f"【{speakers[msg['role']]}】\n{msg['content']}" for msg in messages)
+
+
+class HistoryCompactor:
+    """会話履歴が閾値を超えたら、古いターンをコアセーブ＋あらすじに畳み込む
+
+    role: "gm" / "pl"（要約に使うモデルと発言者の表記を切り替える）
+    pinned: 圧縮後も先頭に原文のまま残すテキスト（GMへの最初の指示など）
+    target: 履歴を送る (プロバイダー, モデル, システムプロンプト)。指定すると、閾値に達していなくても
+            出力の上限（MAX_OUTPUT_TOKENS）を残せないほどコンテキストウィンドウに近づいたら圧縮し、要約もそのモデルで行う
+    threshold: False なら HISTORY_COMPACTION_TOKENS では圧縮せず、コンテキストウィンドウに近づいたときだけ圧縮する
+               （検索メモリで、ターンの呼び出しに送る入力が履歴の長さによらない場合）
+    """
+
+    def __init__(self, role: str, pinned: str = "", target: tuple[str, str, str] | None = None, threshold: bool = True):
+        self.role = role
+        self.pinned = pinned
+        self.target = target
+        self.threshold = threshold
+        self.summary = ""
+        self.chunks = 0  # 直前の圧縮で要約を呼び出した回数（要約の入力が収まらず分けた場合は2以上）
+
+    def _over_context(self, history: list) -> bool:
+        """履歴を送るとコンテキストウィンドウに出力の上限が収まらないか"""
+        if self.target is None:
+            return False
+        provider, model, system_prompt = self.target
+        limit = tokens.input_limit(provider, model, config.MAX_OUTPUT_TOKENS[self.role])
+        if limit is None:
+            return False
+        return tokens.input_tokens(provider, system_prompt, history) > limit
+
+    async def _summarize(self, messages: list) -> tuple[str, int]:
+        """messages を要約し、(要約, 要約を呼び出した回数) を返す
+
+        要約の入力がコンテキストウィンドウに収まらなければ、古い方から区切って順に要約し、
+        各区切りの要約を次の区切りの先頭に畳み込む（どのメッセージも要約から漏らさない）。
+        """
+        target = self.target[:2] if self.target is not None else None
+        summary = None
+        chunks = 0
+        size = len(messages)
+        while messages:
+            while True:
+                chunk = messages[:size]
+                if summary is not None:
+                    chunk = [{"role": "user", "content": f"{SUMMARY_HEADER}\n\n{summary}"}] + chunk
+                try:
+                    text = await acall_history_summary(self.role, _transcript(self.role, chunk), target=target)
+                    break
+                except tokens.ContextLimitError:
+                    # 1件でも収まらなければ圧縮できない（呼び出し元でセッションを終える）
+                    if size <= 1:
+                        raise
+                    size //= 2
+            summary = text
+            chunks += 1
+            messages = messages[size:]
+        return summary, chunks
+
+    async def maybe_compact(self, history: list) -> tuple[int, int] | None:
+        """必要なら history をその場で圧縮し、(圧縮前, 圧縮後) の推定トークン数を返す"""
+        limit = config.HISTORY_COMPACTION_TOKENS if self.threshold else 0
+        # 閾値もコンテキスト上限・トークン予算と同じく、送り先のプロバイダーの係数で数える
+        provider = self.target[0] if self.target is not None else None
+        before = history_tokens(history, provider)
+        if not (limit and before > limit) and not self._over_context(history):
+            return None
+
+        # 直近のやり取りは原文のまま残す（要約メッセージの直後がGM/PL自身の発言になる位置で区切る）
+        start = max(len(history) - 2 * config.HISTORY_KEEP_EXCHANGES, 1)
+        while start < len(history) and history[start]["role"] != "assistant":
+            start += 1
+        if start <= 1 or start >= len(history):
+            return None
+
+        self.summary, self.chunks = await self._summarize(history[:start])
+        head = f"{SUMMARY_HEADER}\n\n{self.summary}"
+        if self.pinned:
+            head = f"{self.pinned}\n\n{head}"
+        history[:] = [{"role": "user", "content": head}] + history[start:]
+        return before, history_tokens(history, provider)
@@ -10,16 +10,185 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
 # === GM設定 ===
-GM_PROVIDER = "anthropic"  # "anthropic", "openai", or "google"
+GM_PROVIDER = "anthropic"  # "anthropic", "openai", "google", or "mock"
 GM_MODEL = "claude-sonnet-4-20250514"
 
 # === PL設定 ===
-PL_PROVIDER = "openai"  # "anthropic", "openai", or "google"
+PL_PROVIDER = "openai"  # "anthropic", "openai", "google", or "mock"
 PL_MODEL = "gpt-4o-mini"
 
+# === パーティ（複数PL） ===
+# 2人以上を指定するとパーティプレイになる（空なら PL_PROVIDER / PL_MODEL の1人）。name は見出しとログに使うPL名（重複不可）
+PARTY = []
+# PARTY = [
+#     {"name": "PL1", "provider": "openai", "model": "gpt-4o-mini"},
+#     {"name": "PL2", "provider": "anthropic", "model": "claude-3-5-haiku-20241022"},
+#     {"name": "PL3", "provider": "google", "model": "gemini-2.0-flash"},
+# ]
+
 # ゲーム設定
 MAX_TURNS = 50  # 1セッションの最大ターン数(安全装置として)
 ENABLE_SESSION_FEEDBACK = True  # Trueでキャンペーン終了時にGM/PLの相互フィードバックを生成
+ENABLE_STREAMING = True  # Trueで応答をストリーミング受信し、コンソール・ログに逐次出力（TTFTを記録）
+ENABLE_PROMPT_CACHE = True  # Trueでプロバイダー側のプロンプトキャッシュを利用（ルールブック入りのシステムプロンプト・履歴）
+GEMINI_CACHE_TTL = 3600  # Geminiのコンテキストキャッシュの有効期間（秒）
+ENABLE_PL_STREAM_ABORT = True  # TrueでPLの応答にGM的な表現が現れた時点で生成を打ち切り、すぐに再試行（ENABLE_STREAMING時のみ）
+ENABLE_GM_PREFETCH = False  # Trueでターン終了後の介入待ちの間に次のGM応答を先行取得（Enterで続行した場合に使用）
+ENABLE_CHECKPOINT = True  # Trueでやり取りごとに logs/campaign_*.checkpoint.jsonl へ差分を追記し、中断したキャンペーンを再開できるようにする
+HISTORY_COMPACTION_TOKENS = 60000  # GM/PL履歴の推定トークン数がこれを超えたら古いターンをコアセーブ＋あらすじに圧縮（0で無効）
+HISTORY_KEEP_EXCHANGES = 6  # 圧縮時に原文のまま残す直近のやり取り数
+
+# 記録/再生キャッシュ（回帰テスト・同一プロンプトの再利用）
+LLM_CACHE_MODE = "passthrough"  # "passthrough": 使わない / "record": ヒット時は再利用・ミス時は記録 / "replay": 記録済みのみ（ミスはエラー）
+LLM_CACHE_DIR = ".llm_cache"  # キャッシュの保存先
+LLM_CACHE_MAX_BYTES = 500 * 1024 * 1024  # キャッシュの最大サイズ（超えたら最終アクセスが古いものから削除）
+
+# === 検索メモリ（履歴全体の代わりに関連する過去の記録をGMに送る） ===
+ENABLE_RETRIEVAL_MEMORY = False  # TrueでGMには最初の指示・直近のやり取り・関連する過去の記録（BM25検索）だけを送る
+MEMORY_RECENT_EXCHANGES = 4  # 原文のまま送る直近のやり取り数
+MEMORY_TOP_K = 5  # 添える過去の記録（段落）の数
+MEMORY_SNIPPET_CHARS = 400  # 記録1件あたりの最大文字数
+MEMORY_NGRAM = 2  # 索引に使う文字n-gramの長さ
+
+# === モデルの振り分け（ターンごとの状況からGM/PLのモデルを選ぶ） ===
+ENABLE_MODEL_ROUTING = False  # TrueでGM/PLのターンの呼び出しごとに MODEL_ROUTING_RULES でモデルの段階を選ぶ（Falseなら常に GM_MODEL / PL_MODEL）
+MODEL_TIERS = {  # 役割ごとの段階 → (プロバイダー, モデル)。"standard" は GM_PROVIDER / GM_MODEL（PLは各自のモデル）、未設定の段階も standard になる
+    "gm": {"light": ("anthropic", "claude-haiku-4-5-20251001"), "heavy": ("anthropic", "claude-opus-4-1-20250805")},
+    "pl": {"heavy": ("openai", "gpt-5-mini")},
+}
+MODEL_ROUTING_RULES = [  # 上から順に評価し、条件をすべて満たした最初のルールの段階を使う（どれにも当たらなければ standard）
+    # 条件: role ("gm"/"pl"), phase ("opening": セッションの最初の描写 / "finale": 最大ターン目前 / "turn"。リスト可),
+    #       min_tension / max_tension（直前の状態表示）, obstacle（障害の有無）, instruction（オーケストレーターの指示の有無）,
+    #       retry（PLの異常応答の再試行）, min_anomalies（直近 ROUTING_ANOMALY_TURNS ターンの異常応答の回数）
+    {"role": "gm", "phase": ["opening", "finale"], "tier": "heavy"},
+    {"role": "gm", "instruction": True, "tier": "heavy"},
+    {"role": "gm", "min_tension": 8, "tier": "heavy"},
+    {"role": "pl", "retry": True, "tier": "heavy"},
+    {"role": "pl", "min_anomalies": 2, "tier": "heavy"},
+    {"role": "gm", "min_tension": 5, "tier": "standard"},
+    {"role": "gm", "obstacle": True, "tier": "standard"},
+    {"role": "gm", "tier": "light"},
+]
+ROUTING_FINALE_TURNS = 3  # 最大ターン数の手前この数のターンを "finale" とする
+ROUTING_ANOMALY_TURNS = 3  # min_anomalies で数える直近のターン数
+
+# === リクエストスケジューラー（レート制限・再試行） ===
+RATE_LIMITS = {  # プロバイダーごとの上限（rpm: リクエスト/分, tpm: 推定トークン/分）。契約プランに合わせて調整
+    "anthropic": {"rpm": 50, "tpm": 80000},
+    "openai": {"rpm": 500, "tpm": 200000},
+    "google": {"rpm": 150, "tpm": 1000000},
+}
+MAX_RETRIES = 5  # 429/5xx/接続エラー時の最大再試行回数
+RETRY_BACKOFF_BASE = 1.0  # 再試行の待ち時間の基準（秒、指数的に増加・ジッター付き）
+RETRY_BACKOFF_MAX = 60.0  # 再試行の待ち時間の上限（秒）
+CIRCUIT_FAILURE_THRESHOLD = 5  # 連続でこの回数失敗したプロバイダーへのリクエストを一時停止
+CIRCUIT_COOLDOWN = 30.0  # 一時停止する秒数
+HTTP_MAX_CONNECTIONS = 100  # プロバイダーごとのHTTPコネクションプールの上限
+
+# === ヘッジリクエスト（応答の遅い呼び出しに予備のリクエストを送る） ===
+ENABLE_HEDGING = False  # Trueで最初のトークンが期限までに届かない呼び出しに予備のリクエストを送り、先に応答した方を使う（もう一方は取り消す）
+HEDGE_ROLES = ("gm", "pl")  # ヘッジする呼び出しの役割
+HEDGE_PERCENTILE = 95  # 期限にするTTFTのパーセンタイル（プロバイダー・モデルごとの直近の実績から学習）
+HEDGE_WINDOW = 200  # 期限の学習に使う直近のTTFTの数
+HEDGE_MIN_SAMPLES = 20  # 実績がこれより少ない間は HEDGE_DEFAULT_DEADLINE を期限にする
+HEDGE_DEFAULT_DEADLINE = 10.0  # 実績が少ない間の期限（秒）
+HEDGE_FALLBACKS = {}  # モデル → 予備のリクエストの送り先 (プロバイダー, モデル)。未設定なら同じモデルに送る（元のリクエストが失敗したときの切り替え先にもなる）
+# HEDGE_FALLBACKS = {"claude-sonnet-4-20250514": ("openai", "gpt-4o")}
+PL_RETRY_CANDIDATES = 1  # PLの異常応答の再試行で並行して生成する候補の数（2以上で、最初に検証を通った候補を使う）
+
+# === バッチAPIでの後回し実行（batch_api.py） ===
+ENABLE_DEFERRED_CALLS = False  # Trueで即時の応答が不要な呼び出しを待ち行列に入れ、後からバッチAPIでまとめて実行する（結果はログに書き戻す）
+DEFERRED_ROLES = ("gm_feedback", "pl_feedback")  # 後回しにする呼び出し（シナリオ生成は batch_api.py prepare で後回しにする）
+DEFERRED_QUEUE_PATH = "logs/deferred_calls.jsonl"  # 後回しにした呼び出しの待ち行列（複数のキャンペーン・プロセスで共有）
+BATCH_MAX_REQUESTS = 10000  # 1つのバッチにまとめるリクエスト数の上限
+BATCH_POLL_INTERVAL = 60.0  # バッチの完了を確認する間隔（秒）
+BATCH_DISCOUNT = 0.5  # バッチAPIの料金（通常の料金に対する割合。推定コスト用）
+
+# === トークン予算（ローカルでの推定トークン数による出力上限・コンテキスト上限・予算） ===
+MAX_OUTPUT_TOKENS = {  # 呼び出しの役割 → 出力トークン数の上限（入力が大きくコンテキストウィンドウに収まらない分は自動で縮める）
+    "gm": 3000,
+    "pl": 2000,
+    "scenario": 2000,
+    "next_hook": 3000,
+    "gm_feedback": 4000,
+    "pl_feedback": 4000,
+    "compaction": 2000,
+}
+MODEL_CONTEXT_WINDOWS = {  # モデル → コンテキストウィンドウ（トークン数、参考値）
+    "claude-opus-4-1-20250805": 200000,
+    "claude-sonnet-4-20250514": 200000,
+    "claude-haiku-4-5-20251001": 200000,
+    "gpt-5.2": 400000,
+    "gpt-5-mini": 400000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gemini-3.1-pro-preview": 1000000,
+    "gemini-2.5-pro": 1000000,
+    "gemini-2.5-flash": 1000000,
+    "gemini-2.0-flash": 1000000,
+    "gemini-2.0-flash-lite": 1000000,
+}
+DEFAULT_CONTEXT_WINDOW = 128000  # MODEL_CONTEXT_WINDOWS にないモデルのコンテキストウィンドウ
+CONTEXT_SAFETY_MARGIN = 0.1  # 推定の誤差に備えて空けておくコンテキストウィンドウの割合
+MIN_OUTPUT_TOKENS = 500  # 出力にこれだけ残せない入力は送らない（履歴を圧縮し、それでも収まらなければセッションを終える）
+SESSION_TOKEN_BUDGET = 0  # 1セッションで使うトークン数（入力＋出力）の上限。超えたらそのターンでセッションを終える（0で無制限）
+CAMPAIGN_TOKEN_BUDGET = 0  # 1キャンペーンで使うトークン数の上限。超えたらセッションを終え、キャンペーンも終える（0で無制限）
+
+# === ペアリング・トーナメント（tournament.py：GM×PLのモデルの組み合わせの比較） ===
+TOURNAMENT_GM_MODELS = [  # 比べるGMの (プロバイダー, モデル)。PLの候補とのすべての組み合わせを比べる
+    ("anthropic", "claude-sonnet-4-20250514"),
+    ("google", "gemini-2.5-pro"),
+]
+TOURNAMENT_PL_MODELS = [  # 比べるPLの (プロバイダー, モデル)
+    ("openai", "gpt-4o-mini"),
+    ("google", "gemini-2.5-flash"),
+]
+TOURNAMENT_INITIAL_RUNS = 2  # 1回目に組み合わせごとに実行するキャンペーン数
+TOURNAMENT_ETA = 2  # 各回で残す組み合わせの割合の逆数（上位 1/ETA を残し、次の回の実行数を ETA 倍にする）
+TOURNAMENT_MAX_ROUNDS = 4  # 最大の回数
+TOURNAMENT_BUDGET_USD = 0.0  # 推定コストの上限（USD、0で無制限。実績の平均から収まる数だけ実行する）
+TOURNAMENT_CONFIDENCE = 0.95  # スコアの信頼区間の信頼水準（上限が首位の下限を下回った組み合わせはその回で落とす）
+TOURNAMENT_WEIGHTS = {  # スコアの重み（★評価: GM/PLの振り返りの平均 / 異常応答: 1 - PLの異常応答率 / 完了: GM判断で終えたセッションの割合）
+    "rating": 0.6,
+    "anomaly": 0.3,
+    "completion": 0.1,
+}
+
+# === 計測（トークン数・レイテンシ・推定コスト） ===
+ENABLE_METRICS_EXPORT = True  # Trueでキャンペーンごとに logs/campaign_*.metrics.json と logs/campaign_*.prom（Prometheus textfile形式）を出力
+MODEL_PRICES = {  # 推定コスト用の料金（USD / 100万トークン、参考値）。cached: キャッシュ読み込み, cache_write: キャッシュ書き込み（省略時は input と同額）
+    "claude-opus-4-1-20250805": {"input": 15.0, "cached": 1.50, "cache_write": 18.75, "output": 75.0},
+    "claude-sonnet-4-20250514": {"input": 3.0, "cached": 0.30, "cache_write": 3.75, "output": 15.0},
+    "claude-haiku-4-5-20251001": {"input": 1.0, "cached": 0.10, "cache_write": 1.25, "output": 5.0},
+    "gpt-5.2": {"input": 1.75, "cached": 0.175, "output": 14.0},
+    "gpt-5-mini": {"input": 0.25, "cached": 0.025, "output": 2.0},
+    "gpt-4o": {"input": 2.5, "cached": 1.25, "output": 10.0},
+    "gpt-4o-mini": {"input": 0.15, "cached": 0.075, "output": 0.6},
+    "gemini-3.1-pro-preview": {"input": 2.0, "cached": 0.20, "output": 12.0},
+    "gemini-2.5-pro": {"input": 1.25, "cached": 0.125, "output": 10.0},
+    "gemini-2.5-flash": {"input": 0.30, "cached": 0.03, "output": 2.5},
+    "gemini-2.0-flash": {"input": 0.10, "cached": 0.025, "output": 0.40},
+    "gemini-2.0-flash-lite": {"input": 0.075, "output": 0.30},
+}
+
+# === HTTPサーバー（server.py：複数キャンペーンの並行実行とSSE配信） ===
+SERVER_HOST = "127.0.0.1"  # 待ち受けるアドレス（認証はないので、外部に公開しないこと）
+SERVER_PORT = 8000  # 待ち受けるポート
+SERVER_MAX_CAMPAIGNS = 100  # 保持するキャンペーン数の上限（超えたら終了済みの古いものから破棄、実行中だけで埋まっていれば開始を断る）
+SERVER_EVENT_BUFFER = 2000  # キャンペーンごとに保持する出力イベント数（購読の再接続時に再送できる範囲）
+SERVER_KEEPALIVE = 15.0  # SSEで出力がないときにコメント行を送る間隔（秒）
+
+# === モックプロバイダー（APIキー不要のオフライン検証用） ===
+# GM_PROVIDER / PL_PROVIDER に "mock" を指定すると、ルールに沿った応答を疑似生成する
+MOCK_TTFT_MEDIAN = 0.0  # 最初のトークンまでの遅延の中央値（秒、0で遅延なし）
+MOCK_TTFT_SIGMA = 0.5  # 遅延のばらつき（対数正規分布のσ）
+MOCK_CHARS_PER_SEC = 0  # 出力速度（文字/秒、0で即時）
+MOCK_PL_ANOMALY_RATE = 0.1  # PLが異常応答（行動宣言なし/GM的な振る舞い）を返す確率
+MOCK_SESSION_TURNS = 8  # GMが【セッション終了】を出すターン数
+MOCK_SEED = 0  # 応答生成の乱数シード
+MOCK_BATCH_DIR = "logs/mock_batches"  # ローカルのバッチAPI（代役）がバッチを保存するディレクトリ
+MOCK_BATCH_DELAY = 0.0  # ローカルのバッチAPIでバッチが完了するまでの秒数
+MOCK_CONTEXT_WINDOW = 0  # モックのコンテキストウィンドウ（トークン数、0で無制限。コンテキスト上限の動作確認用）
 
 # === モデルの選択肢（参考） ===
 # "anthropic" : "claude-opus-4-1-20250805","claude-sonnet-4-20250514", "claude-haiku-4-5-20251001"
@@ -0,0 +1,84 @@
+"""後回し実行の待ち行列：即時の応答が不要な呼び出しを溜めておき、後からバッチAPIでまとめて実行する（実行は batch_api.py）
+
+待ち行列は追記専用のJSONL（DEFERRED_QUEUE_PATH）で、複数のキャンペーン・プロセスが1行ずつ追記する。
+- request: 後回しにした呼び出し（acall_llm() の引数と、結果を書き戻すログ・チェックポイント）
+- submitted: バッチに送ったリクエストとバッチID
+- done: 書き戻した結果（失敗なら error）
+書きかけの最終行（プロセスの強制終了など）は読み込み時に無視する。
+"""
+import os
+import json
+import time
+import uuid
+import config
+
+
+def enabled(kind: str) -> bool:
+    """この種別の呼び出しを後回しにするか"""
+    return config.ENABLE_DEFERRED_CALLS and kind in config.DEFERRED_ROLES
+
+
+class DeferredQueue:
+    """後回しにした呼び出しの待ち行列"""
+
+    def __init__(self, path: str | None = None):
+        self.path = path or config.DEFERRED_QUEUE_PATH
+
+    def _append(self, records: list):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # 1回の write で追記する（他のプロセスの行と混ざらないように）
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+
+    def enqueue(self, kind: str, request: dict, log_path: str, checkpoint_path: str | None = None, session: int = 0,
+                turn: int = 0, speaker: str | None = None, member: str | None = None) -> str:
+        """呼び出しを待ち行列に入れて id を返す
+
+        request: acall_llm() の引数（provider, model, system_prompt, messages, max_tokens, role）
+        member: シナリオ生成ではPLのキー（全員の結果がそろったらチェックポイントに書き戻す）
+        """
+        request_id = uuid.uuid4().hex[:16]
+        self._append([{
+            "type": "request", "id": request_id, "ts": round(time.time(), 3), "kind": kind, "log": log_path,
+            "checkpoint": checkpoint_path, "session": session, "turn": turn, "speaker": speaker, "member": member,
+            "request": request,
+        }])
+        return request_id
+
+    def mark_submitted(self, batch_id: str, provider: str, model: str, ids: list):
+        self._append([{"type": "submitted", "batch": batch_id, "ts": round(time.time(), 3), "provider": provider,
+                       "model": model, "ids": ids}])
+
+    def mark_done(self, results: list):
+        """書き戻した結果を記録する（results: (id, 応答, エラー) のリスト）"""
+        self._append([{"type": "done", "id": request_id, "ts": round(time.time(), 3), "text": text, "error": error}
+                      for request_id, text, error in results])
+
+    def load(self) -> tuple[dict, dict, dict]:
+        """(id → request, バッチID → submitted, id → done) を返す（どれも待ち行列に入った順）"""
+        requests, batches, done = {}, {}, {}
+        if not os.path.exists(self.path):
+            return requests, batches, done
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                record = json.loads(line)
+                if record["type"] == "request":
+                    requests[record["id"]] = record
+                elif record["type"] == "submitted":
+                    batches[record["batch"]] = record
+                elif record["type"] == "done":
+                    done[record["id"]] = record
+        return requests, batches, done
+
+
+def defer(logger, kind: str, request: dict, speaker: str | None = None, member: str | None = None) -> str:
+    """呼び出しを待ち行列に入れ、キャンペーンのログに記録して id を返す
+
+    logger: CampaignLogger（ログ・チェックポイントのパスと、今のセッション・ターンを記録する）
+    """
+    request_id = DeferredQueue().enqueue(kind, request, logger.filepath, logger.checkpoint_path, logger.session_count,
+                                         logger.current_turn, speaker, member)
+    logger.log_deferred(kind, request_id, speaker)
+    return request_id
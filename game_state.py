@@ -0,0 +1,155 @@
+"""ゲーム状態の追跡：GM応答の状態表示（ルールブック4章）を解析し、ターンごとの推移を記録する"""
+import re
+from array import array
+
+# 状態表示の項目（ルールブック「4. ターン出力フォーマット」の固定項目）
+STATUS_FIELDS = ["Turn", "セッションの舞台", "セッションの目的", "HP", "SP", "Tension", "障害", "所持品"]
+
+# 時系列で値がないことを表す値（値は array("h") に収まる範囲に丸める）
+MISSING = -32768
+_VALUE_LIMIT = 32767
+
+TENSION_MAX = 10  # 11以上は事故イベントで半減させる（ルールブック「Tension段階」）
+
+_STATUS_LINE = re.compile(
+    r"^[ \t]*(?:[-*・][ \t]*)?\**(" + "|".join(re.escape(f) for f in STATUS_FIELDS) + r")\**[ \t]*[:：][ \t]*(.*?)[ \t]*$",
+    re.MULTILINE,
+)
+_NUMBER = re.compile(r"-?\d+")
+
+
+def parse_status(text: str) -> dict:
+    """応答から状態表示の項目を取り出す（同じ項目が複数あれば最後のものを使う）"""
+    return {name: value.strip("*").strip() for name, value in _STATUS_LINE.findall(text)}
+
+
+def _numbers(value: str | None) -> list:
+    return [int(n) for n in _NUMBER.findall(value)] if value else []
+
+
+class GameState:
+    """最新のゲーム状態（値が読み取れなかった項目は前回の値を引き継ぐ）"""
+
+    __slots__ = ("session", "turn", "stage", "goal", "hp", "hp_max", "sp", "sp_max", "tension", "obstacle",
+                 "inventory")
+
+    def __init__(self):
+        self.session = 0
+        self.turn = None  # GMが表示したTurn
+        self.stage = ""
+        self.goal = ""
+        self.hp = None
+        self.hp_max = None
+        self.sp = None
+        self.sp_max = None
+        self.tension = None
+        self.obstacle = ""
+        self.inventory = ()
+
+    def to_dict(self) -> dict:
+        return {name: (list(getattr(self, name)) if name == "inventory" else getattr(self, name))
+                for name in self.__slots__}
+
+
+class StateSeries:
+    """ターンごとの HP/SP/Tension の推移（値がない箇所は MISSING）"""
+
+    COLUMNS = ("session", "turn", "hp", "sp", "tension")
+
+    def __init__(self):
+        self.session = array("h")
+        self.turn = array("h")  # オーケストレーターのターン番号
+        self.hp = array("h")
+        self.sp = array("h")
+        self.tension = array("h")
+
+    def __len__(self) -> int:
+        return len(self.turn)
+
+    def append(self, session: int, turn: int, hp, sp, tension):
+        self.session.append(min(session, _VALUE_LIMIT))
+        self.turn.append(min(turn, _VALUE_LIMIT))
+        for column, value in ((self.hp, hp), (self.sp, sp), (self.tension, tension)):
+            column.append(MISSING if value is None else max(-_VALUE_LIMIT, min(_VALUE_LIMIT, value)))
+
+    def column(self, name: str) -> list:
+        """列の値（MISSING は None にする）"""
+        return [None if v == MISSING else v for v in getattr(self, name)]
+
+    def to_dict(self) -> dict:
+        return {name: self.column(name) for name in self.COLUMNS}
+
+
+class GameStateTracker:
+    """GM応答ごとに状態表示を解析し、GameState と StateSeries を更新してルール違反を検出する"""
+
+    def __init__(self):
+        self.state = GameState()
+        self.series = StateSeries()
+        self.violations = []  # {"session", "turn", "message"}
+
+    def update(self, gm_response: str, session: int, turn: int) -> list:
+        """GM応答を取り込み、このターンのルール違反を返す"""
+        status = parse_status(gm_response)
+        state = self.state
+        found = []
+        shown = {}  # このターンに読み取れた HP/SP/Tension
+
+        missing = [name for name in STATUS_FIELDS if name not in status]
+        if len(missing) == len(STATUS_FIELDS):
+            found.append("状態表示がありません")
+        elif missing:
+            found.append(f"状態表示の項目が不足: {', '.join(missing)}")
+
+        if session != state.session:
+            state.session = session
+            state.turn = None
+        shown_turn = _numbers(status.get("Turn"))
+        if shown_turn:
+            if state.turn is not None and shown_turn[0] < state.turn:
+                found.append(f"Turn が戻っています（{state.turn} → {shown_turn[0]}）")
+            state.turn = shown_turn[0]
+
+        for name, attr, limit_attr in (("HP", "hp", "hp_max"), ("SP", "sp", "sp_max")):
+            values = _numbers(status.get(name))
+            if not values:
+                if name in status:
+                    found.append(f"{name} の値を読み取れません: {status[name]}")
+                continue
+            setattr(state, attr, values[0])
+            shown[attr] = values[0]
+            if len(values) > 1:
+                setattr(state, limit_attr, values[1])
+            limit = getattr(state, limit_attr)
+            if values[0] < 0 or (limit is not None and values[0] > limit):
+                found.append(f"{name} が範囲外: {status[name]}")
+
+        tension = _numbers(status.get("Tension"))
+        if tension:
+            state.tension = shown["tension"] = tension[0]
+            if not 0 <= tension[0] <= TENSION_MAX:
+                found.append(f"Tension が範囲外（0〜{TENSION_MAX}、11以上は事故イベントで半減）: {tension[0]}")
+        elif "Tension" in status:
+            found.append(f"Tension の値を読み取れません: {status['Tension']}")
+
+        if "セッションの舞台" in status:
+            state.stage = status["セッションの舞台"]
+        if "セッションの目的" in status:
+            state.goal = status["セッションの目的"]
+        if "障害" in status:
+            state.obstacle = status["障害"]
+        if "所持品" in status:
+            state.inventory = tuple(item.strip() for item in re.split(r"[、,，/]", status["所持品"]) if item.strip())
+
+        self.series.append(session, turn, shown.get("hp"), shown.get("sp"), shown.get("tension"))
+        for message in found:
+            self.violations.append({"session": session, "turn": turn, "message": message})
+        return found
+
+    def to_dict(self) -> dict:
+        """ログと一緒に保存する形式"""
+        return {
+            "state": self.state.to_dict(),
+            "series": self.series.to_dict(),
+            "violations": self.violations,
+        }
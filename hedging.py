@@ -0,0 +1,148 @@
+"""ヘッジリクエスト：最初のトークンがなかなか届かない呼び出しに予備のリクエストを送り、先に応答した方を使う
+
+期限はプロバイダー・モデルごとの直近のTTFT（非ストリーミングは応答時間）の HEDGE_PERCENTILE パーセンタイル。
+期限を過ぎても最初のトークンが届かなければ、同じ内容を HEDGE_FALLBACKS の送り先（未設定なら同じモデル）にも送る。
+ストリーミングでは先に最初のトークンが届いた方、非ストリーミングでは先に完了した方を使い、もう一方は取り消す。
+元のリクエストが失敗した場合も、期限を待たずに予備のリクエストを送る（別のプロバイダーへのフェイルオーバー）。
+"""
+import time
+import asyncio
+from collections import deque
+import config
+from metrics import percentile
+
+
+class LatencyTracker:
+    """プロバイダー・モデルごとの直近のTTFT（期限の学習用）"""
+
+    def __init__(self):
+        self._samples = {}  # (プロバイダー, モデル, ストリーミングか) → deque
+
+    def record(self, provider: str, model: str, streamed: bool, seconds: float):
+        key = (provider, model, streamed)
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=config.HEDGE_WINDOW)
+        samples.append(seconds)
+
+    def deadline(self, provider: str, model: str, streamed: bool) -> float:
+        """予備のリクエストを送るまでの秒数（実績が少ない間は HEDGE_DEFAULT_DEADLINE）"""
+        samples = self._samples.get((provider, model, streamed))
+        if samples is None or len(samples) < config.HEDGE_MIN_SAMPLES:
+            return config.HEDGE_DEFAULT_DEADLINE
+        return percentile(samples, config.HEDGE_PERCENTILE)
+
+
+_tracker = LatencyTracker()
+
+
+def get_tracker() -> LatencyTracker:
+    """プロセス共通のTTFTの記録を取得"""
+    return _tracker
+
+
+def enabled(role: str) -> bool:
+    return config.ENABLE_HEDGING and role in config.HEDGE_ROLES
+
+
+def fallback(provider: str, model: str) -> tuple[str, str]:
+    """予備のリクエストの送り先"""
+    return tuple(config.HEDGE_FALLBACKS.get(model, (provider, model)))
+
+
+class HedgedRequest:
+    """競争させる1つのリクエスト"""
+
+    def __init__(self, index: int, target: tuple[str, str]):
+        self.index = index
+        self.target = target
+        self.started = time.perf_counter()
+        self.first_token = None  # 最初のトークンが届いた時刻
+        self.task = None
+        self.stats = None
+
+
+class Hedge:
+    """元のリクエストと、期限を過ぎたら送る予備のリクエストの競争
+
+    start_request(target, on_chunk) は (コルーチン, CallStats) を返す。
+    run() の後（例外でも）、requests に送ったリクエスト、winner に使ったリクエストの番号（決まらなければ None）が残る。
+    """
+
+    def __init__(self, start_request, target: tuple[str, str], streamed: bool):
+        self.start_request = start_request
+        self.target = target
+        self.streamed = streamed
+        self.requests = []
+        self.winner = None
+
+    def _launch(self, target: tuple[str, str], first: asyncio.Future, on_chunk):
+        request = HedgedRequest(len(self.requests), target)
+
+        def relay(text: str):
+            if request.first_token is None:
+                request.first_token = time.perf_counter()
+            if not first.done():
+                # 最初のトークンが届いた方を使い、他は取り消す
+                first.set_result(request.index)
+                self.winner = request.index
+                for other in self.requests:
+                    if other is not request:
+                        other.task.cancel()
+            if self.winner == request.index:
+                on_chunk(text)
+
+        coro, request.stats = self.start_request(target, relay if on_chunk is not None else None)
+        request.task = asyncio.create_task(coro)
+        self.requests.append(request)
+
+    async def run(self, on_chunk=None) -> str:
+        """先に応答した方の応答を返す（使わなかったリクエストは取り消す）"""
+        first = asyncio.get_running_loop().create_future()  # 最初のトークンが届いたリクエストの番号
+        requests = self.requests
+        tracker = get_tracker()
+        self._launch(self.target, first, on_chunk)
+        timeout = tracker.deadline(*self.target, self.streamed)
+        try:
+            while True:
+                running = [request.task for request in requests if not request.task.done()]
+                done, _ = await asyncio.wait(running + [first], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if first.done():
+                    break
+                succeeded = [r for r in requests if r.task.done() and not r.task.cancelled() and r.task.exception() is None]
+                if succeeded:
+                    self.winner = succeeded[0].index
+                    break
+                backup = fallback(*self.target)
+                if len(requests) == 1 and (not done or backup != self.target):
+                    # 期限切れ、または元のリクエストの失敗（同じ送り先への再送はスケジューラーの再試行に任せる）
+                    self._launch(backup, first, on_chunk)
+                    timeout = None
+                    continue
+                if all(request.task.done() for request in requests):
+                    await requests[0].task  # すべて失敗したら元のリクエストの例外を送出する
+                timeout = None
+            for request in requests:
+                if request.index != self.winner:
+                    request.task.cancel()
+            return await requests[self.winner].task
+        except BaseException:
+            for request in requests:
+                request.task.cancel()
+            raise
+        finally:
+            _learn(tracker, requests, self.winner, self.streamed)
+
+
+def _learn(tracker: LatencyTracker, requests: list, winner: int | None, streamed: bool):
+    """TTFTを記録する
+
+    競争に負けて取り消したリクエストは、少なくともそれまで待った時間として記録する（遅い方を記録しないと期限が縮み続けるため）。
+    """
+    now = time.perf_counter()
+    for request in requests:
+        if request.first_token is not None:
+            tracker.record(*request.target, streamed, request.first_token - request.started)
+        elif winner is not None:
+            # 非ストリーミングの勝者は応答時間、敗者は取り消しまでの時間
+            tracker.record(*request.target, streamed, now - request.started)
@@ -0,0 +1,108 @@
+"""LLM呼び出しの記録/再生キャッシュ（内容アドレス方式・ディスク上でLRU管理）"""
+import os
+import json
+import hashlib
+import tempfile
+import config
+
+# キャッシュモード
+# "passthrough": キャッシュを使わない（通常運用）
+# "record": ヒットすればキャッシュから返し、ミスならAPIを呼んで記録する
+# "replay": キャッシュからのみ返す。ミスは CacheMissError（回帰テスト用）
+CACHE_MODES = ("passthrough", "record", "replay")
+
+
+class CacheMissError(LookupError):
+    """replayモードでキャッシュにない呼び出しが行われた"""
+
+
+class LLMCache:
+    """(provider, model, system_prompt, messages, max_tokens) のハッシュをキーに応答を保存する
+
+    最終アクセス時刻（mtime）で LRU を判定し、合計サイズが max_bytes を超えたら古いものから削除する。
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self._sizes = {}
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    self._sizes[path] = os.path.getsize(path)
+        self._total = sum(self._sizes.values())
+
+    @staticmethod
+    def make_key(provider: str, model: str, system_prompt: str, messages: list, max_tokens: int) -> str:
+        """呼び出し内容からキャッシュキーを作る"""
+        payload = json.dumps([provider, model, system_prompt, messages, max_tokens], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> dict | None:
+        """キャッシュ済みの応答を返す（なければNone）
+
+        text: 応答テキスト / aborted: 生成を打ち切った応答なら打ち切りの理由（text は受信済みの分）
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        os.utime(path)  # LRU用にアクセス時刻を更新
+        return entry
+
+    def put(self, key: str, text: str, provider: str, model: str, aborted: str | None = None):
+        """応答を保存する（書き込み途中のファイルを読まれないよう、一時ファイル経由で置き換える）
+
+        aborted: 生成を打ち切った応答なら打ち切りの理由（再生時も同じ位置で打ち切る）
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"provider": provider, "model": model, "text": text}
+        if aborted is not None:
+            entry["aborted"] = aborted
+        data = json.dumps(entry, ensure_ascii=False)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        size = os.path.getsize(path)
+        self._total += size - self._sizes.get(path, 0)
+        self._sizes[path] = size
+        if self._total > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        """最終アクセスが古いものから削除して上限内に収める"""
+        by_access = sorted(self._sizes, key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in by_access:
+            if self._total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._total -= self._sizes.pop(path)
+
+
+_cache = None
+
+
+def get_cache() -> LLMCache | None:
+    """設定に応じたキャッシュを返す（passthroughならNone）"""
+    global _cache
+    if config.LLM_CACHE_MODE not in CACHE_MODES:
+        raise ValueError(f"Unknown LLM_CACHE_MODE: {config.LLM_CACHE_MODE}")
+    if config.LLM_CACHE_MODE == "passthrough":
+        return None
+    if _cache is None or _cache.directory != config.LLM_CACHE_DIR:
+        _cache = LLMCache(config.LLM_CACHE_DIR, config.LLM_CACHE_MAX_BYTES)
+    return _cache
@@ -0,0 +1,518 @@
+"""ログインデクサー：キャンペーンログ（Markdown）をSQLiteに索引付けし、集計クエリを実行する
+
+ログは1行ずつ読み込むので、ファイル全体をメモリに載せない。
+前回から更新日時・サイズが変わったファイルだけを索引し直す。
+
+    python log_index.py index                       # logs/ を logs/index.sqlite に索引付け
+    python log_index.py query --list                # 用意された集計クエリの一覧
+    python log_index.py query anomaly_rate          # PLモデルごとの異常応答率
+    python log_index.py sql "SELECT COUNT(*) FROM turns"
+"""
+import os
+import re
+import glob
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from orchestrator import RESPONSE_LABELS
+
+DEFAULT_LOG_DIR = "logs"
+DEFAULT_DB = os.path.join(DEFAULT_LOG_DIR, "index.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    started_at TEXT,
+    ended_at TEXT,
+    gm_provider TEXT,
+    gm_model TEXT,
+    pl_provider TEXT,
+    pl_model TEXT,
+    end_reason TEXT,
+    total_sessions INTEGER,
+    total_turns INTEGER,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    cost_usd REAL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    campaign_id INTEGER NOT NULL,
+    session INTEGER NOT NULL,
+    started_at TEXT,
+    ended_at TEXT,
+    end_reason TEXT,
+    turns INTEGER,
+    instruction TEXT,
+    PRIMARY KEY (campaign_id, session)
+);
+CREATE TABLE IF NOT EXISTS turns (
+    campaign_id INTEGER NOT NULL,
+    session INTEGER NOT NULL,
+    turn INTEGER NOT NULL,
+    gm_responses INTEGER,
+    pl_responses INTEGER,
+    pl_retries INTEGER,
+    gm_chars INTEGER,
+    pl_chars INTEGER,
+    gm_latency REAL,
+    pl_latency REAL,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    PRIMARY KEY (campaign_id, session, turn)
+);
+CREATE TABLE IF NOT EXISTS anomalies (
+    campaign_id INTEGER NOT NULL,
+    session INTEGER,
+    turn INTEGER,
+    role TEXT,
+    kind TEXT,
+    reason TEXT,
+    aborted INTEGER
+);
+CREATE TABLE IF NOT EXISTS interventions (
+    campaign_id INTEGER NOT NULL,
+    session INTEGER,
+    turn INTEGER,
+    kind TEXT,
+    text TEXT
+);
+CREATE INDEX IF NOT EXISTS anomalies_campaign ON anomalies (campaign_id);
+CREATE INDEX IF NOT EXISTS interventions_campaign ON interventions (campaign_id);
+"""
+
+# 用意された集計クエリ: 名前 -> (説明, SQL)
+QUERIES = {
+    "campaigns": (
+        "最近のキャンペーン一覧",
+        """SELECT path, started_at, gm_provider || '/' || gm_model AS gm, pl_provider || '/' || pl_model AS pl,
+                  total_sessions, total_turns, end_reason, ROUND(cost_usd, 4) AS cost_usd
+           FROM campaigns ORDER BY started_at DESC LIMIT 20""",
+    ),
+    "turns_per_session": (
+        "GMモデルごとのセッションあたり平均ターン数",
+        """SELECT c.gm_provider || '/' || c.gm_model AS gm, COUNT(*) AS sessions, ROUND(AVG(s.turns), 2) AS avg_turns
+           FROM sessions s JOIN campaigns c ON c.id = s.campaign_id
+           WHERE s.turns IS NOT NULL
+           GROUP BY gm ORDER BY sessions DESC""",
+    ),
+    "anomaly_rate": (
+        "PLモデルごとの異常応答率（異常検知の回数 / PLの行動ターン数）",
+        """SELECT c.pl_provider || '/' || c.pl_model AS pl,
+                  SUM(t.pl_turns) AS pl_turns,
+                  SUM(COALESCE(a.anomalies, 0)) AS anomalies,
+                  SUM(COALESCE(a.aborted, 0)) AS aborted,
+                  ROUND(1.0 * SUM(COALESCE(a.anomalies, 0)) / SUM(t.pl_turns), 4) AS anomaly_rate
+           FROM campaigns c
+           JOIN (SELECT campaign_id, COUNT(*) AS pl_turns FROM turns WHERE pl_responses > 0 GROUP BY campaign_id) t
+             ON t.campaign_id = c.id
+           LEFT JOIN (SELECT campaign_id, COUNT(*) AS anomalies, SUM(aborted) AS aborted
+                      FROM anomalies WHERE kind = 'pl_response' GROUP BY campaign_id) a
+             ON a.campaign_id = c.id
+           GROUP BY pl ORDER BY pl_turns DESC""",
+    ),
+    "state_violations": (
+        "GMモデルごとの状態表示の違反率（違反の数 / GM応答数）",
+        """SELECT c.gm_provider || '/' || c.gm_model AS gm,
+                  SUM(t.gm_responses) AS gm_responses,
+                  SUM(COALESCE(v.violations, 0)) AS violations,
+                  ROUND(1.0 * SUM(COALESCE(v.violations, 0)) / SUM(t.gm_responses), 4) AS violation_rate
+           FROM campaigns c
+           JOIN (SELECT campaign_id, SUM(gm_responses) AS gm_responses FROM turns GROUP BY campaign_id) t
+             ON t.campaign_id = c.id
+           LEFT JOIN (SELECT campaign_id, COUNT(*) AS violations FROM anomalies WHERE kind = 'game_state' GROUP BY campaign_id) v
+             ON v.campaign_id = c.id
+           GROUP BY gm ORDER BY gm_responses DESC""",
+    ),
+    "end_reasons": (
+        "セッションの終了理由の内訳",
+        """SELECT COALESCE(end_reason, '(未終了)') AS end_reason, COUNT(*) AS sessions, ROUND(AVG(turns), 2) AS avg_turns
+           FROM sessions GROUP BY end_reason ORDER BY sessions DESC""",
+    ),
+    "intervention_rate": (
+        "GMモデルごとの人間の介入率（ターン中の介入数 / ターン数）",
+        """SELECT c.gm_provider || '/' || c.gm_model AS gm,
+                  SUM(t.turns) AS turns,
+                  SUM(COALESCE(i.interventions, 0)) AS interventions,
+                  ROUND(1.0 * SUM(COALESCE(i.interventions, 0)) / SUM(t.turns), 4) AS intervention_rate
+           FROM campaigns c
+           JOIN (SELECT campaign_id, COUNT(*) AS turns FROM turns WHERE turn > 0 GROUP BY campaign_id) t
+             ON t.campaign_id = c.id
+           LEFT JOIN (SELECT campaign_id, COUNT(*) AS interventions FROM interventions WHERE kind = 'turn' GROUP BY campaign_id) i
+             ON i.campaign_id = c.id
+           GROUP BY gm ORDER BY turns DESC""",
+    ),
+    "latency": (
+        "モデルごとの平均応答時間と出力文字数",
+        """SELECT 'GM' AS role, c.gm_provider || '/' || c.gm_model AS model,
+                  SUM(t.gm_responses) AS responses,
+                  ROUND(SUM(t.gm_latency) / SUM(t.gm_responses), 2) AS avg_latency,
+                  ROUND(1.0 * SUM(t.gm_chars) / SUM(t.gm_responses), 0) AS avg_chars
+           FROM turns t JOIN campaigns c ON c.id = t.campaign_id WHERE t.gm_responses > 0 GROUP BY model
+           UNION ALL
+           SELECT 'PL', c.pl_provider || '/' || c.pl_model,
+                  SUM(t.pl_responses),
+                  ROUND(SUM(t.pl_latency) / SUM(t.pl_responses), 2),
+                  ROUND(1.0 * SUM(t.pl_chars) / SUM(t.pl_responses), 0)
+           FROM turns t JOIN campaigns c ON c.id = t.campaign_id WHERE t.pl_responses > 0 GROUP BY c.pl_provider, c.pl_model""",
+    ),
+    "cost": (
+        "GM/PLモデルの組み合わせごとの推定コスト（計測サマリーのあるログのみ）",
+        """SELECT gm_provider || '/' || gm_model AS gm, pl_provider || '/' || pl_model AS pl,
+                  COUNT(*) AS campaigns, SUM(total_turns) AS turns,
+                  ROUND(SUM(cost_usd), 4) AS cost_usd, ROUND(SUM(cost_usd) / SUM(total_turns), 5) AS cost_per_turn
+           FROM campaigns WHERE cost_usd IS NOT NULL GROUP BY gm, pl ORDER BY cost_usd DESC""",
+    ),
+}
+
+# ログの見出し -> 応答の種別
+_RESPONSE_HEADERS = {header: (kind, is_retry) for (kind, is_retry), (header, _) in RESPONSE_LABELS.items()}
+
+_SESSION = re.compile(r"^# Session (\d+)$")
+_TURN = re.compile(r"^## Turn (\d+)$")
+_ANOMALY = re.compile(r"^### ⚠️ 異常検知 \((.+)\)$")
+_COMPACTION = re.compile(r"^### 🗜️ 履歴圧縮 \((.+)\)$")
+_ITEM = re.compile(r"^- ([^:]+): (.*)$")
+# バッチAPIの応答は「応答時間」の代わりに「完了まで」（バッチの完了までの時間）を記録する
+_STATS = re.compile(r"^> (?:生成を中断 / |記録済み応答を再生 / )?(?:(?:TTFT: [\d.]+s / )?応答時間: |バッチAPI: \S+ / 完了まで: )([\d.]+)s"
+                    r"(?: / 入力: (\d+) tokens.*? / 出力: 約?(\d+) tokens)?")
+_COST = re.compile(r"^- 推定コスト: \$([\d.]+)")
+
+
+def _response_header(line: str) -> tuple | None:
+    """応答の見出しなら (種別, 再試行か) を返す（パーティでは見出しの後ろにPL名が付く）"""
+    header = _RESPONSE_HEADERS.get(line)
+    if header is None and " " in line:
+        header = _RESPONSE_HEADERS.get(line.rpartition(" ")[0])
+    return header
+
+
+class _LogParser:
+    """CampaignLogger のMarkdownを1行ずつ読み、索引の行を組み立てる"""
+
+    def __init__(self):
+        self.campaign = {"input_tokens": 0, "output_tokens": 0}
+        self.sessions = {}
+        self.turns = {}
+        self.anomalies = []
+        self.interventions = []
+        self.session = 0
+        self.turn = None
+        self.block = None  # 現在のブロックの種別
+        self.response = None  # 現在の応答の [種別, 文字数]
+        self.text = []  # 介入・異常検知ブロックの本文
+
+    def _turn_row(self) -> dict | None:
+        if self.turn is None:
+            return None
+        return self.turns.setdefault((self.session, self.turn), {
+            "gm_responses": 0, "pl_responses": 0, "pl_retries": 0, "gm_chars": 0, "pl_chars": 0,
+            "gm_latency": 0.0, "pl_latency": 0.0, "input_tokens": 0, "output_tokens": 0,
+        })
+
+    def _end_block(self):
+        """本文を溜めるブロックを閉じる"""
+        text = "\n".join(self.text).strip()
+        if self.block == "intervention":
+            self.interventions.append((self.session, self.turn, "turn", text))
+        elif self.block == "session_instruction":
+            self.interventions.append((self.session, None, "session", text))
+            self.sessions[self.session]["instruction"] = text
+        elif self.block == "anomaly":
+            self.anomalies[-1][4] = text.split("\n", 1)[0]
+        self.text = []
+        self.response = None
+
+    def _header(self, line: str) -> bool:
+        """見出し行ならブロックを切り替えて True を返す"""
+        if header := _response_header(line):
+            self._end_block()
+            kind, is_retry = header
+            self.block = "response"
+            self.response = [kind, 0]
+            row = self._turn_row()
+            if row is not None and kind in ("gm", "pl"):
+                row[f"{kind}_responses"] += 1
+                if kind == "pl" and is_retry:
+                    row["pl_retries"] += 1
+            return True
+        if match := _TURN.match(line):
+            self._end_block()
+            self.turn = int(match.group(1))
+            self._turn_row()
+            self.block = None
+            return True
+        if match := _SESSION.match(line):
+            self._end_block()
+            self.session = int(match.group(1))
+            self.turn = None
+            self.sessions[self.session] = {"started_at": None, "ended_at": None, "end_reason": None, "turns": None,
+                                           "instruction": None}
+            self.block = "session_start"
+            return True
+        if match := _ANOMALY.match(line):
+            self._end_block()
+            self.anomalies.append([self.session, self.turn, match.group(1), "pl_response", "", 0])
+            self.block = "anomaly"
+            return True
+        if _COMPACTION.match(line):
+            # 圧縮の要約はどの応答の本文にも数えない
+            self._end_block()
+            self.block = "compaction"
+            return True
+        if line == "# Batch Results":
+            # バッチAPIの書き戻しはキャンペーンの末尾に付くので、直前のターンには数えない
+            self._end_block()
+            self.turn = None
+            self.block = "batch_results"
+            return True
+        block = {
+            "## キャンペーン情報": "info",
+            "## シナリオテンプレート": "template",
+            "### 【オーケストレーター介入】": "intervention",
+            "## 【オーケストレーター介入】追加指示": "session_instruction",
+            "### ⚠️ 状態表示の違反": "state_violation",
+            "### ⚠️ 呼び出し失敗": "call_error",
+            "## セッション終了": "session_end",
+            "# Campaign End": "campaign_end",
+            "# Campaign Resumed": "resume",
+            "## 計測サマリー": "metrics",
+        }.get(line)
+        if block is None:
+            return False
+        self._end_block()
+        self.block = block
+        return True
+
+    def feed(self, line: str):
+        line = line.rstrip("\n")
+        if self.block == "template":
+            # シナリオテンプレート内の見出しは無視し、シナリオ生成かセッション開始まで読み飛ばす
+            if not _response_header(line) and not _SESSION.match(line):
+                return
+        if self._header(line):
+            return
+
+        block = self.block
+        if block == "response":
+            if match := _STATS.match(line):
+                latency, input_tokens, output_tokens = float(match.group(1)), int(match.group(2) or 0), int(match.group(3) or 0)
+                self.campaign["input_tokens"] += input_tokens
+                self.campaign["output_tokens"] += output_tokens
+                row = self._turn_row()
+                kind = self.response[0]
+                if row is not None:
+                    row["input_tokens"] += input_tokens
+                    row["output_tokens"] += output_tokens
+                    if kind in ("gm", "pl"):
+                        row[f"{kind}_latency"] += latency
+            else:
+                row = self._turn_row()
+                kind = self.response[0]
+                if row is not None and kind in ("gm", "pl"):
+                    row[f"{kind}_chars"] += len(line)
+        elif block in ("intervention", "session_instruction"):
+            self.text.append(line)
+        elif block == "anomaly":
+            if line.startswith("- 生成を中断"):
+                self.anomalies[-1][5] = 1
+            else:
+                self.text.append(line)
+        elif block == "state_violation":
+            if line.startswith("- "):
+                self.anomalies.append([self.session, self.turn, "GM", "game_state", line[2:], 0])
+        elif block == "metrics":
+            if match := _COST.match(line):
+                # 再開したキャンペーンは中断までと再開後の計測サマリーを合算する
+                self.campaign["cost_usd"] = self.campaign.get("cost_usd", 0.0) + float(match.group(1))
+        elif block in ("info", "session_start", "session_end", "campaign_end"):
+            match = _ITEM.match(line)
+            if not match:
+                return
+            key, value = match.groups()
+            if block == "info":
+                if key == "開始日時":
+                    self.campaign["started_at"] = value
+                elif key in ("GM", "PL"):
+                    provider, _, model = value.partition(" / ")
+                    self.campaign[f"{key.lower()}_provider"] = provider
+                    self.campaign[f"{key.lower()}_model"] = model
+                elif key.startswith("PL（"):
+                    # パーティはPLごとの値をカンマ区切りで並べる
+                    for field, part in zip(("pl_provider", "pl_model"), value.partition(" / ")[::2]):
+                        self.campaign[field] = f"{self.campaign[field]},{part}" if self.campaign.get(field) else part
+            elif block == "session_start" and key == "開始時刻":
+                self.sessions[self.session]["started_at"] = value
+            elif block == "session_end" and self.session in self.sessions:
+                field = {"終了理由": "end_reason", "セッションターン数": "turns", "終了時刻": "ended_at"}.get(key)
+                if field:
+                    self.sessions[self.session][field] = int(value) if field == "turns" else value
+            elif block == "campaign_end":
+                field = {"終了理由": "end_reason", "総セッション数": "total_sessions", "総ターン数": "total_turns",
+                         "終了時刻": "ended_at"}.get(key)
+                if field:
+                    self.campaign[field] = int(value) if field.startswith("total_") else value
+
+    def finish(self) -> dict:
+        self._end_block()
+        return {
+            "campaign": self.campaign,
+            "sessions": self.sessions,
+            "turns": self.turns,
+            "anomalies": self.anomalies,
+            "interventions": self.interventions,
+        }
+
+
+def parse_log(path: str) -> dict:
+    """キャンペーンログ1件を1行ずつ読み、索引の行を返す"""
+    parser = _LogParser()
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            parser.feed(line)
+    return parser.finish()
+
+
+def _parse_job(args: tuple) -> tuple:
+    path, mtime, size = args
+    return path, mtime, size, parse_log(path)
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _delete_campaign(conn: sqlite3.Connection, campaign_id: int):
+    for table in ("sessions", "turns", "anomalies", "interventions"):
+        conn.execute(f"DELETE FROM {table} WHERE campaign_id = ?", (campaign_id,))
+    conn.execute("DELETE FROM campaigns WHERE id = ?", (campaign_id,))
+
+
+def _store(conn: sqlite3.Connection, path: str, mtime: float, size: int, rows: dict):
+    campaign = rows["campaign"]
+    row = conn.execute("SELECT id FROM campaigns WHERE path = ?", (path,)).fetchone()
+    if row:
+        _delete_campaign(conn, row[0])
+    campaign_id = conn.execute(
+        """INSERT INTO campaigns (path, mtime, size, started_at, ended_at, gm_provider, gm_model, pl_provider, pl_model,
+                                  end_reason, total_sessions, total_turns, input_tokens, output_tokens, cost_usd)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (path, mtime, size, campaign.get("started_at"), campaign.get("ended_at"),
+         campaign.get("gm_provider"), campaign.get("gm_model"), campaign.get("pl_provider"), campaign.get("pl_model"),
+         campaign.get("end_reason"), campaign.get("total_sessions"), campaign.get("total_turns"),
+         campaign["input_tokens"], campaign["output_tokens"], campaign.get("cost_usd")),
+    ).lastrowid
+    conn.executemany(
+        "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(campaign_id, session, s["started_at"], s["ended_at"], s["end_reason"], s["turns"], s["instruction"])
+         for session, s in rows["sessions"].items()],
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO turns VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(campaign_id, session, turn, t["gm_responses"], t["pl_responses"], t["pl_retries"], t["gm_chars"],
+          t["pl_chars"], t["gm_latency"], t["pl_latency"], t["input_tokens"], t["output_tokens"])
+         for (session, turn), t in rows["turns"].items()],
+    )
+    conn.executemany("INSERT INTO anomalies VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     [(campaign_id, *anomaly) for anomaly in rows["anomalies"]])
+    conn.executemany("INSERT INTO interventions VALUES (?, ?, ?, ?, ?)",
+                     [(campaign_id, *intervention) for intervention in rows["interventions"]])
+
+
+def index_logs(log_dir: str = DEFAULT_LOG_DIR, db_path: str = DEFAULT_DB, jobs: int | None = None,
+               commit_every: int = 200) -> dict:
+    """log_dir のキャンペーンログを索引付けする（新規・更新されたファイルのみ）
+
+    jobs: 解析に使うプロセス数（1ならこのプロセスで解析する）
+    """
+    conn = connect(db_path)
+    indexed = {path: (mtime, size) for path, mtime, size in conn.execute("SELECT path, mtime, size FROM campaigns")}
+
+    pending = []
+    seen = set()
+    for path in sorted(glob.glob(os.path.join(log_dir, "campaign_*.md"))):
+        stat = os.stat(path)
+        seen.add(path)
+        if indexed.get(path) != (stat.st_mtime, stat.st_size):
+            pending.append((path, stat.st_mtime, stat.st_size))
+
+    # 削除されたログを索引からも外す
+    removed = [path for path in indexed if path not in seen]
+    for path in removed:
+        _delete_campaign(conn, conn.execute("SELECT id FROM campaigns WHERE path = ?", (path,)).fetchone()[0])
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs > 1 and len(pending) > 1:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        results = executor.map(_parse_job, pending, chunksize=16)
+    else:
+        executor = None
+        results = map(_parse_job, pending)
+    try:
+        for count, (path, mtime, size, rows) in enumerate(results, 1):
+            _store(conn, path, mtime, size, rows)
+            if count % commit_every == 0:
+                conn.commit()
+    finally:
+        if executor:
+            executor.shutdown()
+    conn.commit()
+    conn.close()
+    return {"indexed": len(pending), "unchanged": len(seen) - len(pending), "removed": len(removed)}
+
+
+def run_query(db_path: str, sql: str, params: tuple = ()) -> tuple[list, list]:
+    """(列名, 行) を返す"""
+    conn = connect(db_path)
+    try:
+        cursor = conn.execute(sql, params)
+        columns = [d[0] for d in cursor.description or ()]
+        return columns, cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def format_table(columns: list, rows: list) -> str:
+    """列幅を揃えたテキストの表"""
+    cells = [[("" if v is None else str(v)) for v in row] for row in rows]
+    widths = [max([len(c)] + [len(row[i]) for row in cells]) for i, c in enumerate(columns)]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(columns, widths)),
+             "  ".join("-" * w for w in widths)]
+    lines += ["  ".join(v.ljust(w) for v, w in zip(row, widths)) for row in cells]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="キャンペーンログのSQLite索引と集計クエリ")
+    parser.add_argument("--db", default=DEFAULT_DB, help="索引データベースのパス")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_index = sub.add_parser("index", help="ログを索引付けする（新規・更新分のみ）")
+    p_index.add_argument("log_dir", nargs="?", default=DEFAULT_LOG_DIR, help="ログのディレクトリ")
+    p_index.add_argument("-j", "--jobs", type=int, default=None, help="解析に使うプロセス数（既定: CPU数）")
+    p_query = sub.add_parser("query", help="用意された集計クエリを実行する")
+    p_query.add_argument("name", nargs="?", choices=sorted(QUERIES), help="クエリ名")
+    p_query.add_argument("--list", action="store_true", help="クエリの一覧を表示")
+    p_sql = sub.add_parser("sql", help="任意のSQLを実行する")
+    p_sql.add_argument("sql", help="SQL文")
+    args = parser.parse_args()
+
+    if args.command == "index":
+        result = index_logs(args.log_dir, args.db, args.jobs)
+        print(f"索引: {result['indexed']}件 / 変更なし: {result['unchanged']}件 / 削除: {result['removed']}件 → {args.db}")
+    elif args.command == "query":
+        if args.list or not args.name:
+            for name, (description, _) in QUERIES.items():
+                print(f"{name:20} {description}")
+        else:
+            description, sql = QUERIES[args.name]
+            print(f"# {description}")
+            print(format_table(*run_query(args.db, sql)))
+    else:
+        print(format_table(*run_query(args.db, args.sql)))
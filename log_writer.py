@@ -0,0 +1,58 @@
+"""ログ書き込みスレッド：全キャンペーンのログ書き込みを1本のバックグラウンドスレッドにまとめる"""
+import queue
+import threading
+import traceback
+
+
+class BackgroundWriter:
+    """開いたままのファイルハンドルへの書き込みを、バックグラウンドスレッドで順に処理する
+
+    write() / flush() は呼び出し側を待たせない。close() だけは書き込み完了まで待つ。
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="campaign-log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, f, text: str):
+        self._queue.put((f, "write", text, None))
+
+    def flush(self, f):
+        self._queue.put((f, "flush", None, None))
+
+    def close(self, f):
+        """それまでの書き込みを済ませてからファイルを閉じる（完了まで待つ）"""
+        done = threading.Event()
+        self._queue.put((f, "close", None, done))
+        done.wait()
+
+    def _run(self):
+        while True:
+            f, op, text, done = self._queue.get()
+            try:
+                if op == "write":
+                    f.write(text)
+                elif op == "flush":
+                    f.flush()
+                elif op == "close":
+                    f.close()
+            except Exception:
+                # 1ファイルの書き込み失敗で他のキャンペーンのログを止めない
+                traceback.print_exc()
+            finally:
+                if done is not None:
+                    done.set()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> BackgroundWriter:
+    """プロセス共通の書き込みスレッドを取得"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = BackgroundWriter()
+        return _writer
@@ -1,8 +1,15 @@
 """TRPG Agent - メインエントリポイント"""
-from orchestrator import run_session
+import argparse
+from orchestrator import run_session, resume
 
 # シナリオテンプレートのパス
 SCENARIO_TEMPLATE_PATH = "scenarios/template_fantasy.md"
 
 if __name__ == "__main__":
-    run_session(SCENARIO_TEMPLATE_PATH)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="TRPG Agent")
+    parser.add_argument("--resume", metavar="CHECKPOINT", help="中断したキャンペーンをチェックポイント（logs/campaign_*.checkpoint.jsonl）から再開")
+    args = parser.parse_args()
+    if args.resume:
+        resume(args.resume)
+    else:
+        run_session(SCENARIO_TEMPLATE_PATH)
@@ -0,0 +1,227 @@
+"""検索メモリ：過去のやり取りを文字n-gramのBM25で索引付けし、GMには関連する記録と直近のやり取りだけを送る
+
+会話履歴全体を毎ターン送り直す代わりに、GMへの最初の指示（圧縮後は要約）・直近のやり取り・
+今の入力に関連する過去の記録（上位k件）でGMへの入力を組み立てる。履歴そのものは変更しない。
+外部サービスは使わず、索引はプロセス内の転置インデックス（再開時はチェックポイントから作り直す）。
+"""
+import re
+import math
+import heapq
+import bisect
+from array import array
+import config
+
+# 過去の記録を入力に添えるときの見出し
+MEMORY_HEADER = "【関連する過去の記録（自動検索）】\n現在の描写の参考にしてください（古い情報を含みます）。"
+
+# 索引に入れない段落（状態は直近のやり取りにある最新のものを使う）
+_SKIP_PARAGRAPHS = ("【状態】", "【行動候補】")
+
+_WORD_RUNS = re.compile(r"\w+")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_QUERY_TERMS = 12  # 検索に使う語（n-gram）の数。出現する記録が少ない語から選ぶ
+MAX_DF_RATIO = 0.25  # 記録のこの割合を超えて出現する語は検索に使わない（「した」「ている」など）
+MAX_POSTINGS = 512  # 1回の検索で走査する出現位置の上限（記録が増えても検索時間を一定に保つ）
+RESCORE_CANDIDATES = 16  # 走査しきれなかった語で採点し直す上位候補の数
+
+
+def ngrams(text: str, n: int) -> list:
+    """文字n-gram（記号・空白で区切った語の中だけで作る。n文字に満たない語はそのまま）"""
+    grams = []
+    for run in _WORD_RUNS.findall(text.lower()):
+        if len(run) <= n:
+            grams.append(run)
+        else:
+            grams.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return grams
+
+
+class BM25Index:
+    """文字n-gramの転置インデックス（記録の追加は差分のみ、削除はしない）
+
+    出現位置は「記録の番号 << 8 | 記録内の出現回数」を記録の番号順に並べた array("I")。
+    1つの記録にしか出現しない語（大半の語）は array を作らず int のまま持つ。
+    """
+
+    def __init__(self, n: int = 2):
+        self.n = n
+        self._postings = {}  # 語 → 出現位置（int または array("I")）
+        self._lengths = array("I")
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, text: str) -> int:
+        """記録を追加して番号を返す"""
+        doc_id = len(self._lengths)
+        counts = {}
+        grams = ngrams(text, self.n)
+        for gram in grams:
+            counts[gram] = counts.get(gram, 0) + 1
+        postings = self._postings
+        for gram, tf in counts.items():
+            posting = doc_id << 8 | min(tf, 255)
+            entry = postings.get(gram)
+            if entry is None:
+                postings[gram] = posting
+            elif type(entry) is int:
+                postings[gram] = array("I", (entry, posting))
+            else:
+                entry.append(posting)
+        self._lengths.append(len(grams))
+        self._total_length += len(grams)
+        return doc_id
+
+    def search(self, query: str, k: int, limit: int | None = None) -> list:
+        """BM25の上位k件を (スコア, 記録の番号) で返す
+
+        limit: この番号より前の記録だけを対象にする（直近の記録を除く）
+        走査する出現位置は MAX_POSTINGS 件までで、超えた分の語は途中までの上位候補だけを採点し直す。
+        """
+        n_docs = len(self._lengths)
+        limit = n_docs if limit is None else min(limit, n_docs)
+        if not limit or k <= 0:
+            return []
+        # 出現する記録が少ない（=識別力の高い）語から MAX_QUERY_TERMS 個だけ使う
+        max_df = max(1, int(n_docs * MAX_DF_RATIO))
+        terms = []
+        for gram in set(ngrams(query, self.n)):
+            postings = self._postings.get(gram)
+            if postings is None:
+                continue
+            if type(postings) is int:
+                terms.append((1, gram, (postings,)))
+            elif len(postings) <= max_df:
+                terms.append((len(postings), gram, postings))
+        terms = heapq.nsmallest(MAX_QUERY_TERMS, terms)  # 同じ出現数なら語の順（語は重複しないので出現位置は比べない）
+
+        lengths = self._lengths
+        avg_length = self._total_length / n_docs
+        norm_a = BM25_K1 * (1 - BM25_B)
+        norm_b = BM25_K1 * BM25_B / avg_length
+        budget = MAX_POSTINGS
+        scores = {}
+        get = scores.get
+        deferred = []  # 出現位置を走査しきれなかった語
+        for df, _, postings in terms:
+            end = bisect.bisect_left(postings, limit << 8)
+            if not end:
+                continue
+            weight = math.log(1 + (n_docs - df + 0.5) / (df + 0.5)) * (BM25_K1 + 1)
+            if budget <= 0:
+                deferred.append((weight, postings, end))
+                continue
+            # 予算を超える分は新しい記録の側だけを走査する
+            start = max(0, end - budget)
+            budget -= end - start
+            for posting in postings[start:end]:
+                doc_id = posting >> 8
+                tf = posting & 255
+                scores[doc_id] = get(doc_id, 0.0) + weight * tf / (tf + norm_a + norm_b * lengths[doc_id])
+
+        if deferred:
+            # 残りの語は上位候補にだけ加点する
+            scores = {doc_id: scores[doc_id] for doc_id in heapq.nlargest(RESCORE_CANDIDATES, scores, key=get)}
+            for weight, postings, end in deferred:
+                for doc_id in scores:
+                    i = bisect.bisect_left(postings, doc_id << 8, 0, end)
+                    if i < end and postings[i] >> 8 == doc_id:
+                        tf = postings[i] & 255
+                        scores[doc_id] += weight * tf / (tf + norm_a + norm_b * lengths[doc_id])
+        return [(scores[doc_id], doc_id) for doc_id in heapq.nlargest(k, scores, key=scores.get)]
+
+
+class RetrievalMemory:
+    """GMの会話履歴の検索メモリ
+
+    索引の単位はGM/PL（オーケストレーター）の発言の段落。セッション終了時の「世界の変化」「次回フック」も
+    段落として入る。索引への追加は GM を呼び出すたびに、前回から増えたメッセージだけを行う。
+    """
+
+    def __init__(self):
+        self.index = BM25Index(config.MEMORY_NGRAM)
+        self._docs = []  # 記録の番号 → (セッション, ターン, 発言者, 段落)
+        self._message_docs = array("I")  # メッセージの通し番号 - 1 → そのメッセージの最初の記録の番号
+        self._last = None  # 索引に入れた最後のメッセージ
+        self._pending = []  # 復元中の、まだGM応答のない入力
+        self._label = (0, 0)  # 前回GMを呼び出したときの (セッション, ターン)
+
+    def add(self, message: dict, session: int, turn: int):
+        """メッセージを段落に分けて索引に入れる"""
+        speaker = "GM" if message["role"] == "assistant" else "PL"
+        self._message_docs.append(len(self._docs))
+        for paragraph in _PARAGRAPH_BREAK.split(message["content"]):
+            paragraph = paragraph.strip()
+            if not paragraph or paragraph.startswith(_SKIP_PARAGRAPHS):
+                continue
+            self.index.add(paragraph)
+            self._docs.append((session, turn, speaker, paragraph))
+
+    def restore(self, message: dict, session: int, turn: int):
+        """チェックポイントから復元したメッセージを索引に入れる（load_checkpoint の on_gm_message）
+
+        GMへの入力は、それに答えたGM応答と同じセッション・ターンとして入れる（実行中の索引と同じ）。
+        答えのない末尾の入力は、再開後のGM呼び出しで入れる。
+        """
+        if not session:
+            return  # セッション0のメッセージはGMへの最初の指示（常に送るので入れない）
+        if message["role"] == "user":
+            self._pending.append(message)
+            return
+        for pending in self._pending:
+            self.add(pending, session, turn)
+        self._pending = []
+        self.add(message, session, turn)
+        self._last = message
+
+    def _sync(self, messages: list, end: int):
+        """messages[:end] のうち前回から増えたメッセージを索引に入れる（先頭のGMへの最初の指示・要約は常に送るので入れない）"""
+        start = end
+        while start > 1 and messages[start - 1] is not self._last:
+            start -= 1
+        session, turn = self._label
+        for message in messages[start:end]:
+            self.add(message, session, turn)
+        if end > 1:
+            self._last = messages[end - 1]
+
+    def context(self, history: list, session: int, turn: int) -> list:
+        """GMに送るメッセージ（最初の指示＋関連する過去の記録を添えた直近のやり取り）"""
+        # 今の入力（末尾）は次回の呼び出しで索引に入れる（先行取得の入力を二重に入れないため）
+        self._sync(history, len(history) - 1)
+        self._label = (session, turn)
+
+        # 直近のやり取りは原文のまま送る（先頭の指示の直後がGMの発言になる位置で区切る）
+        start = max(len(history) - 2 * config.MEMORY_RECENT_EXCHANGES - 1, 1)
+        while start < len(history) and history[start]["role"] != "assistant":
+            start += 1
+        if start >= len(history) - 1 or start <= 1:
+            return history
+        window = history[start:]
+
+        # 原文のまま送るメッセージ（今の入力を除いて、索引に入れた最後の len(window) - 1 件）の記録は除く
+        first_sent = max(0, len(self._message_docs) - (len(window) - 1))
+        limit = self._message_docs[first_sent] if first_sent < len(self._message_docs) else len(self._docs)
+        query = f"{window[-2]['content']}\n{window[-1]['content']}"
+        # 同じ文面の段落（繰り返しの行動宣言など）は1件にまとめる
+        hits, seen = [], set()
+        for _, doc_id in self.index.search(query, config.MEMORY_TOP_K * 2, limit):
+            paragraph = self._docs[doc_id][3]
+            if paragraph not in seen and len(hits) < config.MEMORY_TOP_K:
+                seen.add(paragraph)
+                hits.append(doc_id)
+        last = window[-1]
+        if not hits:
+            return [history[0]] + window
+        notes = []
+        for doc_id in sorted(hits):  # 古い順に並べる
+            doc_session, doc_turn, speaker, paragraph = self._docs[doc_id]
+            if len(paragraph) > config.MEMORY_SNIPPET_CHARS:
+                paragraph = paragraph[:config.MEMORY_SNIPPET_CHARS] + "…"
+            notes.append(f"[セッション{doc_session} ターン{doc_turn} {speaker}]\n{paragraph}")
+        content = f"{last['content']}\n\n{MEMORY_HEADER}\n\n" + "\n\n".join(notes)
+        return [history[0]] + window[:-1] + [{"role": last["role"], "content": content}]
@@ -0,0 +1,80 @@
+"""メッセージ変換バッファ：会話履歴をプロバイダーのメッセージ形式へ差分だけ変換して使い回す
+
+履歴は末尾への追加と、履歴圧縮による先頭の置き換えしか起きない。
+そこで会話（先頭メッセージのオブジェクト）ごとに変換済みのメッセージを覚えておき、
+前回の呼び出しから増えたメッセージだけを変換する。1回の呼び出しの変換コストは履歴の長さによらない。
+
+同じ会話の別の続き（GMの先読みと本番の呼び出し、セッション振り返りなど）は、
+共通の先頭部分まで巻き戻してから変換し直す。
+"""
+from collections import OrderedDict
+
+MAX_BUFFERS = 64  # 覚えておく会話の数（古いものから捨てる）
+
+
+class MessageAdapter:
+    """プロバイダーごとのメッセージ変換（プロバイダーを追加するときはこれを継承して登録する）"""
+
+    def prefix(self, system_prompt: str) -> list:
+        """履歴の前に置くメッセージ（OpenAIのシステムメッセージなど）"""
+        return []
+
+    def convert(self, message: dict):
+        """履歴のメッセージ1件（{"role", "content"}）を変換"""
+        return message
+
+
+class MessageBuffer:
+    """1つの会話の変換済みメッセージ"""
+
+    def __init__(self, adapter: MessageAdapter, system_prompt: str):
+        self.adapter = adapter
+        self._sources = []  # 変換元のメッセージ（同一性の確認用）
+        self._converted = adapter.prefix(system_prompt)
+        self._offset = len(self._converted)
+
+    def _common_prefix(self, messages: list) -> int:
+        """前回変換した履歴と共通の先頭部分の長さ"""
+        sources = self._sources
+        n = min(len(messages), len(sources))
+        if n == 0 or messages[0] is not sources[0]:
+            return 0
+        # 途中のメッセージは書き換わらないので、末尾側から一致する位置を探せばよい
+        while messages[n - 1] is not sources[n - 1]:
+            n -= 1
+        return n
+
+    def sync(self, messages: list) -> list:
+        """履歴に合わせて差分を変換し、送信用のリスト（コピー）を返す"""
+        n = self._common_prefix(messages)
+        del self._sources[n:]
+        del self._converted[self._offset + n:]
+        convert = self.adapter.convert
+        for message in messages[n:]:
+            self._sources.append(message)
+            self._converted.append(convert(message))
+        # 送信中に同じ会話の別の呼び出しが変換を進めても影響しないよう、リストはコピーして渡す
+        return list(self._converted)
+
+
+_buffers = OrderedDict()
+
+
+def convert_messages(provider: str, adapter: MessageAdapter, system_prompt: str, messages: list) -> list:
+    """会話ごとのバッファを使って履歴を変換する"""
+    if not messages:
+        return adapter.prefix(system_prompt)
+    # バッファが先頭メッセージを保持しているので、生きている間は id が他のオブジェクトに使い回されない
+    key = (provider, system_prompt, id(messages[0]))
+    buffer = _buffers.get(key)
+    if buffer is None:
+        buffer = _buffers[key] = MessageBuffer(adapter, system_prompt)
+        if len(_buffers) > MAX_BUFFERS:
+            _buffers.popitem(last=False)
+    else:
+        _buffers.move_to_end(key)
+    return buffer.sync(messages)
+
+
+def clear_buffers():
+    _buffers.clear()
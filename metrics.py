@@ -0,0 +1,342 @@
+"""LLM呼び出しの計測：トークン数・レイテンシ・推定コストをキャンペーン・セッション・ターン・役割ごとに集計する"""
+import json
+import time
+import contextvars
+import config
+
+# 実行中のキャンペーンの集計先（asyncio のタスクにも引き継がれる）
+_current = contextvars.ContextVar("campaign_metrics", default=None)
+
+# 集計する数値項目
+_TOTAL_FIELDS = ("calls", "input_tokens", "cached_tokens", "cache_write_tokens", "output_tokens", "cost_usd",
+                 "latency", "ttft")
+
+
+def estimate_cost(provider: str, model: str, input_tokens: int, cached_tokens: int, cache_write_tokens: int,
+                  output_tokens: int) -> float | None:
+    """推定コスト（USD）。料金表にないモデルは None、モックは0"""
+    if provider == "mock":
+        return 0.0
+    price = config.MODEL_PRICES.get(model)
+    if price is None:
+        return None
+    uncached = input_tokens - cached_tokens - cache_write_tokens
+    cost = (
+        uncached * price["input"]
+        + cached_tokens * price.get("cached", price["input"])
+        + cache_write_tokens * price.get("cache_write", price["input"])
+        + output_tokens * price["output"]
+    )
+    return cost / 1_000_000
+
+
+def percentile(values, q: float) -> float:
+    """q パーセンタイル（0〜100、線形補間）"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def _empty_totals() -> dict:
+    return {field: 0 for field in _TOTAL_FIELDS}
+
+
+def _add(totals: dict, call: dict):
+    totals["calls"] += 1
+    for field in ("input_tokens", "cached_tokens", "cache_write_tokens", "output_tokens", "latency", "ttft"):
+        totals[field] += call[field] or 0
+    totals["cost_usd"] += call["cost_usd"] or 0
+
+
+class CampaignMetrics:
+    """1キャンペーン分のLLM呼び出しの計測値と、人間の入力待ち時間"""
+
+    def __init__(self, campaign: str):
+        self.campaign = campaign
+        self.session = 0
+        self.turn = 0
+        self.calls = []
+        self.human_wait = 0.0  # 人間の判断を待った秒数（LLMの時間とは別に集計）
+        self.human_prompts = 0
+        self.unpriced_models = set()
+        self.anomalies = []
+        self.tokens_used = 0  # 使ったトークン数（入力＋出力。トークン予算用で、再開時はチェックポイントの値から続ける）
+        self._start = time.perf_counter()
+        self.wall_time = 0.0
+
+    def tags(self) -> dict:
+        """呼び出し開始時点のセッション・ターン"""
+        return {"session": self.session, "turn": self.turn}
+
+    def record(self, role: str, stats, tags: dict, status: str = "ok"):
+        """1回のLLM呼び出しを記録（status: "ok" / "replayed" / "aborted" / "error" / "cancelled" / "hedge_lost"）"""
+        cost = 0.0 if stats.replayed else estimate_cost(
+            stats.provider, stats.model, stats.input_tokens, stats.cached_tokens, stats.cache_write_tokens,
+            stats.output_tokens,
+        )
+        if cost is None and status == "ok":
+            self.unpriced_models.add(stats.model)
+        self.tokens_used += stats.input_tokens + stats.output_tokens
+        route = stats.route
+        default_cost = cost
+        if route is not None and not stats.replayed:
+            # 振り分けなしで使うはずだったモデルで同じトークン数を処理した場合のコスト（節約額の比較用）
+            default_cost = estimate_cost(
+                route.default[0], route.default[1], stats.input_tokens, stats.cached_tokens, stats.cache_write_tokens,
+                stats.output_tokens,
+            )
+        self.calls.append({
+            **tags,
+            "role": role,
+            "provider": stats.provider,
+            "model": stats.model,
+            "status": status,
+            "streamed": stats.streamed,
+            "input_tokens": stats.input_tokens,
+            "cached_tokens": stats.cached_tokens,
+            "cache_write_tokens": stats.cache_write_tokens,
+            "output_tokens": stats.output_tokens,
+            "cost_usd": cost,
+            "latency": stats.latency,
+            "ttft": stats.ttft,
+            "queue_wait": stats.queue_wait,
+            "retries": stats.retries,
+            "hedge": stats.hedge,
+            "tier": route.tier if route is not None else None,
+            "route_reason": route.reason if route is not None else None,
+            "default_cost_usd": default_cost,
+        })
+
+    def record_anomaly(self, role: str, reason: str, aborted: bool, wasted_tokens: int, saved_seconds: float | None):
+        """異常応答を記録（wasted_tokens: 破棄した出力トークン数, saved_seconds: 生成の打ち切りで短縮した推定秒数）"""
+        self.anomalies.append({
+            **self.tags(),
+            "role": role,
+            "reason": reason,
+            "aborted": aborted,
+            "wasted_tokens": wasted_tokens,
+            "saved_seconds": saved_seconds,
+        })
+
+    def average_latency(self, role: str) -> float | None:
+        """その役割の最後まで生成した呼び出しの平均応答時間"""
+        latencies = [call["latency"] for call in self.calls if call["role"] == role and call["status"] == "ok"]
+        return sum(latencies) / len(latencies) if latencies else None
+
+    def latency_percentiles(self, role: str) -> dict | None:
+        """その役割の最後まで生成した呼び出しの応答時間の p50 / p95 / p99"""
+        latencies = [call["latency"] for call in self.calls if call["role"] == role and call["status"] == "ok"]
+        if not latencies:
+            return None
+        return {f"p{q}": percentile(latencies, q) for q in (50, 95, 99)}
+
+    def hedge_totals(self) -> dict:
+        """予備のリクエストを送った回数・予備の応答を使った回数・使わなかったリクエストの推定コスト"""
+        lost = [call for call in self.calls if call["status"] == "hedge_lost"]
+        return {
+            "hedged": sum(1 for call in self.calls if call["hedge"] is not None),
+            "backup_won": sum(1 for call in self.calls if call["hedge"] == "backup"),
+            "lost_requests": len(lost),
+            "lost_cost_usd": sum(call["cost_usd"] or 0 for call in lost),
+        }
+
+    def anomaly_totals(self) -> dict:
+        return {
+            "count": len(self.anomalies),
+            "aborted": sum(1 for a in self.anomalies if a["aborted"]),
+            "wasted_tokens": sum(a["wasted_tokens"] for a in self.anomalies),
+            "saved_seconds": sum(a["saved_seconds"] or 0 for a in self.anomalies),
+        }
+
+    def routing_totals(self) -> dict | None:
+        """モデルの振り分けの集計（振り分けた呼び出しがなければ None）
+
+        役割・段階・モデルごとの呼び出し数・平均応答時間・推定コストと、既定のモデルを使った場合の推定コスト
+        """
+        routed = [call for call in self.calls if call["tier"] is not None and call["status"] == "ok"]
+        if not routed:
+            return None
+        groups = {}
+        for call in routed:
+            group = groups.setdefault((call["role"], call["tier"], call["model"]),
+                                      {"calls": 0, "latency": 0.0, "cost_usd": 0.0, "default_cost_usd": 0.0})
+            group["calls"] += 1
+            group["latency"] += call["latency"] or 0
+            # 料金表にないモデルの呼び出しは両方のコストから除く
+            if call["cost_usd"] is not None and call["default_cost_usd"] is not None:
+                group["cost_usd"] += call["cost_usd"]
+                group["default_cost_usd"] += call["default_cost_usd"]
+        cost = sum(g["cost_usd"] for g in groups.values())
+        default_cost = sum(g["default_cost_usd"] for g in groups.values())
+        return {
+            "calls": len(routed),
+            "cost_usd": cost,
+            "default_cost_usd": default_cost,
+            "saved_usd": default_cost - cost,
+            "groups": [
+                {"role": role, "tier": tier, "model": model, **g, "average_latency": g["latency"] / g["calls"]}
+                for (role, tier, model), g in sorted(groups.items())
+            ],
+        }
+
+    def add_human_wait(self, seconds: float):
+        self.human_wait += seconds
+        self.human_prompts += 1
+
+    def finish(self):
+        """キャンペーンの経過時間を確定する"""
+        self.wall_time = time.perf_counter() - self._start
+
+    def totals(self) -> dict:
+        totals = _empty_totals()
+        for call in self.calls:
+            _add(totals, call)
+        return totals
+
+    def breakdown(self, *keys: str) -> dict:
+        """指定したタグ（"role", "model", "session" など）の組み合わせごとの集計"""
+        groups = {}
+        for call in self.calls:
+            group = tuple(call[key] for key in keys)
+            _add(groups.setdefault(group, _empty_totals()), call)
+        return groups
+
+    def to_dict(self) -> dict:
+        """JSON出力用"""
+        return {
+            "campaign": self.campaign,
+            "wall_seconds": round(self.wall_time, 3),
+            "human_wait_seconds": round(self.human_wait, 3),
+            "human_prompts": self.human_prompts,
+            "totals": self.totals(),
+            "by_role": {role: totals for (role,), totals in self.breakdown("role").items()},
+            "latency_percentiles": {role: self.latency_percentiles(role) for (role,) in self.breakdown("role")},
+            "by_model": {f"{provider}/{model}": totals for (provider, model), totals in self.breakdown("provider", "model").items()},
+            "by_session": {str(session): totals for (session,), totals in self.breakdown("session").items()},
+            "unpriced_models": sorted(self.unpriced_models),
+            "anomaly_totals": self.anomaly_totals(),
+            "hedge_totals": self.hedge_totals(),
+            "routing": self.routing_totals(),
+            "anomalies": self.anomalies,
+            "calls": self.calls,
+        }
+
+    def to_markdown(self) -> str:
+        """キャンペーンログに書き出す集計セクション"""
+        totals = self.totals()
+        lines = [
+            "## 計測サマリー\n",
+            f"- 経過時間: {self.wall_time:.1f}s（LLM応答時間の合計: {totals['latency']:.1f}s / 人間の入力待ち: {self.human_wait:.1f}s, {self.human_prompts}回）",
+            f"- LLM呼び出し: {totals['calls']}回 / 入力: {totals['input_tokens']} tokens（キャッシュ hit {totals['cached_tokens']}）/ 出力: {totals['output_tokens']} tokens",
+            f"- 推定コスト: ${totals['cost_usd']:.4f}",
+        ]
+        if self.anomalies:
+            a = self.anomaly_totals()
+            lines.append(
+                f"- 異常応答: {a['count']}回（うち生成を中断 {a['aborted']}回）/ 破棄した出力: {a['wasted_tokens']} tokens / "
+                f"中断による短縮: 約{a['saved_seconds']:.1f}s"
+            )
+        hedge = self.hedge_totals()
+        if hedge["hedged"]:
+            lines.append(
+                f"- ヘッジ: 予備のリクエスト {hedge['hedged']}回（うち予備の応答を使用 {hedge['backup_won']}回）/ "
+                f"取り消したリクエストの推定コスト: ${hedge['lost_cost_usd']:.4f}"
+            )
+        if self.unpriced_models:
+            lines.append(f"- 料金未登録のモデル（コストに含まない）: {', '.join(sorted(self.unpriced_models))}")
+        lines += [
+            "",
+            "| 役割 | 呼び出し | 入力 | キャッシュhit | 出力 | 推定コスト | 平均応答時間 | p95応答時間 | p99応答時間 | 平均TTFT |",
+            "|------|---------|------|--------------|------|-----------|-------------|------------|------------|---------|",
+        ]
+        for (role,), t in sorted(self.breakdown("role").items()):
+            tail = self.latency_percentiles(role) or {"p95": 0.0, "p99": 0.0}
+            lines.append(
+                f"| {role} | {t['calls']} | {t['input_tokens']} | {t['cached_tokens']} | {t['output_tokens']} | "
+                f"${t['cost_usd']:.4f} | {t['latency'] / t['calls']:.2f}s | {tail['p95']:.2f}s | {tail['p99']:.2f}s | "
+                f"{t['ttft'] / t['calls']:.2f}s |"
+            )
+        lines += [
+            "",
+            "| モデル | 呼び出し | 入力 | 出力 | 推定コスト |",
+            "|--------|---------|------|------|-----------|",
+        ]
+        for (provider, model), t in sorted(self.breakdown("provider", "model").items()):
+            lines.append(f"| {provider}/{model} | {t['calls']} | {t['input_tokens']} | {t['output_tokens']} | ${t['cost_usd']:.4f} |")
+        routing = self.routing_totals()
+        if routing:
+            lines += [
+                "",
+                f"モデルの振り分け: {routing['calls']}回 / 推定コスト ${routing['cost_usd']:.4f}"
+                f"（既定のモデルなら ${routing['default_cost_usd']:.4f}、差額 ${routing['saved_usd']:.4f}）",
+                "",
+                "| 役割 | 段階 | モデル | 呼び出し | 平均応答時間 | 推定コスト | 既定のモデルでの推定コスト |",
+                "|------|------|--------|---------|-------------|-----------|--------------------------|",
+            ]
+            for g in routing["groups"]:
+                lines.append(
+                    f"| {g['role']} | {g['tier']} | {g['model']} | {g['calls']} | {g['average_latency']:.2f}s | "
+                    f"${g['cost_usd']:.4f} | ${g['default_cost_usd']:.4f} |"
+                )
+        return "\n".join(lines) + "\n\n"
+
+    def to_prometheus(self) -> str:
+        """Prometheus の textfile collector 形式"""
+        metrics = [
+            ("trpg_llm_calls_total", "counter", "LLM calls", "calls"),
+            ("trpg_llm_input_tokens_total", "counter", "Input tokens (including cached)", "input_tokens"),
+            ("trpg_llm_cached_tokens_total", "counter", "Input tokens served from the provider prompt cache", "cached_tokens"),
+            ("trpg_llm_output_tokens_total", "counter", "Output tokens", "output_tokens"),
+            ("trpg_llm_cost_usd_total", "counter", "Estimated cost in USD", "cost_usd"),
+            ("trpg_llm_latency_seconds_total", "counter", "Sum of LLM call latencies", "latency"),
+            ("trpg_llm_ttft_seconds_total", "counter", "Sum of time to first token", "ttft"),
+        ]
+        groups = self.breakdown("role", "provider", "model")
+        lines = []
+        for name, kind, help_text, field in metrics:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for (role, provider, model), t in sorted(groups.items()):
+                labels = f'campaign="{self.campaign}",role="{role}",provider="{provider}",model="{model}"'
+                lines.append(f"{name}{{{labels}}} {round(t[field], 6)}")
+        a = self.anomaly_totals()
+        lines += [
+            "# HELP trpg_anomalies_total Invalid PL responses (aborted: generation stopped mid-stream)",
+            "# TYPE trpg_anomalies_total counter",
+            f'trpg_anomalies_total{{campaign="{self.campaign}",aborted="true"}} {a["aborted"]}',
+            f'trpg_anomalies_total{{campaign="{self.campaign}",aborted="false"}} {a["count"] - a["aborted"]}',
+            "# HELP trpg_anomaly_wasted_tokens_total Output tokens discarded because of invalid responses",
+            "# TYPE trpg_anomaly_wasted_tokens_total counter",
+            f'trpg_anomaly_wasted_tokens_total{{campaign="{self.campaign}"}} {a["wasted_tokens"]}',
+            "# HELP trpg_stream_abort_saved_seconds_total Estimated generation time saved by aborting invalid responses",
+            "# TYPE trpg_stream_abort_saved_seconds_total counter",
+            f'trpg_stream_abort_saved_seconds_total{{campaign="{self.campaign}"}} {round(a["saved_seconds"], 3)}',
+            "# HELP trpg_human_wait_seconds_total Time spent waiting for the human orchestrator",
+            "# TYPE trpg_human_wait_seconds_total counter",
+            f'trpg_human_wait_seconds_total{{campaign="{self.campaign}"}} {round(self.human_wait, 3)}',
+            "# HELP trpg_campaign_wall_seconds Campaign wall-clock duration",
+            "# TYPE trpg_campaign_wall_seconds gauge",
+            f'trpg_campaign_wall_seconds{{campaign="{self.campaign}"}} {round(self.wall_time, 3)}',
+        ]
+        return "\n".join(lines) + "\n"
+
+    def export(self, basepath: str):
+        """<basepath>.metrics.json と <basepath>.prom に書き出す"""
+        with open(f"{basepath}.metrics.json", "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        with open(f"{basepath}.prom", "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+
+
+def activate(metrics: CampaignMetrics):
+    """以降（このタスクと、ここから作られるタスク）のLLM呼び出しを metrics に記録する"""
+    return _current.set(metrics)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+def current() -> CampaignMetrics | None:
+    return _current.get()
@@ -0,0 +1,192 @@
+"""モックプロバイダー：APIキーなしでルールに沿ったGM/PL応答を疑似生成する（オフライン検証・ベンチマーク用）"""
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import random
+import zlib
+import config
+
+_PLACES = ["古い砦跡", "霧深い森", "地下水路", "交易都市の裏通り", "崩れた礼拝堂"]
+_OBSTACLES = ["見張りの兵士", "崩れかけた足場", "毒霧", "正体不明の追跡者", "封印された扉"]
+_ITEMS = ["ランタン", "ロープ", "短剣", "古い地図", "回復薬", "銀の鍵"]
+_ACTIONS = ["周囲を慎重に調べる", "物陰に隠れて様子をうかがう", "正面から突破を試みる", "NPCに話しかけて情報を得る", "来た道を引き返して迂回する"]
+
+
+def _rng(system_prompt: str, messages: list) -> random.Random:
+    """呼び出し内容から決まる乱数（同じ入力には同じ応答を返す）"""
+    last = messages[-1]["content"] if messages else ""
+    seed = zlib.crc32(f"{config.MOCK_SEED}:{len(system_prompt)}:{len(messages)}:{last}".encode("utf-8"))
+    return random.Random(seed)
+
+
+_TURN_LINE = re.compile(r"^Turn: (\d+)", re.MULTILINE)
+
+
+def _session_turn(messages: list) -> int:
+    """現在のセッションで何ターン目のGM応答か（直前のGM応答の状態表示の Turn + 1、セッション開始時は0）
+
+    履歴圧縮や検索メモリで古いやり取りが送られてこなくても数えられるよう、直前のGM応答だけを見る。
+    """
+    if not messages or not messages[-1]["content"].startswith("PLの行動"):
+        return 0
+    for msg in reversed(messages):
+        if msg["role"] == "assistant":
+            match = _TURN_LINE.search(msg["content"])
+            return int(match.group(1)) + 1 if match else 1
+    return 1
+
+
+def _status_block(rng: random.Random, turn: int) -> str:
+    items = "、".join(rng.sample(_ITEMS, 3))
+    return (
+        "【状態】\n"
+        f"Turn: {turn}\n"
+        f"セッションの舞台: {rng.choice(_PLACES)}\n"
+        "セッションの目的: 依頼の真相を突き止める\n"
+        f"HP: {rng.randint(4, 10)}/10\n"
+        f"SP: {rng.randint(1, 6)}/6\n"
+        f"Tension: {rng.randint(0, 10)}\n"
+        f"障害: {rng.choice(_OBSTACLES)}\n"
+        f"所持品: {items}"
+    )
+
+
+def _gm_turn(rng: random.Random, messages: list) -> str:
+    turn = _session_turn(messages)
+    result = rng.choice(["成功", "部分成功", "失敗"])
+    narration = "。\n".join(f"{rng.choice(_PLACES)}に{rng.choice(_OBSTACLES)}の気配が漂う" for _ in range(rng.randint(4, 8)))
+    if turn >= config.MOCK_SESSION_TURNS:
+        return (
+            f"【裁定】\n- 行動結果: {result}\n\n"
+            f"【状況】\n{narration}。\n\n"
+            f"{_status_block(rng, turn)}\n\n"
+            "【セッション終了】\n"
+            "- 終了種別: 目的達成\n- 結果要約: 依頼の真相にたどり着いた\n"
+            "- 世界影響: 王国の不穏な噂が一つ晴れた\n- PC影響: 新たな因縁を得た\n\n"
+            f"現在地: {rng.choice(_PLACES)}\n世界の変化: 街道の警備が強化された\n次回フック: {rng.choice(_OBSTACLES)}の背後にいる黒幕"
+        )
+    options = "\n".join(
+        f"{i + 1}. {action}（目的: 前進 / リスク: {rng.choice(['低', '中', '高'])} / コスト: SP-{rng.randint(0, 2)}）"
+        for i, action in enumerate(rng.sample(_ACTIONS, rng.randint(3, 5)))
+    )
+    return (
+        f"【裁定】\n- 行動結果: {result}\n\n"
+        f"【状況】\n{narration}。\n\n"
+        f"{_status_block(rng, turn)}\n\n"
+        f"【行動候補】\n{options}"
+    )
+
+
+def _pl_turn(rng: random.Random) -> str:
+    thought = "。".join(f"{rng.choice(_OBSTACLES)}が気になる" for _ in range(rng.randint(3, 6)))
+    action = rng.choice(_ACTIONS)
+    if rng.random() < config.MOCK_PL_ANOMALY_RATE:
+        # 異常応答：行動宣言の欠落か、GMの役割への踏み込み
+        if rng.random() < 0.5:
+            return f"【思考】\n{thought}。\n\nとりあえず{action}。"
+        return f"【思考】\n{thought}。\n\n【行動宣言】\n{action}。\n\n【状況】\n{action}ことに成功した。\nHP: 10/10"
+    return f"【思考】\n{thought}。\n\n【行動宣言】\n{action}。"
+
+
+def _rating(rng: random.Random) -> str:
+    stars = rng.randint(1, 5)
+    return "★" * stars + "☆" * (5 - stars)
+
+
+def generate(system_prompt: str, messages: list) -> str:
+    """システムプロンプトと最後のメッセージから役割を判定し、応答を生成する"""
+    rng = _rng(system_prompt, messages)
+    last = messages[-1]["content"] if messages else ""
+    if "記録係" in system_prompt:
+        return (
+            "【コアセーブ】\n- 舞台/大目的: 中世ファンタジー / 王国の脅威の阻止\n"
+            f"- HP/SP/Tension: {rng.randint(4, 10)}/{rng.randint(1, 6)}/{rng.randint(0, 10)}\n"
+            f"- 所持品: {'、'.join(rng.sample(_ITEMS, 3))}\n\n"
+            f"【これまでのあらすじ】\n{rng.choice(_PLACES)}で{rng.choice(_OBSTACLES)}と対峙した。"
+        )
+    if "振り返り" in last:
+        good = "GM" if "GMの対応" in last else "PL"
+        return (
+            f"【面白さの評価】\n緊張感のある展開だった。\n評価: {_rating(rng)}\n\n"
+            f"【{good}の良かったところ】\n- テンポが良かった\n\n【改善が望ましいところ】\n- 描写がやや単調だった"
+        )
+    if "次のセッションで何をしたいか" in last:
+        return f"【振り返り】\n{rng.choice(_OBSTACLES)}との対峙が印象的だった。\n\n【次回への希望】\n{rng.choice(_PLACES)}を調べたい。"
+    if "ゲームマスター（GM）" in system_prompt:
+        return _gm_turn(rng, messages)
+    if "PCと初回セッションを設定" in last:
+        return (
+            "【PC設定】\n- 名前: リオ\n- 職業/役割: 見習い斥候\n- 特徴: 無口だが観察眼が鋭い\n"
+            "- 個人的な目的/動機: 行方不明の兄を探す\n\n"
+            f"【初回セッション設定】\n- 具体的な依頼/状況: {rng.choice(_PLACES)}の調査\n"
+            f"- 開始地点: 冒険者ギルド\n- 初期所持品: {'、'.join(rng.sample(_ITEMS, 4))}"
+        )
+    return _pl_turn(rng)
+
+
+def estimate_usage(system_prompt: str, messages: list, text: str) -> tuple[int, int]:
+    """(入力トークン数, 出力トークン数) の概算（1文字≒1トークン）"""
+    return len(system_prompt) + sum(len(msg["content"]) for msg in messages), len(text)
+
+
+async def _wait_first_token():
+    if config.MOCK_TTFT_MEDIAN > 0:
+        await asyncio.sleep(random.lognormvariate(0, config.MOCK_TTFT_SIGMA) * config.MOCK_TTFT_MEDIAN)
+
+
+async def complete(system_prompt: str, messages: list) -> str:
+    """応答全体を一括で返す（遅延を模擬）"""
+    text = generate(system_prompt, messages)
+    await _wait_first_token()
+    if config.MOCK_CHARS_PER_SEC > 0:
+        await asyncio.sleep(len(text) / config.MOCK_CHARS_PER_SEC)
+    return text
+
+
+async def stream(system_prompt: str, messages: list, chunk_chars: int = 20):
+    """応答を断片ごとに返す（遅延を模擬）"""
+    text = generate(system_prompt, messages)
+    await _wait_first_token()
+    for i in range(0, len(text), chunk_chars):
+        chunk = text[i:i + chunk_chars]
+        if config.MOCK_CHARS_PER_SEC > 0:
+            await asyncio.sleep(len(chunk) / config.MOCK_CHARS_PER_SEC)
+        yield chunk
+
+
+# ローカルのバッチAPI（バッチAPIの実行経路を検証するための代役）
+# バッチは MOCK_BATCH_DIR にファイルとして保存するので、送信したプロセスが終わっても別のプロセスから結果を受け取れる
+
+def _batch_path(batch_id: str) -> str:
+    return os.path.join(config.MOCK_BATCH_DIR, f"{batch_id}.json")
+
+
+def submit_batch(requests: list) -> str:
+    """リクエスト（custom_id, システムプロンプト, メッセージ）を保存してバッチIDを返す"""
+    os.makedirs(config.MOCK_BATCH_DIR, exist_ok=True)
+    batch_id = f"mockbatch_{uuid.uuid4().hex[:12]}"
+    with open(_batch_path(batch_id), "w", encoding="utf-8") as f:
+        json.dump({"created": time.time(), "requests": requests}, f, ensure_ascii=False)
+    return batch_id
+
+
+def _load_batch(batch_id: str) -> dict:
+    with open(_batch_path(batch_id), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def batch_ended(batch_id: str) -> bool:
+    """送信から MOCK_BATCH_DELAY 秒たったら完了"""
+    return time.time() - _load_batch(batch_id)["created"] >= config.MOCK_BATCH_DELAY
+
+
+def batch_results(batch_id: str) -> dict:
+    """custom_id → (応答, (入力トークン数, 出力トークン数))"""
+    results = {}
+    for custom_id, system_prompt, messages in _load_batch(batch_id)["requests"]:
+        text = generate(system_prompt, messages)
+        results[custom_id] = (text, estimate_usage(system_prompt, messages, text))
+    return results
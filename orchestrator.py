@@ -1,8 +1,26 @@
 """オーケストレーター：ゲーム進行を管理"""
-import re
 import os
+import json
+import time
+import atexit
+import asyncio
+import functools
 from datetime import datetime
-from agents import call_gm, call_pl, call_pl_scenario_gen, call_pl_next_hook, call_gm_session_feedback, call_pl_session_feedback, load_file
+from agents import acall_gm, acall_pl, acall_pl_scenario_gen, acall_pl_next_hook, acall_gm_session_feedback, acall_pl_session_feedback, load_file, CallStats, StreamAborted
+from agents import gm_session_feedback_request, pl_session_feedback_request, get_prompt
+from compaction import HistoryCompactor
+from log_writer import get_writer
+from metrics import CampaignMetrics
+from pl_validator import PLStreamValidator, find_gm_pattern
+from game_state import GameStateTracker
+from memory import RetrievalMemory
+from routing import ModelRouter
+from tokens import ContextLimitError
+from party import load_party, merge_settings, merge_actions, merge_hooks
+from checkpoint import (CampaignState, CampaignCheckpoint, load_checkpoint, PHASE_SCENARIO, PHASE_SESSION, PHASE_TURN,
+                        PHASE_SESSION_END, PHASE_END)
+import metrics
+import deferred
 import config
 
 
@@ -11,183 +29,908 @@ def check_pl_response(response: str) -> tuple[bool, str]:
     if "【行動宣言】" not in response:
         return False, "行動宣言がありません"
     
-    gm_patterns = [
-        r"Turn:",
-        r"HP:",
-        r"SP:",
-        r"Tension:",
-        r"【状況】",
-        r"【判定】",
-        r"【裁定】",
-        r"行動候補",
-        r"あなたはどうしますか",
-        r"選択してください",
-    ]
-    for pattern in gm_patterns:
-        if re.search(pattern, response):
-            return False, f"GM的な振る舞いを検出: {pattern}"
+    pattern = find_gm_pattern(response)
+    if pattern is not None:
+        return False, f"GM的な振る舞いを検出: {pattern}"
     
     return True, "OK"
 
 
+# LLM応答の種別 → (ログの見出し, コンソールの見出し)
+RESPONSE_LABELS = {
+    ("gm", False): ("### 【GM】", "【GM】"),
+    ("gm", True): ("### 【GM 再試行】", "【GM 再試行】"),
+    ("pl", False): ("### 【PL】", "【PL】"),
+    ("pl", True): ("### 【PL 再試行】", "【PL 再試行】"),
+    ("scenario", False): ("## PLによるシナリオ生成", "【PL シナリオ生成】"),
+    ("next_hook", False): ("### 【PL 次回への希望】", "【PL 次回への希望】"),
+    ("gm_feedback", False): ("### 【GM セッション振り返り】", "【GM セッション振り返り】"),
+    ("pl_feedback", False): ("### 【PL セッション振り返り】", "【PL セッション振り返り】"),
+}
+
+
+def _label(kind: str, is_retry: bool = False, speaker: str | None = None) -> str:
+    """コンソールの見出し（パーティではPL名を付ける）"""
+    _, label = RESPONSE_LABELS[(kind, is_retry)]
+    return f"{label} {speaker}" if speaker else label
+
+
 class CampaignLogger:
-    """キャンペーン全体のログをMarkdown形式で保存"""
+    """キャンペーン全体のログをMarkdown形式で保存し、同じ内容をJSONLのイベントログにも出力する
+    
+    ファイルは開いたままにし、書き込みはバックグラウンドスレッドでまとめて行う。
+    ターン・セッションの区切りでフラッシュし、close() （終了時・異常終了時）で書き切る。
+    filepath を渡すと、中断したキャンペーンのログに追記する（再開時）。
+    """
     
-    def __init__(self, scenario_template: str):
+    def __init__(self, scenario_template: str, echo: bool = True, filepath: str | None = None):
         os.makedirs("logs", exist_ok=True)
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.filepath = f"logs/campaign_{timestamp}.md"
         self.session_count = 0
         self.total_turns = 0
+        self.current_turn = 0
+        self._response = None
+        self._closed = False
+        self._writer = get_writer()
         
-        with open(self.filepath, "w", encoding="utf-8") as f:
-            f.write("# Campaign Log\n\n")
-            f.write("## キャンペーン情報\n\n")
-            f.write(f"- 開始日時: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"- GM: {config.GM_PROVIDER} / {config.GM_MODEL}\n")
-            f.write(f"- PL: {config.PL_PROVIDER} / {config.PL_MODEL}\n")
-            f.write("## シナリオテンプレート\n\n")
-            f.write(f"{scenario_template}\n\n")
+        if filepath is None:
+            # 同一秒に複数キャンペーンが開始しても衝突しないよう連番を付与
+            suffix = 1
+            while True:
+                name = f"campaign_{timestamp}" if suffix == 1 else f"campaign_{timestamp}_{suffix}"
+                self.filepath = f"logs/{name}.md"
+                try:
+                    self._file = open(self.filepath, "x", encoding="utf-8")
+                    break
+                except FileExistsError:
+                    suffix += 1
+        else:
+            self.filepath = filepath
+            self._file = open(self.filepath, "a", encoding="utf-8")
+        base = self.filepath.removesuffix(".md")
+        self.events_path = f"{base}.jsonl"
+        self.metrics = CampaignMetrics(os.path.basename(base))
+        self.game_state = GameStateTracker()
+        self.state_path = f"{base}.state.json"
+        self.checkpoint_path = f"{base}.checkpoint.jsonl"
+        self._events = open(self.events_path, "w" if filepath is None else "a", encoding="utf-8")
+        # プロセス終了時にも書き切る
+        atexit.register(self.close)
+        
+        if echo:
+            print(f"📄 ログファイル: {self.filepath}")
+        if filepath is not None:
+            return
         
-        print(f"📄 ログファイル: {self.filepath}")
+        self._write(
+            "# Campaign Log\n\n"
+            "## キャンペーン情報\n\n"
+            f"- 開始日時: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"- GM: {config.GM_PROVIDER} / {config.GM_MODEL}\n"
+            + (f"- PL: {config.PL_PROVIDER} / {config.PL_MODEL}\n" if not config.PARTY else
+               "".join(f"- PL（{pl['name']}）: {pl['provider']} / {pl['model']}\n" for pl in config.PARTY))
+            + ("- モデルの振り分け: 有効（各応答で使ったモデルは計測行に記録）\n" if config.ENABLE_MODEL_ROUTING else "")
+            + "## シナリオテンプレート\n\n"
+            f"{scenario_template}\n\n"
+        )
+        self._event("campaign_start", gm=[config.GM_PROVIDER, config.GM_MODEL], pl=[config.PL_PROVIDER, config.PL_MODEL],
+                    party=config.PARTY, model_routing=config.ENABLE_MODEL_ROUTING, scenario_template=scenario_template)
+    
+    def _write(self, text: str):
+        self._writer.write(self._file, text)
+    
+    def _event(self, event: str, **fields):
+        """JSONLのイベントログに1行追記"""
+        record = {"ts": round(time.time(), 3), "event": event, "session": self.session_count, "turn": self.current_turn}
+        record.update(fields)
+        self._writer.write(self._events, json.dumps(record, ensure_ascii=False) + "\n")
+    
+    def flush(self):
+        """書き込み済みの内容をファイルへ反映させる（完了は待たない）"""
+        self._writer.flush(self._file)
+        self._writer.flush(self._events)
+    
+    def close(self):
+        """すべての書き込みを終えてファイルを閉じる"""
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self._writer.close(self._file)
+        self._writer.close(self._events)
+    
+    def log_resume(self, session_num: int, turn: int, total_turns: int):
+        """中断したキャンペーンの再開を記録（最後のチェックポイント以降に書かれた分はやり直す）"""
+        self.session_count = session_num
+        self.current_turn = turn
+        self.total_turns = total_turns
+        self.metrics.session = session_num
+        self.metrics.turn = turn
+        self._write(
+            "---\n\n"
+            "# Campaign Resumed\n\n"
+            f"- 再開日時: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"- 再開位置: セッション {session_num} / ターン {turn}\n\n"
+        )
+        self._event("campaign_resume", gm=[config.GM_PROVIDER, config.GM_MODEL], pl=[config.PL_PROVIDER, config.PL_MODEL])
+        self.flush()
     
     def log_scenario_generation(self, pl_scenario: str):
         """PLによるシナリオ生成を記録"""
-        with open(self.filepath, "a", encoding="utf-8") as f:
-            f.write("## PLによるシナリオ生成\n\n")
-            f.write(f"{pl_scenario}\n\n")
+        self._log_response("scenario", pl_scenario)
     
     def start_session(self, session_num: int, additional_instruction: str = ""):
         """セッション開始を記録"""
         self.session_count = session_num
+        self.current_turn = 0
+        self.metrics.session = session_num
+        self.metrics.turn = 0
         
-        with open(self.filepath, "a", encoding="utf-8") as f:
-            f.write("---\n\n")
-            f.write(f"# Session {session_num}\n\n")
-            f.write(f"- 開始時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-            
-            if additional_instruction:
-                f.write("## 【オーケストレーター介入】追加指示\n\n")
-                f.write(f"{additional_instruction}\n\n")
+        text = (
+            "---\n\n"
+            f"# Session {session_num}\n\n"
+            f"- 開始時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+        )
+        if additional_instruction:
+            text += "## 【オーケストレーター介入】追加指示\n\n"
+            text += f"{additional_instruction}\n\n"
+        self._write(text)
+        self._event("session_start", instruction=additional_instruction)
+        self.flush()
     
     def log_turn_start(self, turn: int):
         """ターン開始を記録"""
         self.total_turns += 1
-        with open(self.filepath, "a", encoding="utf-8") as f:
-            f.write(f"## Turn {turn}\n\n")
+        self.current_turn = turn
+        self.metrics.turn = turn
+        self._write(f"## Turn {turn}\n\n")
+        self._event("turn_start")
+        self.flush()
     
     def log_gm(self, response: str, is_retry: bool = False):
         """GM応答を記録"""
-        label = "【GM 再試行】" if is_retry else "【GM】"
-        with open(self.filepath, "a", encoding="utf-8") as f:
-            f.write(f"### {label}\n\n")
-            f.write(f"{response}\n\n")
+        self._log_response("gm", response, is_retry)
     
     def log_pl(self, response: str, is_retry: bool = False):
         """PL応答を記録"""
-        label = "【PL 再試行】" if is_retry else "【PL】"
-        with open(self.filepath, "a", encoding="utf-8") as f:
-            f.write(f"### {label}\n\n")
-            f.write(f"{response}\n\n")
+        self._log_response("pl", response, is_retry)
+    
+    def log_anomaly(self, anomaly_type: str, reason: str, stats=None):
+        """異常検知を記録（stats があれば破棄した出力トークン数と、生成の打ち切りで短縮した推定時間も記録）"""
+        text = f"### ⚠️ 異常検知 ({anomaly_type})\n\n{reason}\n\n"
+        fields = {}
+        if stats is not None:
+            saved = None
+            if stats.aborted:
+                # 最後まで生成した場合の応答時間を、これまでの平均で見積もる
+                average = self.metrics.average_latency(anomaly_type.lower())
+                saved = max(0.0, average - stats.latency) if average is not None else None
+            fields = {"aborted": stats.aborted, "wasted_tokens": stats.output_tokens, "saved_seconds": saved}
+            self.metrics.record_anomaly(anomaly_type.lower(), reason, **fields)
+            if stats.aborted:
+                text += f"- 生成を中断（破棄した出力: 約{stats.output_tokens} tokens"
+                text += f" / 短縮: 約{saved:.1f}s）\n\n" if saved is not None else "）\n\n"
+        self._write(text)
+        self._event("anomaly", role=anomaly_type, reason=reason, **fields)
+    
+    def log_compaction(self, role: str, summary: str, before_tokens: int, after_tokens: int, chunks: int = 1):
+        """履歴圧縮を記録（chunks: 要約の入力が収まらず、古いターンを分けて要約した回数）"""
+        text = f"### 🗜️ 履歴圧縮 ({role})\n\n- 推定トークン数: {before_tokens} → {after_tokens}\n"
+        if chunks > 1:
+            text += f"- 要約の分割: {chunks}回\n"
+        self._write(f"{text}\n{summary}\n\n")
+        self._event("compaction", role=role, before_tokens=before_tokens, after_tokens=after_tokens, chunks=chunks,
+                    summary=summary)
+    
+    def log_game_state(self, gm_response: str) -> list:
+        """GM応答の状態表示を取り込み、ルール違反があれば記録して返す"""
+        violations = self.game_state.update(gm_response, self.session_count, self.current_turn)
+        if violations:
+            self._write("### ⚠️ 状態表示の違反\n\n" + "".join(f"- {v}\n" for v in violations) + "\n")
+        self._event("game_state", state=self.game_state.state.to_dict(), violations=violations)
+        return violations
     
-    def log_anomaly(self, anomaly_type: str, reason: str):
-        """異常検知を記録"""
-        with open(self.filepath, "a", encoding="utf-8") as f:
-            f.write(f"### ⚠️ 異常検知 ({anomaly_type})\n\n")
-            f.write(f"{reason}\n\n")
+    def save_game_state(self):
+        """ゲーム状態の推移とルール違反の一覧をログと並べて保存"""
+        with open(self.state_path, "w", encoding="utf-8") as f:
+            json.dump(self.game_state.to_dict(), f, ensure_ascii=False, indent=2)
+    
+    def log_call_error(self, kind: str, reason: str, speaker: str | None = None):
+        """LLM呼び出しの失敗を記録（並行して実行した他の呼び出しは続ける）"""
+        label = _label(kind, False, speaker)
+        self._write(f"### ⚠️ 呼び出し失敗\n\n- 対象: {label}\n- 理由: {reason}\n\n")
+        self._event("call_error", kind=kind, speaker=speaker, reason=reason)
     
     def log_human_input(self, input_text: str):
         """人間の介入を記録"""
-        with open(self.filepath, "a", encoding="utf-8") as f:
-            f.write(f"### 【オーケストレーター介入】\n\n")
-            f.write(f"{input_text}\n\n")
+        self._write(f"### 【オーケストレーター介入】\n\n{input_text}\n\n")
+        self._event("human_input", text=input_text)
     
     def log_pl_next_hook(self, response: str):
         """PLの次回フック選択を記録"""
-        with open(self.filepath, "a", encoding="utf-8") as f:
-            f.write("### 【PL 次回への希望】\n\n")
-            f.write(f"{response}\n\n")
+        self._log_response("next_hook", response)
     
     def log_gm_feedback(self, response: str):
         """GMのセッション振り返りを記録"""
-        with open(self.filepath, "a", encoding="utf-8") as f:
-            f.write("### 【GM セッション振り返り】\n\n")
-            f.write(f"{response}\n\n")
+        self._log_response("gm_feedback", response)
 
     def log_pl_feedback(self, response: str):
         """PLのセッション振り返りを記録"""
-        with open(self.filepath, "a", encoding="utf-8") as f:
-            f.write("### 【PL セッション振り返り】\n\n")
-            f.write(f"{response}\n\n")
+        self._log_response("pl_feedback", response)
+
+    def log_deferred(self, kind: str, request_id: str, speaker: str | None = None):
+        """バッチAPIに後回しにした呼び出しを記録（結果は後からログの末尾に書き戻す）"""
+        header, _ = RESPONSE_LABELS[(kind, False)]
+        title = f"{header} {speaker}" if speaker else header
+        self._write(f"{title}\n\n（バッチAPIで後から生成します。結果はログ末尾の「Batch Results」に追記されます: {request_id}）\n\n")
+        self._event("deferred", kind=kind, speaker=speaker, request_id=request_id)
+    
+    def log_batch_results(self, batch_ids: list):
+        """バッチAPIの結果の書き戻しを開始（各応答は begin_response / end_response で記録する）"""
+        self._write(
+            "---\n\n"
+            "# Batch Results\n\n"
+            f"- 受信日時: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"- バッチ: {', '.join(batch_ids) or 'なし（バッチAPIのないプロバイダーは通常の呼び出しで実行）'}\n\n"
+        )
+        self._event("batch_results", batches=batch_ids)
+    
+    def _log_response(self, kind: str, response: str, is_retry: bool = False):
+        self.begin_response(kind, is_retry)
+        self.write_response(response)
+        self.end_response()
+    
+    def begin_response(self, kind: str, is_retry: bool = False, speaker: str | None = None):
+        """LLM応答の記録を開始（ストリーミング時は write_response で逐次追記する）
+        
+        speaker: パーティのPL名（見出しの後ろに付ける）
+        """
+        header, _ = RESPONSE_LABELS[(kind, is_retry)]
+        self._response = (kind, is_retry, speaker, [])
+        self._write(f"{header} {speaker}\n\n" if speaker else f"{header}\n\n")
+    
+    def write_response(self, text: str):
+        """LLM応答の断片を追記"""
+        self._response[3].append(text)
+        self._write(text)
+    
+    def end_response(self, stats=None):
+        """LLM応答の記録を終了（stats があれば TTFT・応答時間・トークン数も記録）"""
+        kind, is_retry, speaker, parts = self._response
+        self._response = None
+        self._write("\n\n")
+        fields = {"kind": kind, "role": "GM" if kind.startswith("gm") else "PL", "retry": is_retry, "text": "".join(parts)}
+        if speaker:
+            fields["speaker"] = speaker
+        if stats is not None:
+            self._write(f"> {stats.summary()}\n\n")
+            fields.update(
+                provider=stats.provider,
+                model=stats.model,
+                replayed=stats.replayed,
+                timings={"ttft": stats.ttft, "latency": stats.latency, "queue_wait": stats.queue_wait},
+                retries=stats.retries,
+                usage={"input": stats.input_tokens, "cached": stats.cached_tokens, "output": stats.output_tokens},
+            )
+            if stats.route is not None:
+                fields["route"] = stats.route.to_dict()
+            if stats.hedge is not None:
+                fields["hedge"] = stats.hedge
+            if stats.batch is not None:
+                fields["batch"] = stats.batch
+        self._event("response", **fields)
 
     def log_session_end(self, reason: str, session_turns: int):
         """セッション終了を記録"""
-        with open(self.filepath, "a", encoding="utf-8") as f:
-            f.write("## セッション終了\n\n")
-            f.write(f"- 終了理由: {reason}\n")
-            f.write(f"- セッションターン数: {session_turns}\n")
-            f.write(f"- 終了時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        self._write(
+            "## セッション終了\n\n"
+            f"- 終了理由: {reason}\n"
+            f"- セッションターン数: {session_turns}\n"
+            f"- 終了時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+        )
+        self._event("session_end", reason=reason, session_turns=session_turns)
+        self.flush()
     
     def log_campaign_end(self, reason: str):
         """キャンペーン終了を記録"""
-        with open(self.filepath, "a", encoding="utf-8") as f:
-            f.write("---\n\n")
-            f.write("# Campaign End\n\n")
-            f.write(f"- 終了理由: {reason}\n")
-            f.write(f"- 総セッション数: {self.session_count}\n")
-            f.write(f"- 総ターン数: {self.total_turns}\n")
-            f.write(f"- 終了時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        self._write(
+            "---\n\n"
+            "# Campaign End\n\n"
+            f"- 終了理由: {reason}\n"
+            f"- 総セッション数: {self.session_count}\n"
+            f"- 総ターン数: {self.total_turns}\n"
+            f"- 終了時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+        )
+        self._event("campaign_end", reason=reason, total_sessions=self.session_count, total_turns=self.total_turns)
+        self.flush()
+
+
+    def log_metrics_summary(self):
+        """LLM呼び出しの計測値（トークン数・レイテンシ・推定コスト・人間の入力待ち）の集計を記録"""
+        self.metrics.finish()
+        self._write(f"\n---\n\n{self.metrics.to_markdown()}")
+        data = self.metrics.to_dict()
+        data.pop("calls")  # 呼び出しごとの値は response イベントに記録済み
+        self._event("metrics_summary", **data)
+        if config.ENABLE_METRICS_EXPORT:
+            self.metrics.export(self.filepath.removesuffix(".md"))
+
+
+class ConsoleDecider:
+    """人間（オーケストレーター）の判断をコンソール入力で受け取る"""
+    
+    async def _ask(self, prompt: str) -> str:
+        return await asyncio.to_thread(input, prompt)
+    
+    async def confirm_scenario(self) -> str:
+        """シナリオ生成後の確認"""
+        return await self._ask("\n[Enter: このシナリオで開始 / r: 再生成 / q: 終了] > ")
+    
+    async def after_turn(self, session_num: int, turn: int) -> str:
+        """ターン終了後の介入"""
+        return await self._ask("\n[Enter: 続行 / q: キャンペーン終了 / 任意の文字: GMへの指示追加] > ")
+    
+    async def after_session(self, session_num: int) -> str:
+        """セッション終了後の継続判断"""
+        return await self._ask("\n[Enter/y: 新セッション開始 / q: キャンペーン終了 / 任意の文字: 次セッションへの指示] > ")
 
 
-def _run_session_feedback(logger, gm_history, pl_history):
-    """キャンペーン終了時にGM/PLのフィードバックを生成・ログ"""
+class ScriptedDecider:
+    """人間の判断をスクリプトで代替する（ヘッドレス実行用）
+    
+    turn_inputs / session_inputs は先頭から順に消費され、尽きた後は自動続行となる。
+    max_sessions に達したセッションの終了後はキャンペーンを終了する。
+    """
+    
+    def __init__(self, max_sessions: int = 1, turn_inputs: list | None = None, session_inputs: list | None = None):
+        self.max_sessions = max_sessions
+        self.turn_inputs = list(turn_inputs or [])
+        self.session_inputs = list(session_inputs or [])
+    
+    async def confirm_scenario(self) -> str:
+        return ""
+    
+    async def after_turn(self, session_num: int, turn: int) -> str:
+        return self.turn_inputs.pop(0) if self.turn_inputs else ""
+    
+    async def after_session(self, session_num: int) -> str:
+        if session_num >= self.max_sessions:
+            return "q"
+        return self.session_inputs.pop(0) if self.session_inputs else ""
+
+
+async def _ask_human(decision, logger: CampaignLogger) -> str:
+    """人間の判断を待ち、待った時間をLLMの時間とは別に計測する"""
+    start = time.perf_counter()
+    try:
+        return await decision
+    finally:
+        logger.metrics.add_human_wait(time.perf_counter() - start)
+
+
+async def _call_and_log(acall, arg, kind: str, logger: CampaignLogger, out=print, is_retry: bool = False,
+                        stats: CallStats | None = None, validator=None, speaker: str | None = None) -> str:
+    """LLMを呼び出し、応答をコンソールとログに出力（ENABLE_STREAMING時は逐次出力）
+    
+    validator: ストリーミング中に断片を検証するオブジェクト。feed() が理由を返したら生成を打ち切り、
+               StreamAborted を送出する（受信済みの応答は validator.text に残る）
+    speaker: パーティのPL名
+    """
+    label = _label(kind, is_retry, speaker)
+    if stats is None:
+        stats = CallStats()
+    logger.begin_response(kind, is_retry, speaker)
+    try:
+        if config.ENABLE_STREAMING:
+            out(f"\n{label}")
+            
+            def on_chunk(text):
+                out(text, end="", flush=True)
+                logger.write_response(text)
+                if validator is not None:
+                    reason = validator.feed(text)
+                    if reason is not None:
+                        raise StreamAborted(reason)
+            
+            try:
+                response = await acall(arg, on_chunk=on_chunk, stats=stats)
+            finally:
+                out()
+        else:
+            response = await acall(arg, stats=stats)
+            out(f"\n{label}\n{response}")
+            logger.write_response(response)
+    finally:
+        logger.end_response(stats if stats.latency is not None else None)
+    if stats.input_tokens:
+        out(f"  ({stats.summary()})")
+    return response
+
+
+class BackgroundCall:
+    """LLM呼び出しをバックグラウンドで進め、出力する番が来るまで受信した断片を溜めておく
+    
+    result() を呼んだ時点で溜めた分をまとめて出力し、以降は逐次出力する。
+    """
+    
+    def __init__(self, acall, arg, kind: str, speaker: str | None = None):
+        self.kind = kind
+        self.speaker = speaker
+        self.chunks = []
+        self.stats = CallStats()
+        self._sink = None
+        self.task = asyncio.create_task(acall(arg, on_chunk=self._on_chunk, stats=self.stats))
+    
+    def _on_chunk(self, text: str):
+        self.chunks.append(text)
+        if self._sink:
+            self._sink(text)
+    
+    def cancel(self):
+        """呼び出しを取り消す（応答は破棄する）"""
+        self.task.cancel()
+    
+    async def result(self, logger: CampaignLogger, out=print) -> str:
+        """応答をコンソールとログに出力して返す（未完了なら完了まで逐次出力）"""
+        logger.begin_response(self.kind, speaker=self.speaker)
+        out(f"\n{_label(self.kind, speaker=self.speaker)}")
+        
+        def sink(text):
+            out(text, end="", flush=True)
+            logger.write_response(text)
+        
+        for chunk in self.chunks:
+            sink(chunk)
+        self._sink = sink
+        try:
+            response = await self.task
+        finally:
+            logger.end_response(self.stats if self.stats.latency is not None else None)
+        out()
+        if self.stats.input_tokens:
+            out(f"  ({self.stats.summary()})")
+        return response
+
+
+class GMPrefetch(BackgroundCall):
+    """人間の介入待ちの間に、次のGM応答をバックグラウンドで先行取得する（使わない場合は cancel() で破棄）"""
+    
+    def __init__(self, history: list, acall=acall_gm):
+        super().__init__(acall, history, "gm")
+
+
+class CallPipeline:
+    """互いの出力に依存しないLLM呼び出しを並行実行し、追加した順にコンソールとログへ出力する
+    
+    after に指定した呼び出しが終わってから始める（arg に関数を渡すと、それまでの応答の辞書から引数を作る）。
+    1つの呼び出しが失敗しても他の呼び出しは続け、失敗はログに記録して応答を None にする。
+    """
+    
+    def __init__(self, logger: CampaignLogger, out=print):
+        self.logger = logger
+        self.out = out
+        self._steps = []  # (名前, 種別, PL名, acall, arg, after)
+    
+    def add(self, kind: str, acall, arg, after: tuple = (), speaker: str | None = None) -> str:
+        """呼び出しを追加して名前（種別、パーティのPLは "種別:PL名"）を返す
+        
+        after には先に追加した呼び出しの名前だけを指定できる。
+        """
+        name = f"{kind}:{speaker}" if speaker else kind
+        added = [step[0] for step in self._steps]
+        if name in added:
+            raise ValueError(f"同じ呼び出しが追加済みです: {name}")
+        unknown = [dep for dep in after if dep not in added]
+        if unknown:
+            raise ValueError(f"先に追加されていない呼び出しには依存できません: {', '.join(unknown)}")
+        self._steps.append((name, kind, speaker, acall, arg, tuple(after)))
+        return name
+    
+    async def run(self) -> dict:
+        """すべての呼び出しを実行し、名前 → 応答（失敗・未実行は None）を返す"""
+        results = {}
+        pending = list(self._steps)
+        while pending:
+            # 依存先が終わった呼び出しをまとめて開始し、追加した順に出力する
+            ready = [step for step in pending if all(dep in results for dep in step[5])]
+            pending = [step for step in pending if not all(dep in results for dep in step[5])]
+            calls = []
+            for name, kind, speaker, acall, arg, after in ready:
+                if any(results[dep] is None for dep in after):
+                    calls.append((name, kind, speaker, None))
+                else:
+                    call = BackgroundCall(acall, arg(results) if callable(arg) else arg, kind, speaker)
+                    calls.append((name, kind, speaker, call))
+            try:
+                for name, kind, speaker, call in calls:
+                    results[name] = await self._output(kind, speaker, call)
+            except BaseException:
+                for *_, call in calls:
+                    if call is not None:
+                        call.cancel()
+                raise
+        return results
+    
+    async def _output(self, kind: str, speaker: str | None, call: BackgroundCall | None) -> str | None:
+        if call is None:
+            reason = "依存する呼び出しが失敗したため実行しませんでした"
+        else:
+            try:
+                return await call.result(self.logger, self.out)
+            except Exception as e:
+                reason = f"{type(e).__name__}: {e}"
+        self.out(f"\n⚠️ {_label(kind, speaker=speaker)}の生成に失敗: {reason}")
+        self.logger.log_call_error(kind, reason, speaker)
+        return None
+
+
+class DeferredOutput:
+    """並行して進める処理のコンソール出力とログ書き込みを溜めておき、順番が来たら書き出す
+    
+    .logger は CampaignLogger の代わりに渡すと、メソッド呼び出しを溜める（go_live() 以降はそのまま呼ぶ）。
+    """
+    
+    def __init__(self, logger: CampaignLogger, out=print):
+        self._logger = logger
+        self._out = out
+        self._pending = []  # (関数, args, kwargs)
+        self._live = False
+        self.logger = _DeferredLogger(self)
+    
+    def _emit(self, func, args, kwargs):
+        if self._live:
+            func(*args, **kwargs)
+        else:
+            self._pending.append((func, args, kwargs))
+    
+    def out(self, *args, **kwargs):
+        self._emit(self._out, args, kwargs)
+    
+    def go_live(self):
+        """溜めた分を書き出し、以降は逐次出力する"""
+        for func, args, kwargs in self._pending:
+            func(*args, **kwargs)
+        self._pending = []
+        self._live = True
+
+
+class _DeferredLogger:
+    def __init__(self, output: DeferredOutput):
+        self._output = output
+    
+    def __getattr__(self, name: str):
+        method = getattr(self._output._logger, name)
+        return lambda *args, **kwargs: self._output._emit(method, args, kwargs)
+
+
+def _track_game_state(logger: CampaignLogger, gm_response: str, out=print):
+    """GM応答の状態表示でゲーム状態を更新し、ルール違反を表示"""
+    for violation in logger.log_game_state(gm_response):
+        out(f"⚠️ 状態表示: {violation}")
+
+
+async def _compact_history(compactor: HistoryCompactor, history: list, logger: CampaignLogger,
+                          checkpoint: CampaignCheckpoint, out=print, key: str | None = None):
+    """履歴が閾値を超えていれば圧縮し、ログとチェックポイントに記録する
+    
+    key: チェックポイントでの履歴のキー（パーティのPLは PartyMember.key。省略時は compactor.role）
+    """
+    key = key or compactor.role
+    length = len(history)
+    result = await compactor.maybe_compact(history)
+    if result:
+        before, after = result
+        role = key.upper()
+        split = f"（要約を{compactor.chunks}回に分割）" if compactor.chunks > 1 else ""
+        out(f"\n🗜️ 履歴圧縮 ({role}): 推定 {before} → {after} tokens{split}")
+        logger.log_compaction(role, compactor.summary, before, after, compactor.chunks)
+        checkpoint.compacted(key, length)
+
+
+async def _pl_action(member, history: list, gm_response: str, logger: CampaignLogger, checkpoint: CampaignCheckpoint,
+                     out=print, router: ModelRouter | None = None) -> str:
+    """1人のPLにGMの描写への行動を宣言させる（GM的な振る舞い・行動宣言なしなら1回だけ再試行）"""
+    acall = _pl_caller(member, router)
+    speaker = member.label
+    
+    # PLに状況を伝える
+    history.append({"role": "user", "content": f"GMからの描写：\n{gm_response}"})
+    
+    # PLの行動（GM的な表現が現れた時点で生成を打ち切る）
+    await _compact_history(member.compactor, history, logger, checkpoint, out, key=member.key)
+    pl_stats = CallStats()
+    validator = PLStreamValidator() if config.ENABLE_PL_STREAM_ABORT else None
+    try:
+        pl_response = await _call_and_log(acall, history, "pl", logger, out, stats=pl_stats, validator=validator,
+                                          speaker=speaker)
+        is_valid, reason = check_pl_response(pl_response)
+    except StreamAborted as e:
+        pl_response = validator.text
+        is_valid, reason = False, e.reason
+    history.append({"role": "assistant", "content": pl_response})
+    
+    # 異常検知
+    if not is_valid:
+        if speaker:
+            reason = f"{speaker}: {reason}"
+        out(f"\n⚠️ 異常検知: {reason}")
+        logger.log_anomaly("PL", reason, pl_stats)
+        
+        history.append({"role": "user", "content": "あなたはPLです。GMの役割は行わず、【行動宣言】を含めて応答してください。"})
+        retry_call = _pl_caller(member, router, retry=True)
+        if config.PL_RETRY_CANDIDATES > 1:
+            pl_response = await _race_pl_retry(retry_call, history, logger, out, speaker, config.PL_RETRY_CANDIDATES)
+        else:
+            pl_response = await _call_and_log(retry_call, history, "pl", logger, out, is_retry=True, speaker=speaker)
+        history.append({"role": "assistant", "content": pl_response})
+    return pl_response
+
+
+async def _race_pl_retry(acall, history: list, logger: CampaignLogger, out, speaker: str | None, candidates: int) -> str:
+    """PLの再試行の候補を並行して生成し、最初に検証を通った候補を使う（どれも通らなければ最初に届いた候補）
+    
+    候補は逐次出力せず、使う候補だけをコンソールとログに出力する。残りの候補は取り消す。
+    """
+    async def candidate(index: int) -> tuple[int, str, bool, CallStats]:
+        stats = CallStats()
+        text = await acall(history, stats=stats)
+        return index, text, check_pl_response(text)[0], stats
+    
+    tasks = [asyncio.create_task(candidate(i)) for i in range(candidates)]
+    chosen = None
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                result = await next_done
+            except Exception as e:
+                # 1候補の失敗は他の候補で補う（全候補が失敗したら最後の例外を送出する）
+                error = e
+                continue
+            if chosen is None or (result[2] and not chosen[2]):
+                chosen = result
+            if chosen[2]:
+                break
+        if chosen is None:
+            raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+    
+    index, text, valid, stats = chosen
+    logger.begin_response("pl", True, speaker)
+    logger.write_response(text)
+    logger.end_response(stats)
+    out(f"\n{_label('pl', True, speaker)}\n{text}")
+    note = "検証を通った" if valid else "どれも検証を通らなかったため最初に届いた"
+    out(f"  ({stats.summary()} / 候補 {candidates}件のうち{note}{index + 1}件目を使用)")
+    return text
+
+
+async def _party_actions(members: list, state: CampaignState, gm_response: str, logger: CampaignLogger,
+                         checkpoint: CampaignCheckpoint, out=print, router: ModelRouter | None = None) -> list:
+    """全PLの行動を同じGMの描写から並行して求め、PLの順に出力して返す
+    
+    ターンの待ち時間は最も遅いPL（再試行を含む）で決まる。先頭のPLは逐次出力し、他のPLの出力は順番が来るまで溜める。
+    """
+    outputs = [DeferredOutput(logger, out) for _ in members]
+    tasks = [
+        asyncio.create_task(_pl_action(member, state.history(member.key), gm_response, output.logger, checkpoint, output.out,
+                                       router))
+        for member, output in zip(members, outputs)
+    ]
+    try:
+        actions = []
+        for task, output in zip(tasks, outputs):
+            output.go_live()
+            actions.append(await task)
+        return actions
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def _run_session_feedback(logger, state: CampaignState, members: list, echo=print):
+    """キャンペーン終了時にGM/PL（パーティでは全員）のフィードバックを並行して生成し、GM→PLの順にログ
+    
+    DEFERRED_ROLES に含まれる振り返りは生成せず、バッチAPIの待ち行列に入れる（→ batch_api.py）。
+    """
     if not config.ENABLE_SESSION_FEEDBACK:
         return
-    print("\n【セッション振り返り生成中...】\n")
-    gm_feedback = call_gm_session_feedback(gm_history)
-    print(f"【GM セッション振り返り】\n{gm_feedback}")
-    logger.log_gm_feedback(gm_feedback)
-    pl_feedback = call_pl_session_feedback(pl_history)
-    print(f"\n【PL セッション振り返り】\n{pl_feedback}")
-    logger.log_pl_feedback(pl_feedback)
+    echo("\n【セッション振り返り生成中...】\n")
+    if deferred.enabled("gm_feedback"):
+        _defer(logger, "gm_feedback", gm_session_feedback_request(state.gm_history), echo)
+    pipeline = CallPipeline(logger, echo)
+    if not deferred.enabled("gm_feedback"):
+        pipeline.add("gm_feedback", acall_gm_session_feedback, state.gm_history)
+    for member in members:
+        if not deferred.enabled("pl_feedback"):
+            pipeline.add("pl_feedback", functools.partial(acall_pl_session_feedback, member=member),
+                         state.history(member.key), speaker=member.label)
+    await pipeline.run()
+    if deferred.enabled("pl_feedback"):
+        for member in members:
+            _defer(logger, "pl_feedback", pl_session_feedback_request(state.history(member.key), member), echo,
+                   member.label)
+
+
+def _defer(logger: CampaignLogger, kind: str, request: dict, out=print, speaker: str | None = None):
+    """呼び出しをバッチAPIの待ち行列に入れる（ログとコンソールには後回しにしたことだけを出力する）"""
+    request_id = deferred.defer(logger, kind, request, speaker)
+    out(f"\n{_label(kind, speaker=speaker)}\n（バッチAPIで後から生成します: {request_id}）")
+
+
+def _gm_caller(state: CampaignState, router: ModelRouter | None = None):
+    """ターンのGM呼び出し
+    
+    検索メモリが有効なら、最初の指示・直近のやり取り・関連する過去の記録だけを送る。
+    router があれば、呼び出しごとにモデルを選ぶ（入力にオーケストレーターの指示があるかも判断材料にする）。
+    """
+    memory = state.memory
+    if memory is None and router is None:
+        return acall_gm
+    
+    async def call(history: list, stats: CallStats | None = None, **kwargs) -> str:
+        if router is not None:
+            kwargs["target"] = router.route("gm", history, (config.GM_PROVIDER, config.GM_MODEL), stats).target
+        if memory is not None:
+            history = memory.context(history, state.session_num, state.turn)
+        return await acall_gm(history, stats=stats, **kwargs)
+    return call
+
+
+def _pl_caller(member, router: ModelRouter | None = None, retry: bool = False):
+    """ターンのPL呼び出し（router があれば、呼び出しごとにモデルを選ぶ）"""
+    if router is None:
+        return functools.partial(acall_pl, member=member)
+    
+    async def call(history: list, stats: CallStats | None = None, **kwargs) -> str:
+        route = router.route("pl", history, (member.provider, member.model), stats, retry)
+        return await acall_pl(history, stats=stats, member=member, target=route.target, **kwargs)
+    return call
+
+
+def _token_budget_exceeded(state: CampaignState, logger: CampaignLogger) -> str | None:
+    """セッション・キャンペーンのトークン予算を使い切っていれば、セッションを終える理由を返す"""
+    used = logger.metrics.tokens_used
+    if config.CAMPAIGN_TOKEN_BUDGET and used >= config.CAMPAIGN_TOKEN_BUDGET:
+        return f"トークン予算超過（キャンペーン: {used} / {config.CAMPAIGN_TOKEN_BUDGET} tokens）"
+    session_used = used - state.session_tokens_start
+    if config.SESSION_TOKEN_BUDGET and session_used >= config.SESSION_TOKEN_BUDGET:
+        return f"トークン予算超過（セッション: {session_used} / {config.SESSION_TOKEN_BUDGET} tokens）"
+    return None
+
+
+def _end_by_context_limit(error: ContextLimitError, logger: CampaignLogger, turn: int, out=print):
+    """履歴を圧縮してもコンテキストウィンドウに収まらない呼び出しがあれば、そのターンでセッションを終える"""
+    out(f"\n⚠️ {error}")
+    out("\nセッション終了（コンテキスト上限）")
+    logger.log_session_end(f"コンテキスト上限（{error}）", turn)
+
+
+def _silent(*args, **kwargs):
+    pass
 
 
 def run_session(scenario_template_path: str):
-    """キャンペーンを実行（複数セッション対応）"""
+    """キャンペーンを実行（複数セッション対応・コンソール対話）"""
+    asyncio.run(run_campaign(scenario_template_path, ConsoleDecider()))
+
+
+def resume(checkpoint_path: str):
+    """中断したキャンペーンをチェックポイントから再開（コンソール対話）"""
+    asyncio.run(resume_campaign(checkpoint_path, ConsoleDecider()))
+
+
+async def run_campaign(scenario_template_path: str, decider=None, echo: bool = True) -> CampaignLogger:
+    """キャンペーンを実行（複数セッション対応）
+    
+    decider: 人間の判断を提供するオブジェクト（ConsoleDecider / ScriptedDecider）
+    echo: Falseでコンソール出力を抑制する（ヘッドレス実行用）
+    """
+    logger, state, checkpoint = new_campaign(scenario_template_path, echo)
+    await play_campaign(logger, state, checkpoint, decider, echo)
+    return logger
+
+
+async def resume_campaign(checkpoint_path: str, decider=None, echo: bool = True) -> CampaignLogger:
+    """チェックポイントから会話履歴と進行状況を復元し、同じログファイルに続けてキャンペーンを実行
     
+    最後のチェックポイント（ターン・セッションの区切り）以降の途中のやり取りはやり直す。
+    """
+    logger, state, checkpoint = load_campaign(checkpoint_path, echo)
+    await play_campaign(logger, state, checkpoint, decider, echo)
+    return logger
+
+
+def new_campaign(scenario_template_path: str, echo: bool = True) -> tuple[CampaignLogger, CampaignState, CampaignCheckpoint]:
+    """新しいキャンペーンのログ・状態・チェックポイントを用意する（進行は play_campaign()）"""
     # シナリオテンプレート読み込み
     scenario_template = load_file(scenario_template_path)
     
-    logger = CampaignLogger(scenario_template)
-    
-    print("=" * 50)
-    print("キャンペーン開始")
-    print("=" * 50)
-    
-    # PLによるシナリオ生成
-    print("\n【PLによるシナリオ生成中...】\n")
-    pl_scenario = call_pl_scenario_gen(scenario_template)
-    print(f"【PL シナリオ生成】\n{pl_scenario}")
-    logger.log_scenario_generation(pl_scenario)
+    logger = CampaignLogger(scenario_template, echo=echo)
+    state = CampaignState(scenario_template_path, scenario_template)
+    state.metrics = logger.metrics
+    if config.ENABLE_RETRIEVAL_MEMORY:
+        state.memory = RetrievalMemory()
+    checkpoint = CampaignCheckpoint(logger.checkpoint_path if config.ENABLE_CHECKPOINT else None, state,
+                                    log_path=logger.filepath)
+    return logger, state, checkpoint
+
+
+def load_campaign(checkpoint_path: str, echo: bool = True) -> tuple[CampaignLogger, CampaignState, CampaignCheckpoint]:
+    """中断したキャンペーンのログ・状態・チェックポイントをチェックポイントから復元する（進行は play_campaign()）"""
+    # 復元したGM応答からゲーム状態と検索メモリも再構築する
+    game_state = GameStateTracker()
+    memory = RetrievalMemory() if config.ENABLE_RETRIEVAL_MEMORY else None
+    log_path, state = load_checkpoint(checkpoint_path, on_gm_response=game_state.update,
+                                      on_gm_message=memory.restore if memory else None)
+    if state.phase == PHASE_END:
+        raise ValueError(f"このキャンペーンは終了しています: {checkpoint_path}")
+    state.memory = memory
     
-    # 人間の確認
-    confirm = input("\n[Enter: このシナリオで開始 / r: 再生成 / q: 終了] > ")
-    if confirm.lower() == "q":
-        print("\nキャンペーン終了")
-        logger.log_campaign_end("人間による中断（シナリオ生成後）")
-        return
-    elif confirm.lower() == "r":
-        print("\n【シナリオ再生成中...】\n")
-        pl_scenario = call_pl_scenario_gen(scenario_template)
-        print(f"【PL シナリオ生成】\n{pl_scenario}")
-        logger.log_scenario_generation(pl_scenario)
+    logger = CampaignLogger(state.scenario_template, echo=echo, filepath=log_path)
+    logger.game_state = game_state
+    # トークン予算は中断前に使った分から続けて数える
+    logger.metrics.tokens_used = state.tokens_used
+    state.metrics = logger.metrics
+    logger.log_resume(state.session_num, state.turn, state.total_turns)
+    return logger, state, CampaignCheckpoint(checkpoint_path, state)
+
+
+async def play_campaign(logger: CampaignLogger, state: CampaignState, checkpoint: CampaignCheckpoint, decider=None,
+                        echo: bool = True, out=None):
+    """用意したキャンペーンを進行し、終了（異常終了・キャンセルを含む）時にログを書き切る
     
-    session_num = 0
-    gm_history = []
+    out: コンソールの代わりに出力を受け取る関数（print と同じ引数。指定時は echo より優先）
+    """
+    if decider is None:
+        decider = ConsoleDecider()
+    if out is None:
+        out = print if echo else _silent
     
-    # 最初のGMへの指示
-    initial_prompt = f"""以下のシナリオテンプレートとPLが作成した設定でセッションを開始してください。
+    # このキャンペーン内のLLM呼び出し（先行取得のタスクを含む）を logger.metrics に集計する
+    token = metrics.activate(logger.metrics)
+    try:
+        await _play_campaign(logger, state, checkpoint, decider, out)
+    finally:
+        metrics.deactivate(token)
+        # 異常終了時も計測値とゲーム状態を残し、ログを書き切る
+        logger.log_metrics_summary()
+        logger.save_game_state()
+        checkpoint.close()
+        logger.close()
+    totals = logger.metrics.totals()
+    out(
+        f"推定コスト: ${totals['cost_usd']:.4f} / LLM呼び出し: {totals['calls']}回 "
+        f"(応答時間の合計 {totals['latency']:.1f}s) / 人間の入力待ち: {logger.metrics.human_wait:.1f}s"
+    )
+
+
+async def _create_characters(members: list, scenario_template: str, logger: CampaignLogger, out=print) -> list:
+    """全PLのPC設定・初回セッション設定を並行して生成し、PLの順に出力して返す"""
+    pipeline = CallPipeline(logger, out)
+    names = [pipeline.add("scenario", functools.partial(acall_pl_scenario_gen, member=member), scenario_template,
+                          speaker=member.label) for member in members]
+    results = await pipeline.run()
+    personas = [results[name] for name in names]
+    if None in personas:
+        raise RuntimeError("PLによるシナリオ生成に失敗しました")
+    return personas
+
+
+def commit_characters(state: CampaignState, checkpoint: CampaignCheckpoint, members: list, personas: list):
+    """PLが作ったPC設定を状態に入れ、GMへの最初の指示を履歴に加えて、セッションの開始前として記録する"""
+    state.personas = {member.key: persona for member, persona in zip(members, personas)}
+    state.pl_scenario = merge_settings(members, personas)
+    state.gm_history.append({"role": "user", "content": _initial_gm_prompt(state.scenario_template, state.pl_scenario)})
+    checkpoint.commit(PHASE_SESSION, pl_scenario=state.pl_scenario, personas=state.personas)
+
+
+def _initial_gm_prompt(scenario_template: str, pl_scenario: str) -> str:
+    """最初のGMへの指示"""
+    return f"""以下のシナリオテンプレートとPLが作成した設定でセッションを開始してください。
 
 【シナリオテンプレート】
 {scenario_template}
@@ -195,131 +938,229 @@ def run_session(scenario_template_path: str):
 【PLが作成した設定】
 {pl_scenario}
 """
-    gm_history.append({"role": "user", "content": initial_prompt})
-    
-    next_session_instruction = ""  # 次セッションへの指示を保持
 
-    while True:
-        session_num += 1
-        turn = 0
-        pl_history = []
-        
-        # セッション開始
-        logger.start_session(session_num, next_session_instruction)
-        next_session_instruction = ""  # 指示をリセット
-        
-        print(f"\n{'='*50}")
-        print(f"セッション {session_num} 開始")
-        print("=" * 50)
-        
-        # GMの最初の描写
-        gm_response = call_gm(gm_history)
-        gm_history.append({"role": "assistant", "content": gm_response})
+
+async def _play_campaign(logger: CampaignLogger, state: CampaignState, checkpoint: CampaignCheckpoint, decider, out):
+    """キャンペーン進行の本体（state.phase の位置から進める）
+    
+    ターン・セッションの区切りごとに checkpoint.commit() で再開できる位置を記録する。
+    """
+    out("=" * 50)
+    out("キャンペーン開始" if state.phase == PHASE_SCENARIO else f"キャンペーン再開（セッション {state.session_num} / ターン {state.turn}）")
+    out("=" * 50)
+    
+    members = load_party()
+    
+    if state.phase == PHASE_SCENARIO:
+        # PLによるシナリオ生成（パーティでは全員が並行して自分のPCを作る）
+        out("\n【PLによるシナリオ生成中...】\n")
+        personas = await _create_characters(members, state.scenario_template, logger, out)
         
-        print(f"\n【GM】\n{gm_response}")
-        logger.log_turn_start(0)
-        logger.log_gm(gm_response)
+        # 人間の確認
+        confirm = await _ask_human(decider.confirm_scenario(), logger)
+        if confirm.lower() == "q":
+            out("\nキャンペーン終了")
+            logger.log_campaign_end("人間による中断（シナリオ生成後）")
+            checkpoint.commit(PHASE_END)
+            return
+        elif confirm.lower() == "r":
+            out("\n【シナリオ再生成中...】\n")
+            personas = await _create_characters(members, state.scenario_template, logger, out)
         
-        # ターンループ
-        session_ended_by_gm = False
+        commit_characters(state, checkpoint, members, personas)
+    
+    for member in members:
+        member.persona = state.personas.get(member.key, "")
+    gm_history = state.gm_history
+    router = ModelRouter(state, logger) if config.ENABLE_MODEL_ROUTING else None
+    acall_gm_turn = _gm_caller(state, router)
+    # 検索メモリではターンのGM呼び出しに履歴全体を送らないので、閾値での圧縮（要約の呼び出し）は行わない
+    gm_compactor = HistoryCompactor("gm", pinned=_initial_gm_prompt(state.scenario_template, state.pl_scenario),
+                                    target=(config.GM_PROVIDER, config.GM_MODEL, get_prompt("GM_SYSTEM_PROMPT")),
+                                    threshold=state.memory is None)
+
+    while True:
+        for member in members:
+            member.new_compactor()
         
-        while turn < config.MAX_TURNS:
-            turn += 1
-            print(f"\n{'='*50}")
-            print(f"セッション {session_num} - ターン {turn}")
-            print("=" * 50)
-            
-            logger.log_turn_start(turn)
-            
-            # PLに状況を伝える
-            pl_history.append({"role": "user", "content": f"GMからの描写：\n{gm_response}"})
+        if state.phase == PHASE_SESSION:
+            state.session_num += 1
+            state.turn = 0
+            state.session_tokens_start = logger.metrics.tokens_used
+            for member in members:
+                checkpoint.reset(member.key)
             
-            # PLの行動
-            pl_response = call_pl(pl_history)
-            pl_history.append({"role": "assistant", "content": pl_response})
+            # セッション開始
+            logger.start_session(state.session_num, state.next_session_instruction)
+            state.next_session_instruction = ""  # 指示をリセット
             
-            print(f"\n【PL】\n{pl_response}")
-            logger.log_pl(pl_response)
+            out(f"\n{'='*50}")
+            out(f"セッション {state.session_num} 開始")
+            out("=" * 50)
             
-            # 異常検知
-            is_valid, reason = check_pl_response(pl_response)
-            if not is_valid:
-                print(f"\n⚠️ 異常検知: {reason}")
-                logger.log_anomaly("PL", reason)
-                
-                pl_history.append({"role": "user", "content": "あなたはPLです。GMの役割は行わず、【行動宣言】を含めて応答してください。"})
-                pl_response = call_pl(pl_history)
-                pl_history.append({"role": "assistant", "content": pl_response})
-                print(f"\n【PL 再試行】\n{pl_response}")
-                logger.log_pl(pl_response, is_retry=True)
-            
-            # 人間の介入ポイント（ターン終了後）
-            user_input = input("\n[Enter: 続行 / q: キャンペーン終了 / 任意の文字: GMへの指示追加] > ")
-            
-            if user_input.lower() == "q":
-                print("\nキャンペーン終了（人間による中断）")
-                logger.log_session_end("人間による中断", turn)
-                _run_session_feedback(logger, gm_history, pl_history)
-                logger.log_campaign_end("人間による中断")
-                print(f"\nログ保存先: {logger.filepath}")
-                return
-            
-            # GMへの指示追加
-            gm_input = f"PLの行動：\n{pl_response}"
-            if user_input:
-                gm_input += f"\n\n【オーケストレーターからの指示】{user_input}"
-                logger.log_human_input(user_input)
-            
-            gm_history.append({"role": "user", "content": gm_input})
-            
-            # GMの応答
-            gm_response = call_gm(gm_history)
+            # GMの最初の描写
+            logger.log_turn_start(0)
+            try:
+                await _compact_history(gm_compactor, gm_history, logger, checkpoint, out)
+                gm_response = await _call_and_log(acall_gm_turn, gm_history, "gm", logger, out)
+            except ContextLimitError as e:
+                # 圧縮しても始められないセッションは、これ以上続けられない
+                _end_by_context_limit(e, logger, 0, out)
+                await _run_session_feedback(logger, state, members, out)
+                logger.log_campaign_end("コンテキスト上限")
+                checkpoint.commit(PHASE_END)
+                break
             gm_history.append({"role": "assistant", "content": gm_response})
+            _track_game_state(logger, gm_response, out)
+            state.total_turns = logger.total_turns
+            checkpoint.commit(PHASE_TURN)
+        
+        session_num = state.session_num
+        gm_response = state.gm_response
+        
+        if state.phase == PHASE_TURN:
+            # ターンループ
+            session_ended = False
             
-            print(f"\n【GM】\n{gm_response}")
-            logger.log_gm(gm_response)
+            while state.turn < config.MAX_TURNS:
+                state.turn += 1
+                turn = state.turn
+                out(f"\n{'='*50}")
+                out(f"セッション {session_num} - ターン {turn}")
+                out("=" * 50)
+                
+                logger.log_turn_start(turn)
+                
+                # 全PLの行動（パーティでは並行して求め、1つのGMへの入力にまとめる）
+                try:
+                    actions = await _party_actions(members, state, gm_response, logger, checkpoint, out, router)
+                except ContextLimitError as e:
+                    _end_by_context_limit(e, logger, turn, out)
+                    session_ended = True
+                    break
+                pl_actions = merge_actions(members, actions)
+                
+                # 介入なしで続行した場合に備え、次のGM応答を先行取得しておく
+                prefetch = None
+                if config.ENABLE_GM_PREFETCH:
+                    try:
+                        await _compact_history(gm_compactor, gm_history, logger, checkpoint, out)
+                        prefetch = GMPrefetch(gm_history + [{"role": "user", "content": pl_actions}], acall_gm_turn)
+                    except ContextLimitError:
+                        # 先行取得はせず、GMの応答の時点で圧縮し直す（収まらなければそこでセッションを終える）
+                        pass
+                
+                # 人間の介入ポイント（ターン終了後）
+                try:
+                    user_input = await _ask_human(decider.after_turn(session_num, turn), logger)
+                except BaseException:
+                    if prefetch:
+                        prefetch.cancel()
+                    raise
+                if prefetch and user_input:
+                    # 中断・指示追加の場合は先行取得した応答を使わない
+                    prefetch.cancel()
+                    prefetch = None
+                
+                if user_input.lower() == "q":
+                    out("\nキャンペーン終了（人間による中断）")
+                    logger.log_session_end("人間による中断", turn)
+                    await _run_session_feedback(logger, state, members, out)
+                    logger.log_campaign_end("人間による中断")
+                    checkpoint.commit(PHASE_END)
+                    out(f"\nログ保存先: {logger.filepath}")
+                    return
+                
+                # GMへの指示追加
+                gm_input = pl_actions
+                if user_input:
+                    gm_input += f"\n\n【オーケストレーターからの指示】{user_input}"
+                    logger.log_human_input(user_input)
+                
+                gm_history.append({"role": "user", "content": gm_input})
+                
+                # GMの応答
+                try:
+                    if prefetch:
+                        gm_response = await prefetch.result(logger, out)
+                    else:
+                        await _compact_history(gm_compactor, gm_history, logger, checkpoint, out)
+                        gm_response = await _call_and_log(acall_gm_turn, gm_history, "gm", logger, out)
+                except ContextLimitError as e:
+                    # 応答のないPLの行動は履歴から外し、直前のGM応答でセッションを終える
+                    gm_history.pop()
+                    gm_response = state.gm_response
+                    _end_by_context_limit(e, logger, turn, out)
+                    session_ended = True
+                    break
+                gm_history.append({"role": "assistant", "content": gm_response})
+                _track_game_state(logger, gm_response, out)
+                state.total_turns = logger.total_turns
+                
+                # セッション終了判定（GMが【セッション終了】を出力した場合）
+                if "【セッション終了】" in gm_response:
+                    out("\nセッション終了（GM判断）")
+                    logger.log_session_end("GM判断", turn)
+                    session_ended = True
+                    break
+                
+                # トークン予算の確認（ターンの区切りで確認するので、最後のターンの分だけ超えることがある）
+                reason = _token_budget_exceeded(state, logger)
+                if reason:
+                    out(f"\nセッション終了（{reason}）")
+                    logger.log_session_end(reason, turn)
+                    session_ended = True
+                    break
+                
+                checkpoint.commit(PHASE_TURN)
             
-            # セッション終了判定（GMが【セッション終了】を出力した場合）
-            if "【セッション終了】" in gm_response:
-                print("\nセッション終了（GM判断）")
-                logger.log_session_end("GM判断", turn)
-                session_ended_by_gm = True
-                break
+            # 最大ターン到達の場合
+            if not session_ended:
+                out("\nセッション終了（最大ターン到達）")
+                logger.log_session_end("最大ターン到達", state.turn)
+            checkpoint.commit(PHASE_SESSION_END)
         
-        # 最大ターン到達の場合
-        if not session_ended_by_gm:
-            print("\nセッション終了（最大ターン到達）")
-            logger.log_session_end("最大ターン到達", turn)
+        # キャンペーンのトークン予算を使い切ったら、次のセッションに進まずに終える
+        if config.CAMPAIGN_TOKEN_BUDGET and logger.metrics.tokens_used >= config.CAMPAIGN_TOKEN_BUDGET:
+            out("\nキャンペーン終了（トークン予算超過）")
+            await _run_session_feedback(logger, state, members, out)
+            logger.log_campaign_end("トークン予算超過")
+            checkpoint.commit(PHASE_END)
+            break
         
-        # PLに次回フック選択を依頼
-        print("\n【PLによる次回フック選択中...】\n")
-        pl_next_hook = call_pl_next_hook(gm_response)
-        print(f"【PL 次回への希望】\n{pl_next_hook}")
-        logger.log_pl_next_hook(pl_next_hook)
+        # PLに次回フック選択を依頼（パーティでは全員に並行して依頼）
+        out("\n【PLによる次回フック選択中...】\n")
+        pipeline = CallPipeline(logger, out)
+        names = [pipeline.add("next_hook", functools.partial(acall_pl_next_hook, member=member), gm_response,
+                              speaker=member.label) for member in members]
+        hooks = await pipeline.run()
+        pl_next_hook = merge_hooks(members, [hooks[name] for name in names])
         
         # セッション終了後の選択
-        print(f"\n{'='*50}")
-        print("セッション終了")
-        print("=" * 50)
+        out(f"\n{'='*50}")
+        out("セッション終了")
+        out("=" * 50)
         
-        next_input = input("\n[Enter/y: 新セッション開始 / q: キャンペーン終了 / 任意の文字: 次セッションへの指示] > ")
+        next_input = await _ask_human(decider.after_session(session_num), logger)
         
         if next_input.lower() == "q":
-            print("\nキャンペーン終了")
-            _run_session_feedback(logger, gm_history, pl_history)
+            out("\nキャンペーン終了")
+            await _run_session_feedback(logger, state, members, out)
             logger.log_campaign_end("人間による終了")
+            checkpoint.commit(PHASE_END)
             break
         elif next_input.lower() in ["", "y"]:
             # 新セッション開始（PLの希望を反映）
             gm_history.append({"role": "user", "content": f"新しいセッションを開始してください。\n\n【PLの次回への希望】\n{pl_next_hook}"})
         else:
             # 追加指示付きで新セッション開始
-            next_session_instruction = next_input  # ログ記録用に保存
+            state.next_session_instruction = next_input  # ログ記録用に保存
             gm_history.append({"role": "user", "content": f"新しいセッションを開始してください。\n\n【PLの次回への希望】\n{pl_next_hook}\n\n【オーケストレーターからの追加指示】\n{next_input}"})
+        checkpoint.commit(PHASE_SESSION, instruction=state.next_session_instruction)
     
-    print("\n" + "=" * 50)
-    print(f"キャンペーン完了")
-    print(f"総セッション数: {session_num}")
-    print(f"総ターン数: {logger.total_turns}")
-    print(f"ログ保存先: {logger.filepath}")
-    print("=" * 50)
\ No newline at end of file
+    out("\n" + "=" * 50)
+    out(f"キャンペーン完了")
+    out(f"総セッション数: {state.session_num}")
+    out(f"総ターン数: {logger.total_turns}")
+    out(f"ログ保存先: {logger.filepath}")
+    out("=" * 50)
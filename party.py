@@ -0,0 +1,86 @@
+"""パーティ：複数のPL（それぞれ別のプロバイダー・モデル）で1つのキャンペーンを遊ぶ"""
+from agents import get_prompt
+from compaction import HistoryCompactor
+import config
+
+
+class PartyMember:
+    """パーティの1人のPL（プロバイダー・モデル・PC設定・履歴圧縮）
+
+    PLが1人のときは config.PL_PROVIDER / PL_MODEL を使い、見出しやプロンプトにPL名を付けない。
+    会話履歴は CampaignState.history(key) にある。
+    """
+
+    def __init__(self, name: str, provider: str, model: str, party_size: int = 1):
+        self.name = name
+        self.provider = provider
+        self.model = model
+        self.party_size = party_size
+        self.key = "pl" if party_size == 1 else f"pl:{name}"  # 履歴・チェックポイントのキー
+        self.persona = ""  # このPLが作成したPC設定
+        self.compactor = None  # 履歴圧縮（セッションごとに new_compactor() で作り直す）
+        self._prompts = {}
+
+    @property
+    def label(self) -> str | None:
+        """ログ・コンソールの見出しに付けるPL名（1人なら None）"""
+        return self.name if self.party_size > 1 else None
+
+    def new_compactor(self) -> HistoryCompactor:
+        """このPLのプロバイダー・モデルのコンテキストウィンドウに合わせて履歴を圧縮・要約する HistoryCompactor を作る"""
+        self.compactor = HistoryCompactor("pl", target=(self.provider, self.model, self.system_prompt("PL_SYSTEM_PROMPT")))
+        return self.compactor
+
+    def system_prompt(self, name: str) -> str:
+        """システムプロンプト（パーティではPL名と自分のPC設定を追記する）"""
+        if self.party_size == 1:
+            return get_prompt(name)
+        if name not in self._prompts:
+            note = f"""
+# パーティプレイ
+このゲームは{self.party_size}人のPLによるパーティプレイです。あなたはPL「{self.name}」です。
+- 宣言するのは自分のPCの行動だけです。他のPCの行動や台詞は決めないでください
+- GMの描写には他のPCの行動の結果も含まれます。仲間と協力しても、別行動をとってもかまいません
+"""
+            if name == "PL_SYSTEM_PROMPT" and self.persona:
+                note += f"\n# あなたのPC\n{self.persona}\n"
+            self._prompts[name] = get_prompt(name) + note
+        return self._prompts[name]
+
+
+def load_party() -> list:
+    """config.PARTY からPLの一覧を作る（空なら PL_PROVIDER / PL_MODEL の1人）"""
+    if not config.PARTY:
+        return [PartyMember("PL", config.PL_PROVIDER, config.PL_MODEL)]
+    names = [entry["name"] for entry in config.PARTY]
+    if len(set(names)) != len(names):
+        raise ValueError(f"PARTY のPL名が重複しています: {names}")
+    return [PartyMember(entry["name"], entry["provider"], entry["model"], len(config.PARTY)) for entry in config.PARTY]
+
+
+def _merge(members: list, texts: list, title: str) -> str:
+    """PLごとの応答を1つの入力にまとめる（1人ならそのまま）"""
+    if members[0].party_size == 1:
+        return texts[0]
+    return "\n\n".join(f"【{member.name}の{title}】\n{text}" for member, text in zip(members, texts))
+
+
+def merge_settings(members: list, personas: list) -> str:
+    """各PLのPC設定・初回セッション設定を、GMへの最初の指示用にまとめる"""
+    if len(members) == 1:
+        return personas[0]
+    return (
+        f"PLは{len(members)}人です。全員のPCが同じパーティとして参加するよう、各PLの初回セッション設定を1つにまとめてください。\n\n"
+        + _merge(members, personas, "設定")
+    )
+
+
+def merge_actions(members: list, actions: list) -> str:
+    """同じターンの全PLの行動宣言を、GMへの1つの入力にまとめる"""
+    return f"PLの行動：\n{_merge(members, actions, '行動')}"
+
+
+def merge_hooks(members: list, hooks: list) -> str:
+    """各PLの次回への希望をまとめる（失敗したPLの分は除く）"""
+    pairs = [(member, hook) for member, hook in zip(members, hooks) if hook is not None]
+    return _merge([member for member, _ in pairs], [hook for _, hook in pairs], "希望") if pairs else ""
@@ -0,0 +1,94 @@
+"""PL応答の検証：GM的な振る舞いを、ストリーミング受信中の断片から逐次検出する"""
+
+# PLが出力してはいけないGMの役割の表現
+GM_PATTERNS = [
+    "Turn:",
+    "HP:",
+    "SP:",
+    "Tension:",
+    "【状況】",
+    "【判定】",
+    "【裁定】",
+    "行動候補",
+    "あなたはどうしますか",
+    "選択してください",
+]
+
+
+class PatternAutomaton:
+    """複数の文字列パターンを1回の走査で検出するオートマトン（Aho-Corasick法）
+
+    走査の状態は呼び出し側が持つので、断片をまたいで出現するパターンも検出できる。
+    """
+
+    def __init__(self, patterns: list):
+        self._goto = [{}]
+        self._fail = [0]
+        self._match = [None]  # その状態で出現が確定するパターン
+        for pattern in patterns:
+            state = 0
+            for ch in pattern:
+                if ch not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._match.append(None)
+                    self._goto[state][ch] = len(self._goto) - 1
+                state = self._goto[state][ch]
+            if self._match[state] is None:
+                self._match[state] = pattern
+
+        # 失敗遷移を幅優先で設定（接尾辞として含まれるパターンも検出する）
+        queue = list(self._goto[0].values())
+        while queue:
+            state = queue.pop(0)
+            for ch, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(ch, 0)
+                if self._match[child] is None:
+                    self._match[child] = self._match[self._fail[child]]
+
+    def scan(self, text: str, state: int = 0) -> tuple[int, str | None]:
+        """text を走査し、(走査後の状態, 最初に出現したパターン) を返す（出現しなければ None）"""
+        goto, fail, match = self._goto, self._fail, self._match
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if match[state] is not None:
+                return state, match[state]
+        return state, None
+
+
+_GM_AUTOMATON = PatternAutomaton(GM_PATTERNS)
+
+
+def find_gm_pattern(text: str) -> str | None:
+    """text に最初に現れるGM的な表現（なければ None）"""
+    return _GM_AUTOMATON.scan(text)[1]
+
+
+class PLStreamValidator:
+    """ストリーミング中のPL応答を断片ごとに検証する
+
+    feed() がGM的な表現を検出した時点で、呼び出し側は生成を中断して再試行できる。
+    """
+
+    def __init__(self):
+        self._state = 0
+        self.received = []
+
+    @property
+    def text(self) -> str:
+        """これまでに受信した応答"""
+        return "".join(self.received)
+
+    def feed(self, chunk: str) -> str | None:
+        """断片を検証し、GM的な振る舞いを検出したら理由を返す"""
+        self.received.append(chunk)
+        self._state, pattern = _GM_AUTOMATON.scan(chunk, self._state)
+        if pattern is not None:
+            return f"GM的な振る舞いを検出: {pattern}"
+        return None
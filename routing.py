@@ -0,0 +1,137 @@
+"""モデルの振り分け：ターンごとの状況からGM/PLの呼び出しに使うモデルの段階を選ぶ
+
+判断材料は、直前のGMの状態表示（Tension・障害）、進行（セッションの最初の描写・最大ターン目前）、
+直近の異常応答とその再試行、オーケストレーターの指示の有無。
+config.MODEL_ROUTING_RULES を上から順に評価し、最初に条件をすべて満たしたルールの段階を使う。
+"""
+import config
+
+# GMへの入力にオーケストレーターの指示が含まれていることを示す見出し
+INSTRUCTION_MARKER = "【オーケストレーターからの指示】"
+
+STANDARD_TIER = "standard"  # 既定の段階（GM_PROVIDER / GM_MODEL、PLは各自のモデル）
+
+# 障害がないことを表す状態表示の値
+_NO_OBSTACLE = ("", "なし", "無し", "特になし", "-", "ー", "—", "ない")
+
+# 進行の段階 → 説明
+_PHASES = {"opening": "セッションの最初の描写", "finale": "最大ターン目前", "turn": "通常のターン"}
+
+# ルールの条件 → (判定, ログに残す振り分け理由)。どちらも (条件の値, 判断材料) を受け取る
+_CONDITIONS = {
+    "role": (lambda v, s: s["role"] == v, None),
+    "phase": (lambda v, s: s["phase"] in (v if isinstance(v, (list, tuple)) else (v,)),
+              lambda v, s: _PHASES.get(s["phase"], s["phase"])),
+    "min_tension": (lambda v, s: s["tension"] is not None and s["tension"] >= v,
+                    lambda v, s: f"Tension {s['tension']}（{v}以上）"),
+    "max_tension": (lambda v, s: s["tension"] is not None and s["tension"] <= v,
+                    lambda v, s: f"Tension {s['tension']}（{v}以下）"),
+    "obstacle": (lambda v, s: s["obstacle"] == v, lambda v, s: "障害あり" if v else "障害なし"),
+    "instruction": (lambda v, s: s["instruction"] == v, lambda v, s: "オーケストレーターの指示あり" if v else "指示なし"),
+    "retry": (lambda v, s: s["retry"] == v, lambda v, s: "異常応答の再試行" if v else "初回の応答"),
+    "min_anomalies": (lambda v, s: s["anomalies"] >= v, lambda v, s: f"直近の異常応答 {s['anomalies']}回（{v}回以上）"),
+}
+
+
+class Route:
+    """1回の呼び出しの振り分け結果"""
+
+    __slots__ = ("tier", "provider", "model", "reason", "default")
+
+    def __init__(self, tier: str, provider: str, model: str, reason: str, default: tuple[str, str]):
+        self.tier = tier
+        self.provider = provider
+        self.model = model
+        self.reason = reason
+        self.default = default  # 振り分けなしで使うはずだった (プロバイダー, モデル)（コスト比較用）
+
+    @property
+    def target(self) -> tuple[str, str]:
+        return self.provider, self.model
+
+    def describe(self) -> str:
+        return f"{self.tier}（{self.provider} / {self.model}、{self.reason}）"
+
+    def to_dict(self) -> dict:
+        return {"tier": self.tier, "reason": self.reason, "default_provider": self.default[0],
+                "default_model": self.default[1]}
+
+
+def has_obstacle(obstacle: str) -> bool:
+    """状態表示の「障害」に何か書かれているか"""
+    return obstacle.strip().strip("。") not in _NO_OBSTACLE
+
+
+def _matches(rule: dict, signals: dict) -> bool:
+    for key, value in rule.items():
+        if key == "tier":
+            continue
+        if key not in _CONDITIONS:
+            raise ValueError(f"MODEL_ROUTING_RULES の条件が不正です: {key}")
+        if not _CONDITIONS[key][0](value, signals):
+            return False
+    return True
+
+
+def _reason(rule: dict, signals: dict) -> str:
+    reasons = [_CONDITIONS[key][1](value, signals) for key, value in rule.items() if key != "tier" and _CONDITIONS[key][1]]
+    return "、".join(reasons) or "他のルールに該当しない"
+
+
+def choose(signals: dict, default: tuple[str, str]) -> Route:
+    """判断材料からモデルを選ぶ
+
+    signals: role（"gm" / "pl"）, phase（"opening" / "turn" / "finale"）, tension（不明なら None）,
+             obstacle, instruction, retry, anomalies
+    default: 振り分けなしで使う (プロバイダー, モデル)
+    """
+    tier, reason = STANDARD_TIER, "既定"
+    for rule in config.MODEL_ROUTING_RULES:
+        if _matches(rule, signals):
+            tier, reason = rule["tier"], _reason(rule, signals)
+            break
+    target = config.MODEL_TIERS.get(signals["role"], {}).get(tier)
+    if target is None:
+        tier, target = STANDARD_TIER, default  # その役割に段階のモデルがなければ既定のモデル
+    provider, model = target
+    return Route(tier, provider, model, reason, default)
+
+
+class ModelRouter:
+    """キャンペーンの進行状態・ゲーム状態・計測値から、GM/PLの呼び出しごとにモデルを選ぶ"""
+
+    def __init__(self, state, logger):
+        self.state = state  # CampaignState
+        self.logger = logger  # CampaignLogger（game_state と metrics を参照）
+
+    def signals(self, role: str, history: list, retry: bool = False) -> dict:
+        state = self.state
+        game_state = self.logger.game_state.state
+        if state.turn == 0:
+            phase = "opening"
+        elif state.turn > config.MAX_TURNS - config.ROUTING_FINALE_TURNS:
+            phase = "finale"
+        else:
+            phase = "turn"
+        first_turn = state.turn - config.ROUTING_ANOMALY_TURNS
+        anomalies = sum(
+            1 for anomaly in self.logger.metrics.anomalies
+            if anomaly["session"] == state.session_num and anomaly["turn"] > first_turn
+        )
+        last = history[-1]["content"] if history else ""
+        return {
+            "role": role,
+            "phase": phase,
+            "tension": game_state.tension,
+            "obstacle": has_obstacle(game_state.obstacle),
+            "instruction": role == "gm" and INSTRUCTION_MARKER in last,
+            "retry": retry,
+            "anomalies": anomalies,
+        }
+
+    def route(self, role: str, history: list, default: tuple[str, str], stats=None, retry: bool = False) -> Route:
+        """モデルを選び、stats があれば振り分け結果を記録する（ログ・計測に残る）"""
+        route = choose(self.signals(role, history, retry), default)
+        if stats is not None:
+            stats.route = route
+        return route
@@ -0,0 +1,198 @@
+"""リクエストスケジューラー：全プロバイダー呼び出しのレート制限・再試行・サーキットブレーカー"""
+import time
+import random
+import asyncio
+from tokens import input_tokens
+import config
+
+# 再試行する HTTP ステータス（レート制限・タイムアウト・サーバーエラー）
+RETRYABLE_STATUS = {408, 409, 429}
+# ステータスを持たない接続系の例外（SDKごとの例外クラスを import せずに名前で判定する）
+RETRYABLE_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout", "RemoteProtocolError"}
+
+
+class TokenBucket:
+    """1分あたりの上限を、連続的に補充されるバケツで表す"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """amount を取り出せるまでの秒数（0なら即時）"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ProviderState:
+    """プロバイダーごとのレート制限・サーキットブレーカーの状態と計測値"""
+
+    def __init__(self, provider: str):
+        limits = config.RATE_LIMITS.get(provider) or {}
+        self.rpm = TokenBucket(limits["rpm"]) if limits.get("rpm") else None
+        self.tpm = TokenBucket(limits["tpm"]) if limits.get("tpm") else None
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        # 計測値
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.circuit_opens = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def wait_time(self, tokens: int) -> float:
+        """次のリクエストを送れるまでの秒数"""
+        waits = [self.open_until - time.monotonic()]
+        if self.rpm:
+            waits.append(self.rpm.wait_time(1))
+        if self.tpm:
+            waits.append(self.tpm.wait_time(tokens))
+        return max(0.0, *waits)
+
+    def consume(self, tokens: int):
+        if self.rpm:
+            self.rpm.consume(1)
+        if self.tpm:
+            self.tpm.consume(tokens)
+
+    def record_success(self):
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= config.CIRCUIT_FAILURE_THRESHOLD:
+            # 連続して失敗しているプロバイダーには、しばらくリクエストを送らない
+            self.open_until = time.monotonic() + config.CIRCUIT_COOLDOWN
+            self.consecutive_failures = 0
+            self.circuit_opens += 1
+
+
+def retry_info(error: Exception) -> tuple[bool, float | None]:
+    """(再試行すべきか, retry-after の秒数) を返す"""
+    status = getattr(error, "status_code", None)
+    if not isinstance(status, int):
+        status = getattr(error, "code", None)
+    if isinstance(status, int):
+        retryable = status in RETRYABLE_STATUS or status >= 500
+    else:
+        retryable = type(error).__name__ in RETRYABLE_ERROR_NAMES or isinstance(error, (ConnectionError, TimeoutError))
+
+    retry_after = None
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers:
+        try:
+            if headers.get("retry-after-ms"):
+                retry_after = float(headers["retry-after-ms"]) / 1000
+            elif headers.get("retry-after"):
+                retry_after = float(headers["retry-after"])
+        except (TypeError, ValueError):
+            pass  # 日付形式の retry-after はバックオフに任せる
+    return retryable, retry_after
+
+
+def backoff_delay(attempt: int, retry_after: float | None = None) -> float:
+    """ジッター付き指数バックオフ（retry-after があればそれ以上待つ）"""
+    delay = min(config.RETRY_BACKOFF_MAX, config.RETRY_BACKOFF_BASE * 2 ** attempt)
+    delay *= random.uniform(0.5, 1.0)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class Scheduler:
+    """全プロバイダー呼び出しの窓口"""
+
+    def __init__(self):
+        self._states = {}
+
+    def state(self, provider: str) -> ProviderState:
+        if provider not in self._states:
+            self._states[provider] = ProviderState(provider)
+        return self._states[provider]
+
+    async def call(self, provider: str, system_prompt: str, messages: list, max_tokens: int, attempt, stats=None,
+                   can_retry=None):
+        """attempt()（1回分の呼び出し）をレート制限・再試行付きで実行する
+
+        can_retry: 失敗時に呼ばれ、Falseなら再試行しない（ストリーミングで出力済みの場合など）
+        """
+        state = self.state(provider)
+        reserved = input_tokens(provider, system_prompt, messages) + max_tokens
+        retries = 0
+        queue_wait = 0.0
+        try:
+            while True:
+                # レート制限・サーキットブレーカーの待ち
+                while True:
+                    wait = state.wait_time(reserved)
+                    if wait <= 0:
+                        break
+                    queue_wait += wait
+                    await asyncio.sleep(wait)
+                state.consume(reserved)
+                state.requests += 1
+
+                try:
+                    result = await attempt()
+                except Exception as e:
+                    retryable, retry_after = retry_info(e)
+                    if retryable:
+                        state.record_failure()
+                    if not retryable or retries >= config.MAX_RETRIES or (can_retry and not can_retry()):
+                        raise
+                    delay = backoff_delay(retries, retry_after)
+                    retries += 1
+                    state.retries += 1
+                    queue_wait += delay
+                    await asyncio.sleep(delay)
+                    continue
+
+                state.record_success()
+                if state.tpm and stats is not None and stats.input_tokens:
+                    # 見積もりより少なかった分をバケツに戻す
+                    state.tpm.refund(max(0, reserved - stats.input_tokens - stats.output_tokens))
+                return result
+        finally:
+            state.queue_wait_total += queue_wait
+            state.queue_wait_max = max(state.queue_wait_max, queue_wait)
+            if stats is not None:
+                stats.queue_wait = queue_wait
+                stats.retries = retries
+
+    def metrics(self) -> dict:
+        """プロバイダーごとのリクエスト数・再試行数・待ち時間"""
+        return {
+            provider: {
+                "requests": s.requests,
+                "retries": s.retries,
+                "failures": s.failures,
+                "circuit_opens": s.circuit_opens,
+                "queue_wait_total": round(s.queue_wait_total, 3),
+                "queue_wait_max": round(s.queue_wait_max, 3),
+            }
+            for provider, s in self._states.items()
+        }
+
+
+_scheduler = Scheduler()
+
+
+def get_scheduler() -> Scheduler:
+    """プロセス共通のスケジューラーを取得"""
+    return _scheduler
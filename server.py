@@ -0,0 +1,304 @@
+"""HTTPサーバー：複数のキャンペーンを1プロセスで並行実行し、GM/PLの出力をServer-Sent Eventsで配信する
+
+    python server.py --port 8000
+
+エンドポイント:
+    GET    /campaigns                キャンペーンの一覧
+    POST   /campaigns                キャンペーン開始（{"scenario": パス} / 再開は {"resume": チェックポイントのパス}）
+    GET    /campaigns/{id}           状態（入力待ちなら prompt に選択肢）
+    POST   /campaigns/{id}/input     入力待ちへの回答（{"text": ""} で続行、"q" で終了、それ以外はGMへの指示）
+    GET    /campaigns/{id}/events    出力の購読（SSE。Last-Event-ID で続きから受け取れる）
+    DELETE /campaigns/{id}           キャンペーンを中断（チェックポイントから再開できる）
+
+キャンペーンは asyncio のタスクとして動き、スレッドはキャンペーン数によらない（ログ書き込みスレッドは共通の1本）。
+出力イベントはキャンペーンごとに最新 SERVER_EVENT_BUFFER 件だけを保持し、購読者はその中から自分の続きを読む。
+"""
+import json
+import asyncio
+import argparse
+import itertools
+import traceback
+from collections import deque
+from orchestrator import ConsoleDecider, new_campaign, load_campaign, play_campaign
+import config
+
+MAX_BODY_BYTES = 64 * 1024  # リクエスト本文の上限
+
+STATUS_TEXT = {
+    200: "OK", 201: "Created", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class RemoteDecider(ConsoleDecider):
+    """人間の判断をHTTPで受け取る（選択肢は ConsoleDecider と同じ）"""
+
+    def __init__(self, campaign: "LiveCampaign"):
+        self.campaign = campaign
+
+    async def _ask(self, prompt: str) -> str:
+        return await self.campaign.ask(prompt.strip())
+
+
+class LiveCampaign:
+    """サーバーで実行中のキャンペーン（出力イベントのリングバッファと入力待ち）"""
+
+    def __init__(self, campaign_id: str, buffer_size: int):
+        self.id = campaign_id
+        self.status = "running"  # running / waiting / finished / failed / cancelled
+        self.log_path = None
+        self.error = None
+        self.prompt = None  # 入力待ちの選択肢
+        self.task = None
+        self._answer = None
+        self._events = deque(maxlen=buffer_size)  # (イベントID, イベント名, データ)
+        self._next_id = 1
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("finished", "failed", "cancelled")
+
+    def info(self) -> dict:
+        return {"id": self.id, "status": self.status, "log": self.log_path, "prompt": self.prompt, "error": self.error}
+
+    def publish(self, event: str, data: dict):
+        self._events.append((self._next_id, event, data))
+        self._next_id += 1
+        # 待っている購読者を起こす（次の待ち合わせ用に作り直す）
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def out(self, *args, sep: str = " ", end: str = "\n", flush: bool = False):
+        """print の代わりに出力をイベントとして流す"""
+        self.publish("output", {"text": sep.join(str(arg) for arg in args) + end})
+
+    async def ask(self, prompt: str) -> str:
+        """入力待ちを知らせて、POST /input の回答を待つ"""
+        self._answer = asyncio.get_running_loop().create_future()
+        self.prompt = prompt
+        self.status = "waiting"
+        self.publish("prompt", {"prompt": prompt})
+        try:
+            return await self._answer
+        finally:
+            self._answer = None
+            self.prompt = None
+            if self.status == "waiting":
+                self.status = "running"
+
+    def answer(self, text: str):
+        if self._answer is None or self._answer.done():
+            raise HTTPError(409, "入力待ちではありません")
+        self._answer.set_result(text)
+
+    @property
+    def last_event_id(self) -> int:
+        return self._next_id - 1
+
+    def events_after(self, last_id: int) -> tuple[list, bool]:
+        """last_id より後のイベントと、バッファから溢れて取りこぼした分があるか"""
+        if not self._events:
+            return [], False
+        first_id = self._events[0][0]
+        start = max(0, last_id + 1 - first_id)
+        return list(itertools.islice(self._events, start, None)), last_id + 1 < first_id
+
+    async def wait_changed(self, timeout: float) -> bool:
+        """新しいイベントを待つ（timeout 秒で打ち切り）"""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def run(self, logger, state, checkpoint):
+        try:
+            await play_campaign(logger, state, checkpoint, RemoteDecider(self), out=self.out)
+            self.status = "finished"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+        except Exception as e:
+            # 1キャンペーンの失敗でサーバーを止めない
+            self.status = "failed"
+            self.error = repr(e)
+            traceback.print_exc()
+        self.publish("end", self.info())
+
+
+class CampaignServer:
+    """キャンペーンの開始・入力・購読を受け付けるHTTPサーバー（1接続1リクエスト）"""
+
+    def __init__(self, max_campaigns: int | None = None, event_buffer: int | None = None):
+        self.max_campaigns = max_campaigns or config.SERVER_MAX_CAMPAIGNS
+        self.event_buffer = event_buffer or config.SERVER_EVENT_BUFFER
+        self.campaigns = {}  # ID → LiveCampaign（開始順）
+        self._ids = itertools.count(1)
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self._handle, host, port)
+        print(f"🌐 http://{host}:{port}/campaigns")
+        async with server:
+            await server.serve_forever()
+
+    # --- キャンペーン操作 ---
+
+    def start(self, body: dict) -> LiveCampaign:
+        self._make_room()
+        if body.get("resume"):
+            prepare, path = load_campaign, body["resume"]
+        elif body.get("scenario"):
+            prepare, path = new_campaign, body["scenario"]
+        else:
+            raise HTTPError(400, "scenario か resume を指定してください")
+        try:
+            logger, state, checkpoint = prepare(path, echo=False)
+        except (OSError, ValueError) as e:
+            raise HTTPError(400, str(e))
+        campaign = LiveCampaign(str(next(self._ids)), self.event_buffer)
+        campaign.log_path = logger.filepath
+        self.campaigns[campaign.id] = campaign
+        campaign.task = asyncio.create_task(campaign.run(logger, state, checkpoint))
+        return campaign
+
+    def _make_room(self):
+        """上限に達していれば終了済みの古いキャンペーンを破棄する"""
+        while len(self.campaigns) >= self.max_campaigns:
+            oldest = next((c for c in self.campaigns.values() if c.done), None)
+            if oldest is None:
+                raise HTTPError(503, f"実行中のキャンペーンが上限（{self.max_campaigns}件）に達しています")
+            del self.campaigns[oldest.id]
+
+    def get(self, campaign_id: str) -> LiveCampaign:
+        if campaign_id not in self.campaigns:
+            raise HTTPError(404, f"キャンペーンがありません: {campaign_id}")
+        return self.campaigns[campaign_id]
+
+    # --- HTTP ---
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                method, path, headers, body = await self._read_request(reader)
+                await self._route(method, path, headers, body, writer)
+            except HTTPError as e:
+                await self._respond(writer, e.status, {"error": str(e)})
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            except Exception as e:
+                traceback.print_exc()
+                await self._respond(writer, 500, {"error": repr(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> tuple[str, str, dict, dict]:
+        request_line = await reader.readline()
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "不正なリクエストです")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = headers.get("content-length") or "0"
+        if not length.isdigit():
+            raise HTTPError(400, "Content-Length が不正です")
+        length = int(length)
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, "リクエスト本文が大きすぎます")
+        body = {}
+        if length:
+            try:
+                body = json.loads(await reader.readexactly(length))
+            except ValueError:
+                raise HTTPError(400, "本文はJSONで指定してください")
+            if not isinstance(body, dict):
+                raise HTTPError(400, "本文はJSONオブジェクトで指定してください")
+        return method.upper(), target.split("?", 1)[0].rstrip("/"), headers, body
+
+    async def _route(self, method: str, path: str, headers: dict, body: dict, writer: asyncio.StreamWriter):
+        parts = path.strip("/").split("/")
+        if parts[0] != "campaigns" or len(parts) > 3:
+            raise HTTPError(404, f"パスがありません: {path}")
+        if len(parts) == 1:
+            if method == "GET":
+                return await self._respond(writer, 200, [c.info() for c in self.campaigns.values()])
+            if method == "POST":
+                return await self._respond(writer, 201, self.start(body).info())
+        elif len(parts) == 2:
+            campaign = self.get(parts[1])
+            if method == "GET":
+                return await self._respond(writer, 200, campaign.info())
+            if method == "DELETE":
+                if not campaign.done:
+                    campaign.task.cancel()
+                    await asyncio.wait([campaign.task])
+                return await self._respond(writer, 200, campaign.info())
+        elif parts[2] == "input" and method == "POST":
+            self.get(parts[1]).answer(str(body.get("text", "")))
+            return await self._respond(writer, 202, {"accepted": True})
+        elif parts[2] == "events" and method == "GET":
+            last_id = headers.get("last-event-id") or "0"
+            if not last_id.isdigit():
+                raise HTTPError(400, "Last-Event-ID が不正です")
+            return await self._stream(writer, self.get(parts[1]), int(last_id))
+        raise HTTPError(405, f"{method} {path} は使えません")
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, data):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + payload
+        )
+        await writer.drain()
+
+    async def _stream(self, writer: asyncio.StreamWriter, campaign: LiveCampaign, last_id: int):
+        """出力をSSEで送る（遅い購読者の分はためず、バッファから溢れた分は skipped イベントで知らせる）"""
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream; charset=utf-8\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        await writer.drain()
+        while True:
+            events, skipped = campaign.events_after(last_id)
+            if skipped:
+                writer.write(f"event: skipped\ndata: {json.dumps({'after': last_id})}\n\n".encode("utf-8"))
+            for event_id, event, data in events:
+                writer.write(f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+                last_id = event_id
+            await writer.drain()
+            if campaign.last_event_id > last_id:
+                continue  # 送っている間に増えた分
+            if campaign.done:
+                return
+            if not await campaign.wait_changed(config.SERVER_KEEPALIVE):
+                # 切断を検出するためのコメント行
+                writer.write(b": keepalive\n\n")
+                await writer.drain()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="複数キャンペーンをHTTPで操作・SSEで観戦するサーバー")
+    parser.add_argument("--host", default=config.SERVER_HOST, help="待ち受けるアドレス")
+    parser.add_argument("--port", type=int, default=config.SERVER_PORT, help="待ち受けるポート")
+    args = parser.parse_args()
+    try:
+        asyncio.run(CampaignServer().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,124 @@
+"""トークン数の概算：APIを呼ばずに、プロバイダーごとの文字あたりのトークン数で見積もる
+
+会話履歴は会話（先頭メッセージのオブジェクト）ごとにメッセージ単位の累計を覚えておき、前回から増えたメッセージの分だけ数える（message_buffer と同じ方式）。
+毎回同じものを送るシステムプロンプト（ルールブック入り）の見積もりは本文ごとに覚えておく。
+"""
+import functools
+from collections import OrderedDict
+import config
+
+# プロバイダー → (ASCII文字あたり, それ以外の文字あたり, メッセージ1件あたり) のトークン数（参考値）
+# プロバイダー未指定は日本語1文字≒1トークン、ASCII 4文字≒1トークン。モックは1文字＝1トークン（mock_provider.estimate_usage と同じ）
+DEFAULT_RATES = (0.25, 1.0, 0)
+TOKEN_RATES = {
+    "anthropic": (0.3, 1.0, 4),
+    "openai": (0.25, 0.8, 4),
+    "google": (0.25, 0.7, 4),
+    "mock": (1.0, 1.0, 0),
+}
+
+PROMPT_CACHE_SIZE = 64  # 見積もりを覚えておくシステムプロンプトの数
+MAX_HISTORIES = 16  # 累計を覚えておく会話の数（古いものから捨てる。捨てた会話は次の呼び出しで数え直す）
+
+
+class ContextLimitError(ValueError):
+    """入力がモデルのコンテキストウィンドウに収まらない（送信前に検出）"""
+
+
+def estimate_tokens(text: str, provider: str | None = None) -> int:
+    """トークン数の概算"""
+    ascii_rate, other_rate, _ = TOKEN_RATES.get(provider, DEFAULT_RATES)
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return int((len(text) - ascii_chars) * other_rate + ascii_chars * ascii_rate)
+
+
+@functools.lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def prompt_tokens(system_prompt: str, provider: str | None = None) -> int:
+    """システムプロンプトの推定トークン数"""
+    return estimate_tokens(system_prompt, provider)
+
+
+def message_tokens(message: dict, provider: str | None = None) -> int:
+    """メッセージ1件の推定トークン数（役割・区切りの分を含む）"""
+    return estimate_tokens(message["content"], provider) + TOKEN_RATES.get(provider, DEFAULT_RATES)[2]
+
+
+class HistoryTokens:
+    """1つの会話の推定トークン数（末尾への追加と、履歴圧縮による先頭の置き換えに追従する）"""
+
+    def __init__(self, provider: str | None = None):
+        self.provider = provider
+        self._sources = []  # 数えたメッセージ（同一性の確認用）
+        self._totals = [0]  # 先頭から i 件の累計
+
+    def count(self, messages: list) -> int:
+        sources = self._sources
+        n = min(len(messages), len(sources))
+        if n and messages[0] is not sources[0]:
+            n = 0
+        while n and messages[n - 1] is not sources[n - 1]:
+            n -= 1
+        del sources[n:]
+        del self._totals[n + 1:]
+        total = self._totals[-1]
+        for message in messages[n:]:
+            total += message_tokens(message, self.provider)
+            sources.append(message)
+            self._totals.append(total)
+        return total
+
+
+_histories = OrderedDict()
+
+
+def history_tokens(messages: list, provider: str | None = None) -> int:
+    """会話履歴の推定トークン数（会話ごとに、前回から増えたメッセージの分だけ数える）"""
+    if not messages:
+        return 0
+    # 累計が先頭メッセージを保持しているので、生きている間は id が他のオブジェクトに使い回されない
+    key = (provider, id(messages[0]))
+    history = _histories.get(key)
+    if history is None:
+        history = _histories[key] = HistoryTokens(provider)
+        if len(_histories) > MAX_HISTORIES:
+            _histories.popitem(last=False)
+    else:
+        _histories.move_to_end(key)
+    return history.count(messages)
+
+
+def input_tokens(provider: str, system_prompt: str, messages: list) -> int:
+    """1回の呼び出しの入力の推定トークン数"""
+    return prompt_tokens(system_prompt, provider) + history_tokens(messages, provider)
+
+
+def context_window(provider: str, model: str) -> int | None:
+    """モデルのコンテキストウィンドウ（モックは MOCK_CONTEXT_WINDOW。0なら None で無制限）"""
+    if provider == "mock":
+        return config.MOCK_CONTEXT_WINDOW or None
+    return config.MODEL_CONTEXT_WINDOWS.get(model, config.DEFAULT_CONTEXT_WINDOW)
+
+
+def input_limit(provider: str, model: str, max_tokens: int) -> int | None:
+    """出力に max_tokens を残したうえで入力に使えるトークン数（推定の誤差の分 CONTEXT_SAFETY_MARGIN を空ける）"""
+    window = context_window(provider, model)
+    if window is None:
+        return None
+    return int(window * (1 - config.CONTEXT_SAFETY_MARGIN)) - max_tokens
+
+
+def fit_max_tokens(provider: str, model: str, system_prompt: str, messages: list, max_tokens: int) -> int:
+    """入力の推定トークン数に合わせて、コンテキストウィンドウに収まるよう max_tokens を縮める
+
+    出力に MIN_OUTPUT_TOKENS（max_tokens の方が小さければ max_tokens）も残せないときは、送信せずに ContextLimitError を送出する。
+    """
+    limit = input_limit(provider, model, 0)
+    if limit is None:
+        return max_tokens
+    used = input_tokens(provider, system_prompt, messages)
+    available = limit - used
+    if available < min(max_tokens, config.MIN_OUTPUT_TOKENS):
+        raise ContextLimitError(
+            f"入力（推定 {used} tokens）が {provider}/{model} のコンテキストウィンドウ（{context_window(provider, model)} tokens）に収まりません"
+        )
+    return min(max_tokens, available)
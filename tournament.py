@@ -0,0 +1,356 @@
+"""ペアリング・トーナメント：GM×PLのモデルの組み合わせごとにヘッドレスのキャンペーンを実行し、順位表を作る
+
+    python tournament.py scenarios/template_fantasy.md                  # TOURNAMENT_GM_MODELS × TOURNAMENT_PL_MODELS
+    python tournament.py scenarios/template_fantasy.md --gm anthropic/claude-sonnet-4-20250514 \\
+        --pl openai/gpt-4o-mini --pl google/gemini-2.5-flash --budget 5
+
+各キャンペーンはイベントログから採点する（GM/PLのセッション振り返りの★評価・PLの応答のうち異常応答の割合・GM判断でセッションを終えられたか）。
+successive halving で実行数を割り当てる：各回、残っている組み合わせで同じ数のキャンペーンを実行し、
+スコアの信頼区間の上限が首位の下限を下回った組み合わせと、上位 1 / TOURNAMENT_ETA に入らなかった組み合わせを落とし、
+次の回は実行数を TOURNAMENT_ETA 倍にする。1組に絞れるか、予算（推定コスト）・回数の上限に達したら終える。
+GM/PLのモデルは config を書き換えて切り替えるので、組み合わせは1組ずつ順に実行する（同じ組み合わせのキャンペーンは並行して実行する）。
+"""
+import re
+import json
+import math
+import time
+import asyncio
+import argparse
+import contextlib
+import statistics
+from datetime import datetime
+from batch import run_batch
+from log_index import format_table
+import config
+
+# 振り返りの「評価: ★★★☆☆」
+_RATING = re.compile(r"評価\s*[:：]\s*([★☆]+)")
+
+
+def parse_rating(text: str) -> int | None:
+    """振り返りの★の数（1〜5。見つからなければ None）"""
+    match = _RATING.search(text)
+    if match is None:
+        return None
+    stars = match.group(1).count("★")
+    return stars if 1 <= stars <= 5 else None
+
+
+class CampaignScore:
+    """1キャンペーンの採点結果"""
+
+    def __init__(self, log_path: str):
+        self.log_path = log_path
+        self.gm_ratings = []  # GMの振り返りの★（PLへの評価）
+        self.pl_ratings = []  # PLの振り返りの★（GMへの評価）
+        self.pl_responses = 0  # PLの行動宣言の応答数（再試行を含む）
+        self.anomalies = 0  # PLの異常応答の数
+        self.sessions = 0
+        self.completed_sessions = 0  # GM判断（【セッション終了】）で終えたセッション数
+        self.session_turns = []
+        self.cost = 0.0
+
+    @property
+    def gm_rating(self) -> float | None:
+        return statistics.mean(self.gm_ratings) if self.gm_ratings else None
+
+    @property
+    def pl_rating(self) -> float | None:
+        return statistics.mean(self.pl_ratings) if self.pl_ratings else None
+
+    @property
+    def anomaly_rate(self) -> float | None:
+        return self.anomalies / self.pl_responses if self.pl_responses else None
+
+    @property
+    def completion_rate(self) -> float | None:
+        return self.completed_sessions / self.sessions if self.sessions else None
+
+    def score(self) -> float | None:
+        """0〜1のスコア（TOURNAMENT_WEIGHTS で重み付け。値のない項目は除いて重みを配り直す）"""
+        ratings = [r for r in (self.gm_rating, self.pl_rating) if r is not None]
+        parts = {
+            "rating": (statistics.mean(ratings) - 1) / 4 if ratings else None,
+            "anomaly": 1 - self.anomaly_rate if self.anomaly_rate is not None else None,
+            "completion": self.completion_rate,
+        }
+        weights = {key: weight for key, weight in config.TOURNAMENT_WEIGHTS.items() if parts.get(key) is not None}
+        total = sum(weights.values())
+        if not total:
+            return None
+        return sum(parts[key] * weight for key, weight in weights.items()) / total
+
+
+def score_campaign(log_path: str) -> CampaignScore:
+    """キャンペーンのイベントログ（campaign_*.jsonl）から採点する"""
+    result = CampaignScore(log_path)
+    with open(log_path.removesuffix(".md") + ".jsonl", encoding="utf-8") as f:
+        for line in f:
+            event = json.loads(line)
+            kind = event["event"]
+            if kind == "response":
+                if event["kind"] == "pl":
+                    result.pl_responses += 1
+                elif event["kind"] in ("gm_feedback", "pl_feedback"):
+                    rating = parse_rating(event["text"])
+                    if rating is not None:
+                        getattr(result, event["kind"].removesuffix("feedback") + "ratings").append(rating)
+            elif kind == "anomaly" and event["role"] == "PL":
+                result.anomalies += 1
+            elif kind == "session_end":
+                result.sessions += 1
+                result.session_turns.append(event["session_turns"])
+                if event["reason"] == "GM判断":
+                    result.completed_sessions += 1
+            elif kind == "metrics_summary":
+                result.cost += event["totals"]["cost_usd"]
+    return result
+
+
+def confidence_interval(values: list, confidence: float) -> tuple[float, float]:
+    """平均の信頼区間（正規近似。2件未満なら (-inf, inf)）"""
+    if len(values) < 2:
+        return -math.inf, math.inf
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    mean = statistics.mean(values)
+    half = z * statistics.stdev(values) / math.sqrt(len(values))
+    return mean - half, mean + half
+
+
+class Pairing:
+    """GM×PLのモデルの組み合わせと、その採点結果"""
+
+    def __init__(self, gm: tuple[str, str], pl: tuple[str, str]):
+        self.gm = gm
+        self.pl = pl
+        self.results = []  # CampaignScore
+        self.failed = 0
+        self.eliminated = None  # 落ちた回（残っていれば None）
+        self.reason = ""
+
+    @property
+    def name(self) -> str:
+        return f"{'/'.join(self.gm)} × {'/'.join(self.pl)}"
+
+    @property
+    def scores(self) -> list:
+        return [s for s in (result.score() for result in self.results) if s is not None]
+
+    @property
+    def mean(self) -> float | None:
+        return statistics.mean(self.scores) if self.scores else None
+
+    def interval(self) -> tuple[float, float]:
+        return confidence_interval(self.scores, config.TOURNAMENT_CONFIDENCE)
+
+    @property
+    def cost(self) -> float:
+        return sum(result.cost for result in self.results)
+
+    def _mean_of(self, values: list) -> float | None:
+        values = [v for v in values if v is not None]
+        return statistics.mean(values) if values else None
+
+    def to_dict(self) -> dict:
+        low, high = self.interval()
+        return {
+            "gm": list(self.gm),
+            "pl": list(self.pl),
+            "campaigns": len(self.results),
+            "failed": self.failed,
+            "score": self.mean,
+            "ci": [low, high] if math.isfinite(low) else None,
+            "gm_rating": self._mean_of([r.gm_rating for r in self.results]),
+            "pl_rating": self._mean_of([r.pl_rating for r in self.results]),
+            "anomaly_rate": self._mean_of([r.anomaly_rate for r in self.results]),
+            "completion_rate": self._mean_of([r.completion_rate for r in self.results]),
+            "turns_per_session": self._mean_of([t for r in self.results for t in r.session_turns]),
+            "cost_usd": round(self.cost, 6),
+            "eliminated_round": self.eliminated,
+            "reason": self.reason,
+            "logs": [r.log_path for r in self.results],
+        }
+
+
+def select(active: list, round_num: int) -> list:
+    """この回で残す組み合わせを選び、落とした組み合わせに回と理由を記録する"""
+    for pairing in active:
+        if pairing.mean is None:
+            pairing.eliminated, pairing.reason = round_num, "採点できたキャンペーンがない"
+    ranked = sorted((p for p in active if p.mean is not None), key=lambda p: p.mean, reverse=True)
+    if not ranked:
+        return []
+    best_low = ranked[0].interval()[0]
+    keep = max(1, math.ceil(len(active) / config.TOURNAMENT_ETA))
+    survivors = []
+    for pairing in ranked:
+        if pairing is not ranked[0] and pairing.interval()[1] < best_low:
+            pairing.eliminated, pairing.reason = round_num, "信頼区間の上限が首位の下限を下回った"
+        elif len(survivors) >= keep:
+            pairing.eliminated, pairing.reason = round_num, f"上位 {keep} 組に入らなかった"
+        else:
+            survivors.append(pairing)
+    return survivors
+
+
+@contextlib.contextmanager
+def _use_pairing(pairing: Pairing):
+    """組み合わせのモデルで config を一時的に書き換える
+
+    振り返りは採点に使うので必ずその場で生成し、モデルの振り分けは使わない（組み合わせのモデルだけで比べる）。
+    """
+    names = ("GM_PROVIDER", "GM_MODEL", "PL_PROVIDER", "PL_MODEL", "PARTY", "ENABLE_SESSION_FEEDBACK",
+             "ENABLE_DEFERRED_CALLS", "ENABLE_MODEL_ROUTING")
+    saved = {name: getattr(config, name) for name in names}
+    config.GM_PROVIDER, config.GM_MODEL = pairing.gm
+    config.PL_PROVIDER, config.PL_MODEL = pairing.pl
+    config.PARTY = []
+    config.ENABLE_SESSION_FEEDBACK = True
+    config.ENABLE_DEFERRED_CALLS = False
+    config.ENABLE_MODEL_ROUTING = False
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+
+
+class TournamentReport:
+    """トーナメントの結果"""
+
+    def __init__(self, pairings: list):
+        self.pairings = pairings
+        self.rounds = 0
+        self.campaigns = 0  # 実行したキャンペーン数（失敗を含む）
+        self.completed = 0  # 完了したキャンペーン数（推定コストを集計できた分）
+        self.spend = 0.0
+        self.stop_reason = ""
+        self.elapsed = 0.0
+
+    def ranking(self) -> list:
+        """残った組み合わせ → 後の回で落ちた組み合わせの順に、それぞれスコアの高い順"""
+        return sorted(self.pairings, key=lambda p: (p.eliminated is None, p.eliminated or 0,
+                                                    p.mean if p.mean is not None else -1), reverse=True)
+
+    def leaderboard(self) -> str:
+        rows = []
+        for rank, pairing in enumerate(self.ranking(), 1):
+            d = pairing.to_dict()
+            rows.append([
+                rank, pairing.name, d["campaigns"],
+                f"{d['score']:.3f}" if d["score"] is not None else "-",
+                f"[{d['ci'][0]:.3f}, {d['ci'][1]:.3f}]" if d["ci"] else "-",
+                _fmt(d["gm_rating"], ".2f"), _fmt(d["pl_rating"], ".2f"), _fmt(d["anomaly_rate"], ".1%"),
+                _fmt(d["completion_rate"], ".0%"), _fmt(d["turns_per_session"], ".1f"), f"${d['cost_usd']:.4f}",
+                f"{pairing.eliminated}回目で脱落" if pairing.eliminated else "残り" if pairing.results else "未実行",
+            ])
+        columns = ["順位", "GM × PL", "実行数", "スコア", f"{config.TOURNAMENT_CONFIDENCE:.0%}信頼区間", "★GM", "★PL",
+                   "異常応答率", "GM判断で終了", "ターン/セッション", "推定コスト", "結果"]
+        return format_table(columns, rows)
+
+    def summary(self) -> str:
+        return (
+            f"{self.leaderboard()}\n\n"
+            f"回数: {self.rounds} / キャンペーン数: {self.campaigns}（完了 {self.completed}） / 終了理由: {self.stop_reason}\n"
+            f"推定コストの合計: ${self.spend:.4f} / 経過時間: {self.elapsed:.1f}s"
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "campaigns": self.campaigns,
+            "completed": self.completed,
+            "spend_usd": round(self.spend, 6),
+            "stop_reason": self.stop_reason,
+            "elapsed": round(self.elapsed, 3),
+            "weights": config.TOURNAMENT_WEIGHTS,
+            "confidence": config.TOURNAMENT_CONFIDENCE,
+            "ranking": [pairing.to_dict() for pairing in self.ranking()],
+        }
+
+    def save(self) -> str:
+        """logs/tournament_*.json に保存してパスを返す"""
+        path = f"logs/tournament_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        return path
+
+
+def _fmt(value, spec: str) -> str:
+    return "-" if value is None else format(value, spec)
+
+
+async def run_tournament(scenarios: list, gm_models: list, pl_models: list, concurrency: int = 4,
+                         max_sessions: int = 1, budget: float | None = None, out=print) -> TournamentReport:
+    """GMとPLのモデルの全組み合わせでトーナメントを行う
+
+    gm_models / pl_models: (プロバイダー, モデル) のリスト
+    budget: 推定コストの上限（USD。None なら TOURNAMENT_BUDGET_USD、0で無制限）
+    """
+    budget = config.TOURNAMENT_BUDGET_USD if budget is None else budget
+    pairings = [Pairing(tuple(gm), tuple(pl)) for gm in gm_models for pl in pl_models]
+    report = TournamentReport(pairings)
+    start = time.perf_counter()
+    active = list(pairings)
+    runs = config.TOURNAMENT_INITIAL_RUNS
+    report.stop_reason = "回数の上限"
+    for round_num in range(1, config.TOURNAMENT_MAX_ROUNDS + 1):
+        report.rounds = round_num
+        out(f"\n🏁 {round_num}回目: {len(active)}組 × {runs}キャンペーン")
+        for pairing in active:
+            n = runs
+            if budget:
+                # 1キャンペーンあたりの推定コストの実績から、予算に収まる数だけ実行する
+                remaining = budget - report.spend
+                # 失敗したキャンペーンの推定コストは集計されないので、完了したキャンペーンで平均する
+                per_campaign = report.spend / report.completed if report.completed else 0.0
+                if per_campaign:
+                    n = min(n, int(remaining / per_campaign))
+                if remaining <= 0 or n <= 0:
+                    report.stop_reason = "予算の上限"
+                    break
+            with _use_pairing(pairing):
+                batch = await run_batch(scenarios, n, concurrency, max_sessions)
+            pairing.failed += batch.failed
+            for log_path in batch.log_files:
+                pairing.results.append(score_campaign(log_path))
+            report.campaigns += n
+            report.completed += len(batch.log_files)
+            report.spend += batch.total_cost
+            out(f"  {pairing.name}: スコア {_fmt(pairing.mean, '.3f')}（{len(pairing.results)}件）")
+        if report.stop_reason == "予算の上限":
+            break
+        active = select(active, round_num)
+        if len(active) <= 1:
+            report.stop_reason = "1組に絞れた" if active else "採点できた組み合わせがない"
+            break
+        runs *= config.TOURNAMENT_ETA
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def _model(value: str) -> tuple[str, str]:
+    """"プロバイダー/モデル" を (プロバイダー, モデル) にする"""
+    provider, sep, model = value.partition("/")
+    if not sep or not model:
+        raise argparse.ArgumentTypeError(f"プロバイダー/モデル の形式で指定してください: {value}")
+    return provider, model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GM×PLのモデルの組み合わせを比較するトーナメントを行う")
+    parser.add_argument("scenarios", nargs="+", help="シナリオテンプレートのパス")
+    parser.add_argument("--gm", type=_model, action="append", help="GMの プロバイダー/モデル（複数指定可。省略時は TOURNAMENT_GM_MODELS）")
+    parser.add_argument("--pl", type=_model, action="append", help="PLの プロバイダー/モデル（複数指定可。省略時は TOURNAMENT_PL_MODELS）")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="同じ組み合わせのキャンペーンの同時実行数")
+    parser.add_argument("-s", "--sessions", type=int, default=1, help="1キャンペーンあたりのセッション数")
+    parser.add_argument("--budget", type=float, default=None, help="推定コストの上限（USD、0で無制限。省略時は TOURNAMENT_BUDGET_USD）")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_tournament(args.scenarios, args.gm or config.TOURNAMENT_GM_MODELS,
+                                        args.pl or config.TOURNAMENT_PL_MODELS, args.concurrency, args.sessions,
+                                        args.budget))
+    print("=" * 50)
+    print(report.summary())
+    print(f"結果: {report.save()}")
+    print("=" * 50)